@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+余额查询短期缓存
+文件名: BalanceCache.py
+功能: 在余额查询接口前加一层短TTL缓存，并对同一账户的并发查询做合并（single-flight）：
+     同一时刻只有一个线程真正调用接口，其余线程等待并共享这次结果。
+     界面点击、自动查询线程、分账前检查在几秒内查询同一商户时只产生一次接口调用。
+"""
+
+import threading
+import time
+
+
+class _InFlight:
+    """进行中的查询"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlightTTLCache:
+    """带过期时间和并发合并的查询缓存"""
+
+    def __init__(self, ttl_seconds=30, logger=None):
+        """
+        :param ttl_seconds: 缓存有效期（秒），0表示不缓存但仍合并并发查询
+        :param logger: 日志器
+        """
+        self.ttl_seconds = max(0, ttl_seconds)
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (expire_time, value)
+        self._in_flight = {}  # key -> _InFlight
+        self._generations = {}  # key -> 失效次数，加载期间发生失效时不写入缓存
+        self.hits = 0
+        self.coalesced = 0
+        self.loads = 0
+
+    def get_or_load(self, key, loader, cacheable=None):
+        """
+        获取缓存值，未命中时调用loader加载
+        :param key: 缓存键（可哈希）
+        :param loader: 加载函数 loader() -> value
+        :param cacheable: 判断结果是否可缓存的函数 cacheable(value) -> bool，默认都缓存
+        :return: value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = _InFlight()
+                self._in_flight[key] = flight
+                self.loads += 1
+                leader = True
+                generation = self._generations.get(key, 0)
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                if flight.error is None and self.ttl_seconds > 0 \
+                        and self._generations.get(key, 0) == generation \
+                        and (cacheable is None or cacheable(flight.value)):
+                    self._entries[key] = (time.monotonic() + self.ttl_seconds, flight.value)
+            flight.event.set()
+
+        return flight.value
+
+    def invalidate(self, predicate=None):
+        """
+        使缓存失效，正在进行的加载结果也不会再写入缓存
+        :param predicate: 键过滤函数 predicate(key) -> bool，不传则清空全部
+        """
+        with self._lock:
+            keys = set(self._entries) | set(self._in_flight)
+            for key in [k for k in keys if predicate is None or predicate(k)]:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'coalesced': self.coalesced, 'loads': self.loads,
+                    'size': len(self._entries)}
+
+
+# 全局余额缓存（按需创建）
+_balance_cache = None
+_balance_cache_lock = threading.Lock()
+
+
+def get_balance_cache(logger=None):
+    """
+    按BALANCE_CACHE_CONFIG获取全局余额缓存，未启用时返回None
+    缓存键约定为 (调用方, 商户号, 账户类型, 门店号)，不同调用方的响应类型不同，各自独立缓存
+    """
+    global _balance_cache
+    from config import Config
+    cache_config = Config.get_balance_cache_config()
+    if not cache_config.get('ENABLED', True):
+        return None
+    with _balance_cache_lock:
+        if _balance_cache is None:
+            _balance_cache = SingleFlightTTLCache(cache_config.get('TTL_SECONDS', 30), logger=logger)
+        return _balance_cache
+
+
+def invalidate_merchant_balance(merchant_id):
+    """余额发生变动（分账付款方和收款方、挂账充值、提现）后使该商户的缓存失效"""
+    if _balance_cache is not None:
+        _balance_cache.invalidate(lambda key: str(key[1]) == str(merchant_id))
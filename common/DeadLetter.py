@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+失败单据死信队列
+文件名: DeadLetter.py
+功能: 上传、分账、充值、提现中处理失败的单据连同原始单据数据记入死信队列，记录失败类型、重试次数和下次可重试时间。
+     重试任务每次取出少量已到重试时间的单据，按原业务方法重新处理：成功后移出队列，
+     失败则按指数退避推迟下次重试，超过最大重试次数后转为搁置状态，等待人工处理。
+     失败类型:
+       business  - 接口返回业务失败
+       exception - 处理过程异常（网络、超时等）
+       writeback - 接口已成功但数据库回写失败（重试时由幂等台账跳过发送，只补做回写）
+实现: sqlite持久化，内存中保留待处理单据键，成功路径上的移出检查只读一次 PRAGMA data_version，
+     其他进程提交过写入（版本号变化）时才重新加载单据键，不在队列中的单据不执行DELETE。
+     队列按主机存放（运行数据目录下），多主机部署时每台主机的定时服务只重试本机记录的失败单据。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class _PayloadEncoder(json.JSONEncoder):
+    """单据数据中的时间、金额类型编码为带类型标记的对象，重试时原样还原"""
+
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return {'__datetime__': obj.strftime(_TIME_FORMAT)}
+        if isinstance(obj, Decimal):
+            return {'__decimal__': str(obj)}
+        return str(obj)
+
+
+def _decode_payload_object(obj):
+    if '__datetime__' in obj:
+        return datetime.strptime(obj['__datetime__'], _TIME_FORMAT)
+    if '__decimal__' in obj:
+        return Decimal(obj['__decimal__'])
+    return obj
+
+
+class DeadLetterStore:
+    """失败单据死信队列：sqlite持久化 + 内存待处理键集合"""
+
+    PENDING = 'pending'
+    PARKED = 'parked'
+
+    BUSINESS = 'business'
+    EXCEPTION = 'exception'
+    WRITEBACK = 'writeback'
+
+    _CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS dead_letter (
+        stage              TEXT NOT NULL,
+        item_key           TEXT NOT NULL,
+        payload            TEXT NOT NULL,
+        failure_class      TEXT NOT NULL,
+        last_error         TEXT,
+        attempts           INTEGER NOT NULL DEFAULT 0,
+        status             TEXT NOT NULL,
+        next_eligible_time TEXT NOT NULL,
+        create_time        TEXT NOT NULL,
+        update_time        TEXT NOT NULL,
+        PRIMARY KEY (stage, item_key)
+    )
+    """
+
+    def __init__(self, db_path, max_attempts=5, base_delay_minutes=10, max_delay_minutes=720, logger=None):
+        """
+        :param db_path: sqlite文件路径
+        :param max_attempts: 最大重试次数，超过后转为搁置
+        :param base_delay_minutes: 首次重试延迟（分钟），之后每次翻倍
+        :param max_delay_minutes: 重试延迟上限（分钟）
+        :param logger: 日志器
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = max(0.0, float(base_delay_minutes))
+        self.max_delay = max(self.base_delay, float(max_delay_minutes))
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self._CREATE_TABLE)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_dead_letter_due "
+                           "ON dead_letter (status, next_eligible_time)")
+        self._conn.commit()
+
+        self._data_version = None
+        self._keys = set()
+        self._sync_keys()
+        self._log('info', f"📮 死信队列已加载: {len(self._keys)} 条记录 ({db_path})")
+
+    def backoff_minutes(self, attempts):
+        """第attempts次重试失败后的等待时间（分钟）"""
+        return min(self.max_delay, self.base_delay * (2 ** max(0, attempts - 1)))
+
+    def add(self, stage, item_key, payload, failure_class, error=''):
+        """
+        记入一条失败单据；已在队列中的单据只更新失败信息和单据数据，不改变重试次数和下次重试时间
+        :param stage: 业务步骤（upload/split/recharge/withdraw）
+        :param item_key: 单据键
+        :param payload: 原始单据数据，重试时原样传回业务方法
+        :param failure_class: 失败类型（business/exception/writeback）
+        :param error: 失败原因
+        """
+        now = datetime.now()
+        try:
+            payload_json = json.dumps(payload, cls=_PayloadEncoder, ensure_ascii=False)
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO dead_letter (stage, item_key, payload, failure_class, last_error, attempts, status, "
+                    "next_eligible_time, create_time, update_time) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?) "
+                    "ON CONFLICT(stage, item_key) DO UPDATE SET payload = excluded.payload, "
+                    "failure_class = excluded.failure_class, last_error = excluded.last_error, "
+                    "update_time = excluded.update_time",
+                    (stage, str(item_key), payload_json, failure_class, str(error)[:500], self.PENDING,
+                     (now + timedelta(minutes=self.base_delay)).strftime(_TIME_FORMAT),
+                     now.strftime(_TIME_FORMAT), now.strftime(_TIME_FORMAT)))
+                self._conn.commit()
+                self._keys.add((stage, str(item_key)))
+            self._log('warning', f"📮 {stage} 单据 {item_key} 记入死信队列 ({failure_class}): {str(error)[:200]}")
+            return True
+        except Exception as e:
+            self._log('error', f"❌ 死信队列写入失败 {stage}/{item_key}: {str(e)}")
+            return False
+
+    def resolve(self, stage, item_key):
+        """单据已处理成功，移出队列（不在队列中时不访问sqlite）"""
+        key = (stage, str(item_key))
+        if not self.contains(stage, item_key):
+            return False
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM dead_letter WHERE stage = ? AND item_key = ?", key)
+                self._conn.commit()
+                self._keys.discard(key)
+            self._log('info', f"✅ {stage} 单据 {item_key} 已处理成功，移出死信队列")
+            return True
+        except Exception as e:
+            self._log('error', f"❌ 死信队列移出失败 {stage}/{item_key}: {str(e)}")
+            return False
+
+    def contains(self, stage, item_key):
+        """单据是否在队列中（含搁置）"""
+        # 队列文件由多个进程共用，先同步其他进程记入或移出的单据
+        with self._lock:
+            self._sync_keys()
+            return (stage, str(item_key)) in self._keys
+
+    def claim_due(self, limit=20, stages=None):
+        """
+        取出已到重试时间的单据，同时累加重试次数并把下次重试时间推后（进程中途退出也不会立即重复重试）
+        同一队列文件可能被多个进程（定时服务、界面手动重试）同时读取，按读取时的重试次数条件更新，
+        只有更新成功的一方取得该单据
+        :param stages: 只取这些业务步骤的单据，为空时不限
+        :return: [{'stage', 'item_key', 'payload', 'failure_class', 'attempts', 'last_error'}]
+        """
+        now = datetime.now()
+        sql = ("SELECT stage, item_key, payload, failure_class, attempts, last_error FROM dead_letter "
+               "WHERE status = ? AND next_eligible_time <= ?")
+        params = [self.PENDING, now.strftime(_TIME_FORMAT)]
+        if stages:
+            sql += f" AND stage IN ({', '.join('?' for _ in stages)})"
+            params.extend(stages)
+        sql += " ORDER BY next_eligible_time LIMIT ?"
+        params.append(max(1, int(limit)))
+
+        items = []
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            for stage, item_key, payload_json, failure_class, attempts, last_error in rows:
+                next_time = now + timedelta(minutes=self.backoff_minutes(attempts + 1))
+                claimed = self._conn.execute(
+                    "UPDATE dead_letter SET attempts = ?, next_eligible_time = ?, update_time = ? "
+                    "WHERE stage = ? AND item_key = ? AND attempts = ? AND status = ?",
+                    (attempts + 1, next_time.strftime(_TIME_FORMAT), now.strftime(_TIME_FORMAT), stage, item_key,
+                     attempts, self.PENDING)).rowcount
+                self._conn.commit()
+                if claimed != 1:
+                    # 已被其他进程取走
+                    continue
+                attempts += 1
+                items.append({'stage': stage, 'item_key': item_key,
+                              'payload': json.loads(payload_json, object_hook=_decode_payload_object),
+                              'failure_class': failure_class, 'attempts': attempts, 'last_error': last_error})
+        return items
+
+    def mark_failed(self, stage, item_key, attempts, error=None):
+        """
+        重试失败：未达到最大重试次数时保持claim_due推后的重试时间，否则转为搁置
+        :param error: 重试本身抛出的异常（业务方法已自行记录失败原因时为空）
+        """
+        if attempts < self.max_attempts and error is None:
+            return
+        with self._lock:
+            if attempts >= self.max_attempts:
+                self._conn.execute("UPDATE dead_letter SET status = ? WHERE stage = ? AND item_key = ?",
+                                   (self.PARKED, stage, str(item_key)))
+            if error is not None:
+                self._conn.execute("UPDATE dead_letter SET last_error = ? WHERE stage = ? AND item_key = ?",
+                                   (str(error)[:500], stage, str(item_key)))
+            self._conn.commit()
+        if attempts >= self.max_attempts:
+            self._log('error', f"🛑 {stage} 单据 {item_key} 已重试 {attempts} 次仍失败，转为搁置，请人工处理")
+
+    def requeue(self, stage=None, item_key=None):
+        """把搁置的单据重新放回队列（人工处理原因后使用），返回放回条数"""
+        sql = "UPDATE dead_letter SET status = ?, attempts = 0, next_eligible_time = ? WHERE status = ?"
+        params = [self.PENDING, datetime.now().strftime(_TIME_FORMAT), self.PARKED]
+        if stage:
+            sql += " AND stage = ?"
+            params.append(stage)
+        if item_key is not None:
+            sql += " AND item_key = ?"
+            params.append(str(item_key))
+        with self._lock:
+            count = self._conn.execute(sql, params).rowcount
+            self._conn.commit()
+        return count
+
+    def list_items(self, status=None, limit=100):
+        """列出队列中的单据（不含单据数据）"""
+        sql = ("SELECT stage, item_key, failure_class, attempts, status, next_eligible_time, last_error, create_time "
+               "FROM dead_letter")
+        params = []
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        sql += " ORDER BY next_eligible_time LIMIT ?"
+        params.append(max(1, int(limit)))
+        columns = ('stage', 'item_key', 'failure_class', 'attempts', 'status', 'next_eligible_time',
+                   'last_error', 'create_time')
+        with self._lock:
+            return [dict(zip(columns, row)) for row in self._conn.execute(sql, params).fetchall()]
+
+    def stats(self):
+        """按业务步骤、状态统计条数: {(stage, status): count}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, status, COUNT(*) FROM dead_letter GROUP BY stage, status")
+            return {(stage, status): count for stage, status, count in rows.fetchall()}
+
+    def redrive(self, handlers, batch_size=20):
+        """
+        按原业务方法重试一批已到重试时间的单据
+        :param handlers: {stage: handler(payload) -> 是否成功}，没有处理方法的业务步骤不取出
+        :param batch_size: 本批最多重试条数
+        :return: {'total', 'success', 'failed', 'parked'}
+        """
+        summary = {'total': 0, 'success': 0, 'failed': 0, 'parked': 0}
+        items = self.claim_due(batch_size, stages=list(handlers))
+        if not items:
+            return summary
+
+        self._log('info', f"🔁 开始重试 {len(items)} 条死信单据")
+        for item in items:
+            summary['total'] += 1
+            stage, item_key, attempts = item['stage'], item['item_key'], item['attempts']
+            start = time.perf_counter()
+            error = None
+            try:
+                success = bool(handlers[stage](item['payload']))
+            except Exception as e:
+                success = False
+                error = f"重试异常: {str(e)}"
+
+            elapsed = time.perf_counter() - start
+            if success:
+                summary['success'] += 1
+                self.resolve(stage, item_key)
+                self._log('info', f"✅ {stage} 单据 {item_key} 第 {attempts} 次重试成功 ({elapsed:.2f}秒)")
+                continue
+
+            summary['failed'] += 1
+            self.mark_failed(stage, item_key, attempts, error)
+            if attempts >= self.max_attempts:
+                summary['parked'] += 1
+            else:
+                self._log('warning', f"⚠️ {stage} 单据 {item_key} 第 {attempts} 次重试失败，"
+                                     f"{self.backoff_minutes(attempts):.0f} 分钟后再试")
+
+        self._log('info', f"🔁 死信重试完成: 共 {summary['total']} 条，成功 {summary['success']}，"
+                          f"失败 {summary['failed']}（其中转为搁置 {summary['parked']}）")
+        return summary
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _sync_keys(self):
+        """其他连接提交过写入时重新加载单据键（调用方持有锁或在初始化中）"""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._keys = set(self._conn.execute("SELECT stage, item_key FROM dead_letter").fetchall())
+            self._data_version = data_version
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[死信队列] {message}")
+
+
+# 全局死信队列（按需创建）
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_dead_letter_store(logger=None):
+    """按DEAD_LETTER_CONFIG获取全局死信队列，未启用时返回None"""
+    global _store
+    from config import Config
+    dead_letter_config = Config.get_dead_letter_config()
+    if not dead_letter_config.get('ENABLED', True):
+        return None
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = DeadLetterStore(
+                    os.path.join(Config.get_runtime_data_dir(), dead_letter_config.get('DB_FILE', 'dead_letter.db')),
+                    max_attempts=dead_letter_config.get('MAX_ATTEMPTS', 5),
+                    base_delay_minutes=dead_letter_config.get('BASE_DELAY_MINUTES', 10),
+                    max_delay_minutes=dead_letter_config.get('MAX_DELAY_MINUTES', 720),
+                    logger=logger)
+            except Exception as e:
+                if logger:
+                    logger.error(f"[死信队列] ❌ 死信队列初始化失败，本次不记录失败单据: {str(e)}")
+                return None
+        return _store
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+出站资金请求幂等台账
+文件名: IdempotencyLedger.py
+功能: 本地记录已成功发出的资金类请求 (method, order_id, target) 及平台返回的 request_no/trade_no。
+     每次签名发送前先查台账，命中则直接复用上次结果，只补做数据库回写，避免在
+     "接口成功但数据库状态回写失败" 的情况下下次运行重复上传/分账/充值。
+
+实现: sqlite作为持久化存储，内存Bloom过滤器做前置判断——命中Bloom的键才按主键查sqlite。
+     台账文件由守护进程、GUI、死信重放和分片进程共用，其他进程在本进程加载后写入的键
+     不在本进程的Bloom过滤器中，因此Bloom未命中时先按rowid增量加载新写入的键再判断。
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class BloomFilter:
+    """简单的Bloom过滤器"""
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        capacity = max(1, int(capacity))
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class IdempotencyLedger:
+    """幂等台账：sqlite持久化 + 内存Bloom过滤器"""
+
+    _CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS outbound_ledger (
+        ledger_key  TEXT PRIMARY KEY,
+        method      TEXT NOT NULL,
+        order_id    TEXT NOT NULL,
+        target      TEXT NOT NULL,
+        request_no  TEXT,
+        trade_no    TEXT,
+        create_time TEXT NOT NULL
+    )
+    """
+
+    def __init__(self, db_path, bloom_capacity=100000, bloom_error_rate=0.001, logger=None):
+        """
+        :param db_path: sqlite文件路径
+        :param bloom_capacity: Bloom过滤器预计容量
+        :param bloom_error_rate: Bloom过滤器期望误判率
+        :param logger: 日志器
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self._CREATE_TABLE)
+        self._conn.commit()
+
+        self._bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+        self._loaded_rowid = 0
+        with self._lock:
+            count = self._load_new_keys()
+        self._log('info', f"📒 幂等台账已加载: {count} 条记录 ({db_path})")
+
+    @staticmethod
+    def make_key(method, order_id, target=''):
+        return f"{method}|{order_id}|{target or ''}"
+
+    def get(self, method, order_id, target=''):
+        """
+        查询请求是否已成功发送过
+        :return: {'request_no', 'trade_no', 'create_time'}，未发送过返回None
+        """
+        ledger_key = self.make_key(method, order_id, target)
+        with self._lock:
+            if ledger_key not in self._bloom:
+                # 可能是其他进程在本进程加载后写入的
+                self._load_new_keys()
+                if ledger_key not in self._bloom:
+                    return None
+            row = self._conn.execute(
+                "SELECT request_no, trade_no, create_time FROM outbound_ledger WHERE ledger_key = ?",
+                (ledger_key,)).fetchone()
+        if row is None:
+            return None
+        return {'request_no': row[0], 'trade_no': row[1], 'create_time': row[2]}
+
+    def put(self, method, order_id, target='', request_no=None, trade_no=None):
+        """记录一次成功发送的请求"""
+        ledger_key = self.make_key(method, order_id, target)
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO outbound_ledger "
+                    "(ledger_key, method, order_id, target, request_no, trade_no, create_time) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (ledger_key, method, str(order_id), str(target or ''),
+                     request_no, trade_no, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                self._conn.commit()
+            self._bloom.add(ledger_key)
+            return True
+        except Exception as e:
+            self._log('error', f"❌ 幂等台账写入失败 {ledger_key}: {str(e)}")
+            return False
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbound_ledger").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _load_new_keys(self):
+        """把上次加载之后写入（包括其他进程写入）的键加入Bloom过滤器，返回新加载的条数，调用方持有锁"""
+        count = 0
+        for rowid, ledger_key in self._conn.execute(
+                "SELECT rowid, ledger_key FROM outbound_ledger WHERE rowid > ? ORDER BY rowid",
+                (self._loaded_rowid,)):
+            self._bloom.add(ledger_key)
+            self._loaded_rowid = rowid
+            count += 1
+        return count
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[幂等台账] {message}")
+
+
+# 全局台账实例（按需创建）
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_idempotency_ledger(logger=None):
+    """按IDEMPOTENCY_CONFIG获取全局幂等台账，未启用时返回None"""
+    global _ledger
+    from config import Config
+    ledger_config = Config.get_idempotency_config()
+    if not ledger_config.get('ENABLED', True):
+        return None
+    with _ledger_lock:
+        if _ledger is None:
+            try:
+                _ledger = IdempotencyLedger(
+                    os.path.join(Config.get_runtime_data_dir(), ledger_config.get('DB_FILE', 'idempotency.db')),
+                    bloom_capacity=ledger_config.get('BLOOM_CAPACITY', 100000),
+                    bloom_error_rate=ledger_config.get('BLOOM_ERROR_RATE', 0.001),
+                    logger=logger)
+            except Exception as e:
+                if logger:
+                    logger.error(f"[幂等台账] ❌ 幂等台账初始化失败，本次不做发送前检查: {str(e)}")
+                return None
+        return _ledger
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+多阶段作业引擎
+文件名: JobEngine.py
+功能: 把多个业务步骤注册为带类型的阶段（接收一种条目类型，产出另一种条目类型），
+     阶段产出的条目按类型直接投递给下一个阶段的队列，在同一进程内连续流转，
+     不必等下一个阶段的定时任务再从数据库扫描。
+     每个阶段可独立设置工作线程数，也可以从任意阶段注入初始条目（如数据库中已处于中间状态的单据）。
+     传入停止事件时，事件置位后不再投递初始条目，各阶段在条目之间检查事件，未处理的条目直接丢弃。
+"""
+
+import queue
+import threading
+import time
+
+from common.Pipeline import StageStats
+
+# 阶段结束标记
+_STOP = object()
+
+
+class JobStage:
+    """作业阶段定义"""
+
+    def __init__(self, name, handler, accepts, emits=None, workers=1):
+        """
+        :param name: 阶段名称
+        :param handler: 处理函数 handler(item) -> 产出条目的可迭代对象（可为空）
+        :param accepts: 本阶段接收的条目类型
+        :param emits: 本阶段产出的条目类型，None表示终点阶段
+        :param workers: 工作线程数
+        """
+        self.name = name
+        self.handler = handler
+        self.accepts = accepts
+        self.emits = emits
+        self.workers = max(1, int(workers))
+
+
+class JobEngine:
+    """按条目类型路由的多阶段作业引擎"""
+
+    def __init__(self, name='job', queue_size=100, logger=None):
+        """
+        :param name: 引擎名称（用于线程名和日志）
+        :param queue_size: 每个阶段输入队列的容量
+        :param logger: 日志器
+        """
+        self.name = name
+        self.queue_size = max(1, int(queue_size))
+        self.logger = logger
+        self.stages = []
+        self.stage_stats = {}
+        self._routes = {}  # 条目类型 -> 阶段
+
+    def add_stage(self, name, handler, accepts, emits=None, workers=1):
+        """注册一个阶段，支持链式调用；每种条目类型只能由一个阶段接收"""
+        if accepts in self._routes:
+            raise ValueError(f"条目类型 {accepts.__name__} 已由阶段 {self._routes[accepts].name} 接收")
+        stage = JobStage(name, handler, accepts, emits, workers)
+        self.stages.append(stage)
+        self._routes[accepts] = stage
+        return self
+
+    def validate(self):
+        """检查每个阶段的产出类型都有对应的接收阶段"""
+        for stage in self.stages:
+            if stage.emits is not None and stage.emits not in self._routes:
+                raise ValueError(f"阶段 {stage.name} 产出的 {stage.emits.__name__} 没有接收阶段")
+
+    def run(self, seeds, stop_event=None, reset_stats=True):
+        """
+        运行作业，阻塞直到所有条目流转结束
+        :param seeds: 初始条目的可迭代对象，按条目类型投递到对应阶段
+        :param stop_event: 停止事件（如任务租约丢失），置位后剩余条目不再处理
+        :param reset_stats: 是否清零阶段统计，同一作业追加投递条目时传False累计统计
+        :return: 总耗时（秒）
+        """
+        if not self.stages:
+            raise ValueError("作业引擎至少需要一个阶段")
+        self.validate()
+
+        queues = {stage.name: queue.Queue(maxsize=self.queue_size) for stage in self.stages}
+        if reset_stats or not self.stage_stats:
+            self.stage_stats = {stage.name: StageStats(stage.name, stage.workers) for stage in self.stages}
+
+        # 在途条目数（已入队但还未处理完），为0且初始条目投递完毕时作业结束
+        outstanding = 0
+        seeding_done = False
+        skipped = 0
+        state = threading.Condition()
+
+        def dispatch(item, source_stats=None):
+            nonlocal outstanding
+            stage = self._routes.get(type(item))
+            if stage is None:
+                self._log('error', f"❌ 没有阶段接收条目类型 {type(item).__name__}，已丢弃")
+                return
+            with state:
+                outstanding += 1
+            put_start = time.perf_counter()
+            queues[stage.name].put(item)
+            if source_stats is not None:
+                source_stats.record_blocked(time.perf_counter() - put_start)
+
+        def item_done(processed=True):
+            nonlocal outstanding, skipped
+            with state:
+                outstanding -= 1
+                if not processed:
+                    skipped += 1
+                if outstanding == 0 and seeding_done:
+                    state.notify_all()
+
+        def work(stage):
+            stats = self.stage_stats[stage.name]
+            in_queue = queues[stage.name]
+            while True:
+                item = in_queue.get()
+                if item is _STOP:
+                    break
+                if stop_event is not None and stop_event.is_set():
+                    item_done(processed=False)
+                    continue
+
+                item_start = time.perf_counter()
+                try:
+                    outputs = list(stage.handler(item) or [])
+                except Exception as e:
+                    stats.record(time.perf_counter() - item_start, False)
+                    self._log('error', f"❌ 阶段 {stage.name} 处理异常: {str(e)}")
+                    item_done()
+                    continue
+                stats.record(time.perf_counter() - item_start)
+
+                # 产出先入队再标记本条完成，保证在途计数不会提前归零
+                for output in outputs:
+                    if stage.emits is not None and not isinstance(output, stage.emits):
+                        self._log('error', f"❌ 阶段 {stage.name} 产出类型错误: "
+                                           f"{type(output).__name__}，期望 {stage.emits.__name__}")
+                        continue
+                    dispatch(output, stats)
+                item_done()
+
+        run_start = time.perf_counter()
+        threads = []
+        for stage in self.stages:
+            for n in range(stage.workers):
+                thread = threading.Thread(target=work, args=(stage,),
+                                          name=f"{self.name}-{stage.name}-{n + 1}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        seed_count = 0
+        for item in seeds:
+            if stop_event is not None and stop_event.is_set():
+                break
+            dispatch(item)
+            seed_count += 1
+        self._log('info', f"📥 初始条目投递完成: {seed_count} 条")
+
+        with state:
+            seeding_done = True
+            while outstanding > 0:
+                state.wait()
+
+        for stage in self.stages:
+            for _ in range(stage.workers):
+                queues[stage.name].put(_STOP)
+        for thread in threads:
+            thread.join()
+
+        if stop_event is not None and stop_event.is_set():
+            self._log('warning', f"🛑 作业已被停止，{skipped} 个条目未处理，留待下次执行")
+        return time.perf_counter() - run_start
+
+    def get_stage_stats(self):
+        """获取各阶段统计（按注册顺序）"""
+        return [self.stage_stats[stage.name].to_dict() for stage in self.stages if stage.name in self.stage_stats]
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[作业引擎] {self.name}: {message}")
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+定时任务跨主机租约
+文件名: JobLease.py
+功能: 多台主机同时运行定时任务服务（主备）时，每次执行前先在 P_BL_FZ_JOB_LEASE 表中获取该任务的租约，
+     只有持有租约的主机执行，执行期间后台线程定期续约（心跳）。
+     持有者宕机后租约到期，备机在下一次尝试时接管。
+     租约到期时间统一使用数据库时间 CAST(SYSTIMESTAMP AS TIMESTAMP)（数据库服务器本地时间，
+     与TIMESTAMP列直接比较），不受各主机时钟偏差和会话时区影响。
+     续约确认失败（已被接管，或超过租约时长仍无法续约）时置位租约丢失事件，
+     任务在处理相邻两个条目之间检查该事件并停止，避免两台主机同时处理同一批单据。
+"""
+
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from common.OraclePool import pooled_connection
+
+
+class LeaseGuard:
+    """hold()返回的租约持有状态，真值表示是否获取成功"""
+
+    def __init__(self, acquired):
+        self.acquired = acquired
+        self.lost = threading.Event()  # 租约丢失事件，置位后任务应尽快停止
+
+    def __bool__(self):
+        return self.acquired
+
+
+class JobLease:
+    """基于数据库行的定时任务租约"""
+
+    _ACQUIRE_SQL = """
+        MERGE INTO P_BL_FZ_JOB_LEASE t
+        USING (SELECT :job_name AS JOB_NAME FROM dual) s
+        ON (t.JOB_NAME = s.JOB_NAME)
+        WHEN MATCHED THEN UPDATE SET
+            t.OWNER_ID = :owner_id,
+            t.LEASE_UNTIL = CAST(SYSTIMESTAMP AS TIMESTAMP) + NUMTODSINTERVAL(:lease_seconds, 'SECOND'),
+            t.ACQUIRE_TIME = CAST(SYSTIMESTAMP AS TIMESTAMP),
+            t.HEARTBEAT_TIME = CAST(SYSTIMESTAMP AS TIMESTAMP)
+            WHERE t.LEASE_UNTIL < CAST(SYSTIMESTAMP AS TIMESTAMP) OR t.OWNER_ID = :owner_id
+        WHEN NOT MATCHED THEN INSERT (JOB_NAME, OWNER_ID, LEASE_UNTIL, ACQUIRE_TIME, HEARTBEAT_TIME)
+            VALUES (:job_name, :owner_id,
+                    CAST(SYSTIMESTAMP AS TIMESTAMP) + NUMTODSINTERVAL(:lease_seconds, 'SECOND'),
+                    CAST(SYSTIMESTAMP AS TIMESTAMP), CAST(SYSTIMESTAMP AS TIMESTAMP))
+    """
+
+    _RENEW_SQL = """
+        UPDATE P_BL_FZ_JOB_LEASE
+        SET LEASE_UNTIL = CAST(SYSTIMESTAMP AS TIMESTAMP) + NUMTODSINTERVAL(:lease_seconds, 'SECOND'),
+            HEARTBEAT_TIME = CAST(SYSTIMESTAMP AS TIMESTAMP)
+        WHERE JOB_NAME = :job_name AND OWNER_ID = :owner_id
+    """
+
+    _RELEASE_SQL = """
+        UPDATE P_BL_FZ_JOB_LEASE
+        SET LEASE_UNTIL = CAST(SYSTIMESTAMP AS TIMESTAMP) + NUMTODSINTERVAL(:keep_seconds, 'SECOND'),
+            FINISH_TIME = CAST(SYSTIMESTAMP AS TIMESTAMP)
+        WHERE JOB_NAME = :job_name AND OWNER_ID = :owner_id
+    """
+
+    def __init__(self, owner_id=None, lease_seconds=300, heartbeat_seconds=60, logger=None):
+        """
+        :param owner_id: 本机标识，默认 主机名:进程号
+        :param lease_seconds: 租约时长（秒），持有者超过该时间未续约即视为失效
+        :param heartbeat_seconds: 执行期间续约间隔（秒），应明显小于租约时长
+        :param logger: 日志器
+        """
+        self.owner_id = owner_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = max(10, int(lease_seconds))
+        self.heartbeat_seconds = max(1, min(int(heartbeat_seconds), self.lease_seconds // 2))
+        self.logger = logger
+
+    @classmethod
+    def from_config(cls, logger=None):
+        """按JOB_LEASE_CONFIG创建租约，未启用时返回None"""
+        from config import Config
+        lease_config = Config.get_job_lease_config()
+        if not lease_config.get('ENABLED', False):
+            return None
+        return cls(owner_id=lease_config.get('OWNER_ID') or None,
+                   lease_seconds=lease_config.get('LEASE_SECONDS', 300),
+                   heartbeat_seconds=lease_config.get('HEARTBEAT_SECONDS', 60),
+                   logger=logger)
+
+    def acquire(self, job_name):
+        """
+        尝试获取租约（租约空闲、已过期或本来就由本机持有时成功）
+        :return: True=获取成功
+        """
+        try:
+            with pooled_connection(self.logger) as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(self._ACQUIRE_SQL, {'job_name': job_name, 'owner_id': self.owner_id,
+                                                       'lease_seconds': self.lease_seconds})
+                    acquired = cursor.rowcount == 1
+                    connection.commit()
+                except Exception as e:
+                    connection.rollback()
+                    # 两台主机同时首次插入同一任务时，后插入的一方违反主键，视为未获取
+                    if 'ORA-00001' in str(e):
+                        return False
+                    raise
+                finally:
+                    cursor.close()
+            return acquired
+        except Exception as e:
+            self._log('error', f"❌ 获取任务 {job_name} 的租约失败: {str(e)}")
+            return False
+
+    def renew(self, job_name):
+        """续约，返回False表示租约已被其他主机接管，None表示数据库异常、续约结果未知"""
+        return self._update(self._RENEW_SQL, {'job_name': job_name, 'owner_id': self.owner_id,
+                                              'lease_seconds': self.lease_seconds}, '续约')
+
+    def release(self, job_name, keep_seconds=0):
+        """
+        释放租约并记录完成时间
+        :param keep_seconds: 释放后继续保留的秒数，间隔任务用它保持由同一台主机连续执行
+        """
+        return self._update(self._RELEASE_SQL, {'job_name': job_name, 'owner_id': self.owner_id,
+                                                'keep_seconds': max(0, int(keep_seconds))}, '释放')
+
+    def finished_since(self, job_name, since):
+        """
+        任务自since（本机时间）以来是否已由任一主机执行完成
+        FINISH_TIME是数据库时间，since按距今的秒数换算成数据库时间后在SQL中比较，不受主机时钟和时区影响
+        """
+        elapsed_seconds = max(0.0, (datetime.now() - since).total_seconds())
+        try:
+            with pooled_connection(self.logger) as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute("""
+                        SELECT COUNT(*) FROM P_BL_FZ_JOB_LEASE
+                        WHERE JOB_NAME = :job_name
+                          AND FINISH_TIME >= CAST(SYSTIMESTAMP AS TIMESTAMP) - NUMTODSINTERVAL(:elapsed_seconds, 'SECOND')
+                    """, {'job_name': job_name, 'elapsed_seconds': elapsed_seconds})
+                    row = cursor.fetchone()
+                finally:
+                    cursor.close()
+            return bool(row and row[0])
+        except Exception as e:
+            self._log('error', f"❌ 查询任务 {job_name} 的完成时间失败: {str(e)}")
+            return False
+
+    @contextmanager
+    def hold(self, job_name, keep_seconds=0):
+        """
+        在租约保护下执行任务，期间自动续约
+        用法:
+            with lease.hold('结算全流程') as guard:
+                if guard:
+                    run_job(stop_event=guard.lost)
+        """
+        if not self.acquire(job_name):
+            yield LeaseGuard(False)
+            return
+
+        self._log('info', f"🔐 已获取任务 {job_name} 的租约 ({self.owner_id})")
+        guard = LeaseGuard(True)
+        stop_event = threading.Event()
+
+        def heartbeat():
+            last_renewed = time.monotonic()
+            while not stop_event.wait(self.heartbeat_seconds):
+                renewed = self.renew(job_name)
+                if renewed:
+                    last_renewed = time.monotonic()
+                    continue
+                # 已被接管，或数据库异常持续到租约到期，其他主机随时可能接手
+                if renewed is False or time.monotonic() - last_renewed >= self.lease_seconds:
+                    self._log('error', f"❌ 任务 {job_name} 的租约已丢失，通知任务停止处理后续条目")
+                    guard.lost.set()
+                    return
+                self._log('warning', f"⚠️ 任务 {job_name} 的租约续约失败，下个心跳重试")
+
+        heartbeat_thread = threading.Thread(target=heartbeat, name=f"lease-{job_name}", daemon=True)
+        heartbeat_thread.start()
+        try:
+            yield guard
+        finally:
+            stop_event.set()
+            heartbeat_thread.join(timeout=5)
+            self.release(job_name, keep_seconds)
+
+    def _update(self, sql, params, action):
+        """执行租约更新，返回是否更新到本机持有的租约行，数据库异常时返回None"""
+        try:
+            with pooled_connection(self.logger) as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(sql, params)
+                    updated = cursor.rowcount == 1
+                    connection.commit()
+                finally:
+                    cursor.close()
+            return updated
+        except Exception as e:
+            self._log('error', f"❌ 任务 {params['job_name']} 租约{action}失败: {str(e)}")
+            return None
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[任务租约] {message}")
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+定时任务调度器
+文件名: JobScheduler.py
+功能: 在一个调度线程中托管所有定时任务（每日定点任务、固定间隔任务），任务在共享线程池中执行：
+     - 同一任务上一次还未执行完时，本次到期直接跳过，不会重叠执行
+     - 每日任务的最近执行时间持久化到状态文件，服务停机错过执行点后重新启动时在补跑窗口内补执行一次
+     - 间隔任务因执行过久或进程暂停错过的多个周期合并为一次
+     - 传入任务租约（JobLease）时，多台主机中只有获取到租约的一台执行，其余待命接管；
+       注册时 accepts_stop_event=True 的任务以 func(stop_event=...) 调用，租约丢失时该事件被置位
+     不依赖图形界面，可由无界面的服务进程直接使用。
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+
+class ScheduledJob:
+    """定时任务定义"""
+
+    DAILY = 'daily'
+    INTERVAL = 'interval'
+
+    def __init__(self, name, func, kind, hour=0, minute=0, interval_seconds=0,
+                 run_immediately=True, use_lease=True, accepts_stop_event=False):
+        self.name = name
+        self.func = func
+        self.kind = kind
+        self.hour = hour
+        self.minute = minute
+        self.interval_seconds = interval_seconds
+        self.run_immediately = run_immediately
+        self.use_lease = use_lease
+        self.accepts_stop_event = accepts_stop_event
+
+        self.next_run = None
+        self.occurrence = None  # 本次执行对应的计划时间
+        self.last_run = None  # 最近一次执行完成时间
+        self.last_success = None
+        self.running = False
+        self.run_count = 0
+        self.skip_count = 0
+
+    def previous_occurrence(self, now):
+        """每日任务: now之前（含）最近一次的计划执行时间"""
+        scheduled = now.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if scheduled > now:
+            scheduled -= timedelta(days=1)
+        return scheduled
+
+    def compute_next_run(self, now):
+        """计算下一次执行时间（错过的周期不逐个补，合并为一次）"""
+        if self.kind == self.DAILY:
+            return self.previous_occurrence(now) + timedelta(days=1)
+        return now + timedelta(seconds=self.interval_seconds)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'schedule': f"{self.hour:02d}:{self.minute:02d}" if self.kind == self.DAILY
+            else f"每 {self.interval_seconds // 60} 分钟",
+            'next_run': self.next_run.strftime('%Y-%m-%d %H:%M:%S') if self.next_run else None,
+            'last_run': self.last_run.strftime('%Y-%m-%d %H:%M:%S') if self.last_run else None,
+            'last_success': self.last_success,
+            'running': self.running,
+            'run_count': self.run_count,
+            'skip_count': self.skip_count,
+        }
+
+
+class JobScheduler:
+    """单线程调度 + 共享线程池执行的定时任务调度器"""
+
+    def __init__(self, max_workers=4, catch_up_hours=6, state_file=None, lease=None, logger=None):
+        """
+        :param max_workers: 执行任务的共享线程数
+        :param catch_up_hours: 每日任务错过执行点后允许补跑的时间窗口（小时），0表示不补跑
+        :param state_file: 任务执行状态文件路径（JSON），为空时不持久化、不补跑
+        :param lease: 跨主机任务租约（JobLease），为空时本机直接执行
+        :param logger: 日志器
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.catch_up_window = timedelta(hours=max(0, catch_up_hours))
+        self.state_file = state_file
+        self.lease = lease
+        self.logger = logger
+
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    # ===== 任务注册 =====
+    def add_daily_job(self, name, func, hour, minute, accepts_stop_event=False):
+        """
+        注册每日定点任务
+        :param accepts_stop_event: 任务函数是否接收 stop_event 参数（租约丢失时置位，任务应在条目之间检查）
+        """
+        self._add_job(ScheduledJob(name, func, ScheduledJob.DAILY, hour=int(hour), minute=int(minute),
+                                   accepts_stop_event=accepts_stop_event))
+        return self
+
+    def add_interval_job(self, name, func, minutes, run_immediately=True, use_lease=True):
+        """
+        注册固定间隔任务
+        :param run_immediately: 启动后是否立即执行一次
+        :param use_lease: 配置了跨主机租约时是否需要先获取租约（只影响本机的任务设为False）
+        """
+        self._add_job(ScheduledJob(name, func, ScheduledJob.INTERVAL,
+                                   interval_seconds=max(1, int(float(minutes) * 60)),
+                                   run_immediately=run_immediately, use_lease=use_lease))
+        return self
+
+    def _add_job(self, job):
+        with self._lock:
+            if job.name in self.jobs:
+                raise ValueError(f"定时任务 {job.name} 已注册")
+            self.jobs[job.name] = job
+
+    # ===== 启动与停止 =====
+    def start(self):
+        """启动调度线程"""
+        if self._thread and self._thread.is_alive():
+            self._log('warning', "⚠️ 调度器已在运行")
+            return
+
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='scheduled-job')
+        self._plan_initial_runs()
+        self._thread = threading.Thread(target=self._run_loop, name='job-scheduler', daemon=True)
+        self._thread.start()
+        self._log('info', f"🚀 调度器已启动: {len(self.jobs)} 个任务，共享线程 {self.max_workers} 个")
+
+    def stop(self, wait=True):
+        """停止调度；wait=True时等待正在执行的任务结束"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+        self._log('info', "🛑 调度器已停止")
+
+    def run_forever(self):
+        """启动并阻塞当前线程直到stop()被调用"""
+        self.start()
+        while not self._stop_event.wait(1):
+            pass
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def get_status(self):
+        """获取各任务状态"""
+        with self._lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    # ===== 调度 =====
+    def _plan_initial_runs(self):
+        """计算各任务的首次执行时间，每日任务按状态文件判断是否需要补跑"""
+        state = self._load_state()
+        now = datetime.now()
+        with self._lock:
+            for job in self.jobs.values():
+                if job.kind == ScheduledJob.INTERVAL:
+                    job.next_run = now if job.run_immediately else job.compute_next_run(now)
+                    continue
+
+                last_run = state.get(job.name)
+                job.last_run = datetime.strptime(last_run, '%Y-%m-%d %H:%M:%S') if last_run else None
+                missed = job.previous_occurrence(now)
+                if job.last_run is not None and job.last_run < missed and now - missed <= self.catch_up_window:
+                    job.next_run = now
+                    self._log('warning', f"⏪ 任务 {job.name} 错过了 {missed.strftime('%Y-%m-%d %H:%M')} 的执行，立即补跑")
+                else:
+                    job.next_run = job.compute_next_run(now)
+                self._log('info', f"📅 任务 {job.name} 下次执行: {job.next_run.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    def _run_loop(self):
+        while not self._stop_event.is_set():
+            now = datetime.now()
+            with self._lock:
+                due = [job for job in self.jobs.values() if job.next_run and job.next_run <= now]
+                for job in due:
+                    job.next_run = job.compute_next_run(now)
+                    if job.running:
+                        job.skip_count += 1
+                        self._log('warning', f"⏭️ 任务 {job.name} 上一次尚未执行完，本次跳过")
+                        continue
+                    job.running = True
+                    job.occurrence = job.previous_occurrence(now) if job.kind == ScheduledJob.DAILY else now
+                    self._executor.submit(self._execute, job)
+
+                next_wake = min((job.next_run for job in self.jobs.values() if job.next_run), default=None)
+
+            # 最多睡1秒，系统时间调整或休眠唤醒后能及时发现到期任务
+            wait_seconds = 1.0
+            if next_wake is not None:
+                wait_seconds = min(wait_seconds, max(0.0, (next_wake - datetime.now()).total_seconds()))
+            self._stop_event.wait(wait_seconds)
+
+    def _execute(self, job):
+        if self.lease is None or not job.use_lease:
+            self._run_job(job)
+            return
+
+        # 每日任务本次计划时间之后已由其他主机执行完成，不再执行
+        if job.kind == ScheduledJob.DAILY and self.lease.finished_since(job.name, job.occurrence):
+            self._log('info', f"☑️ 任务 {job.name} 已由其他主机执行完成，本机跳过")
+            self._finish(job, True)
+            return
+
+        # 间隔任务执行完后继续保留租约到下一周期之后，保持由同一台主机连续执行
+        keep_seconds = job.interval_seconds + self.lease.lease_seconds if job.kind == ScheduledJob.INTERVAL else 0
+        with self.lease.hold(job.name, keep_seconds) as guard:
+            if guard:
+                self._run_job(job, guard.lost)
+                return
+
+        self._log('info', f"💤 任务 {job.name} 由其他主机执行中，本机待命")
+        with self._lock:
+            job.running = False
+            if job.kind == ScheduledJob.DAILY:
+                # 持有者宕机时租约到期后由本机接管
+                job.next_run = min(job.next_run, datetime.now() + timedelta(seconds=self.lease.lease_seconds))
+
+    def _run_job(self, job, stop_event=None):
+        self._log('info', f"▶️ 开始执行任务 {job.name}")
+        start = time.perf_counter()
+        success = True
+        try:
+            if job.accepts_stop_event:
+                job.func(stop_event=stop_event or threading.Event())
+            else:
+                job.func()
+        except Exception as e:
+            success = False
+            self._log('error', f"❌ 任务 {job.name} 执行异常: {str(e)}")
+        elapsed = time.perf_counter() - start
+        self._finish(job, success)
+
+        status = '完成' if success else '失败'
+        self._log('info', f"⏹️ 任务 {job.name} 执行{status}，耗时 {elapsed:.2f}秒，"
+                          f"下次执行: {job.next_run.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    def _finish(self, job, success):
+        with self._lock:
+            job.running = False
+            job.last_run = datetime.now()
+            job.last_success = success
+            job.run_count += 1
+        if job.kind == ScheduledJob.DAILY:
+            self._save_state()
+
+    # ===== 状态持久化 =====
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            self._log('error', f"❌ 读取调度状态文件失败，本次不补跑: {str(e)}")
+            return {}
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        with self._lock:
+            state = {job.name: job.last_run.strftime('%Y-%m-%d %H:%M:%S')
+                     for job in self.jobs.values() if job.kind == ScheduledJob.DAILY and job.last_run}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+            temp_file = f"{self.state_file}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, self.state_file)
+        except Exception as e:
+            self._log('error', f"❌ 保存调度状态文件失败: {str(e)}")
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[定时调度] {message}")
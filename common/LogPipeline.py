@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+异步日志管道
+文件名: LogPipeline.py
+功能: 业务线程只把日志记录放入有界队列（不阻塞、不做格式化和IO），由单个监听线程统一输出到
+     控制台、按大小/时间滚动并gzip压缩的日志文件，以及GUI等已注册的处理器。
+     控制台或Tk主循环变慢时只会让队列积压，不会拖慢上传、分账等工作线程；
+     队列满时丢弃新的INFO/DEBUG日志并计数，恢复后输出一条丢弃汇总；WARNING及以上级别的日志从不丢弃，
+     队列满时等待监听线程腾出位置。
+     结构化事件等延迟拼接的消息原样入队，由监听线程格式化时才拼接。
+用法: 各模块创建日志器后调用 route_logger(logger)，日志器原有的控制台处理器由管道统一替代，
+     其他处理器（GUI、文件）改由监听线程调用。
+"""
+
+import atexit
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def _gzip_rotator(source, dest):
+    """滚动时把旧日志压缩为 .gz"""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class CompressedRotatingFileHandler(RotatingFileHandler):
+    """按大小和时间滚动、旧文件gzip压缩的日志文件处理器"""
+
+    def __init__(self, filename, max_bytes=0, backup_count=14, rotate_hours=24, encoding='utf-8'):
+        """
+        :param filename: 日志文件路径
+        :param max_bytes: 单个文件上限字节数，0表示不按大小滚动
+        :param backup_count: 保留的压缩文件个数
+        :param rotate_hours: 按时间滚动的间隔（小时），0表示不按时间滚动
+        """
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.namer = lambda name: name + '.gz'
+        self.rotator = _gzip_rotator
+        self.rotate_seconds = max(0, rotate_hours) * 3600
+        self._next_rollover = time.time() + self.rotate_seconds
+
+    def shouldRollover(self, record):
+        if self.rotate_seconds and time.time() >= self._next_rollover:
+            return 1
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._next_rollover = time.time() + self.rotate_seconds
+
+
+class DropCountingQueueHandler(QueueHandler):
+    """非阻塞入队的队列处理器：队列满时丢弃并计数"""
+
+    REPORT_INTERVAL = 10
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._reported = 0
+        self._last_report = None
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # 带%参数的消息在业务线程合并（参数可能随后被修改），无参数的延迟消息（如StructLog事件）原样入队，
+        # 由监听线程格式化时才拼接；时间戳等格式化同样留给监听线程
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            # 告警和错误不丢弃，队列满时阻塞等待
+            self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                return
+        if self.dropped > self._reported and (self._last_report is None or
+                                              time.monotonic() - self._last_report >= self.REPORT_INTERVAL):
+            self._report_drops()
+
+    def _report_drops(self):
+        with self._lock:
+            count, self._reported = self.dropped - self._reported, self.dropped
+            self._last_report = time.monotonic()
+        record = logging.LogRecord('LogPipeline', logging.WARNING, __file__, 0,
+                                   f"[日志管道] ⚠️ 日志队列已满，丢弃 {count} 条日志 (累计 {self.dropped} 条)",
+                                   None, None)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class _Listener(QueueListener):
+    """处理器列表可追加的队列监听器"""
+
+    def add_handler(self, handler):
+        self.handlers = self.handlers + (handler,)
+
+    def enqueue_sentinel(self):
+        # 停止时队列可能是满的，阻塞等待监听线程腾出位置
+        self.queue.put(self._sentinel)
+
+
+class AsyncLogPipeline:
+    """有界队列 + 单监听线程的日志管道"""
+
+    def __init__(self, file_path=None, max_bytes=0, backup_count=14, rotate_hours=24, queue_size=10000,
+                 console=True, level=logging.INFO):
+        """
+        :param file_path: 日志文件路径，为空时不写文件
+        :param max_bytes: 单个日志文件上限字节数
+        :param backup_count: 保留的压缩日志个数
+        :param rotate_hours: 日志文件按时间滚动的间隔（小时）
+        :param queue_size: 队列容量，满时丢弃新日志
+        :param console: 是否输出到控制台
+        :param level: 控制台和文件的输出级别
+        """
+        handlers = []
+        formatter = logging.Formatter(_FORMAT)
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(formatter)
+            console_handler.setLevel(level)
+            handlers.append(console_handler)
+        if file_path:
+            os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+            file_handler = CompressedRotatingFileHandler(file_path, max_bytes, backup_count, rotate_hours)
+            file_handler.setFormatter(formatter)
+            file_handler.setLevel(level)
+            handlers.append(file_handler)
+
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.queue_handler = DropCountingQueueHandler(self.queue)
+        self.listener = _Listener(self.queue, *handlers, respect_handler_level=True)
+        self._handler_keys = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self.listener.start()
+                self._started = True
+
+    def stop(self):
+        """处理完队列中剩余的日志后停止监听线程"""
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+        if self.queue_handler.dropped:
+            print(f"[日志管道] ⚠️ 运行期间共丢弃 {self.queue_handler.dropped} 条日志")
+
+    def add_handler(self, handler, key=None):
+        """
+        追加由监听线程调用的处理器
+        :param key: 去重键，相同键的处理器只注册一次（如多个窗口共用同一个GUI日志队列）
+        """
+        key = key if key is not None else id(handler)
+        with self._lock:
+            if key in self._handler_keys:
+                return False
+            self._handler_keys.add(key)
+            self.listener.add_handler(handler)
+            return True
+
+    def route(self, logger):
+        """
+        日志器改为经队列输出: 标准格式的控制台处理器由管道统一替代，其他处理器移交监听线程
+        """
+        if logger is None or self.queue_handler in logger.handlers:
+            return logger
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            if type(handler) is logging.StreamHandler and handler.formatter is not None \
+                    and handler.formatter._fmt == _FORMAT:
+                continue
+            # GUI处理器按所写入的队列去重
+            target = getattr(handler, 'log_queue', None)
+            self.add_handler(handler, key=id(target) if target is not None else None)
+        logger.addHandler(self.queue_handler)
+        logger.propagate = False
+        return logger
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'capacity': self.queue.maxsize,
+                'dropped': self.queue_handler.dropped, 'handlers': len(self.listener.handlers)}
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_log_pipeline():
+    """按LOG_PIPELINE_CONFIG获取进程内共享的日志管道（首次调用时启动），未启用时返回None"""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            from config import Config
+            from common.ShardRunner import shard_scoped_name
+            pipeline_config = Config.get_log_pipeline_config()
+            if not pipeline_config.get('ENABLED', True):
+                return None
+            file_name = pipeline_config.get('FILE_NAME', '')
+            file_path = os.path.join(Config.get_runtime_data_dir(), 'logs', shard_scoped_name(file_name)) \
+                if file_name else None
+            _pipeline = AsyncLogPipeline(file_path=file_path,
+                                         max_bytes=pipeline_config.get('MAX_BYTES', 0),
+                                         backup_count=pipeline_config.get('BACKUP_COUNT', 14),
+                                         rotate_hours=pipeline_config.get('ROTATE_HOURS', 24),
+                                         queue_size=pipeline_config.get('QUEUE_SIZE', 10000),
+                                         console=pipeline_config.get('CONSOLE', True),
+                                         level=logging.getLevelName(pipeline_config.get('LEVEL', 'INFO')))
+            _pipeline.start()
+            atexit.register(_pipeline.stop)
+        return _pipeline
+
+
+def route_logger(logger):
+    """日志器接入异步日志管道（管道未启用时原样返回）"""
+    try:
+        pipeline = get_log_pipeline()
+    except Exception as e:
+        print(f"[日志管道] ❌ 初始化失败，继续同步输出日志: {str(e)}")
+        return logger
+    if pipeline is not None:
+        pipeline.route(logger)
+    return logger
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+企业微信通知发件箱
+文件名: NotificationOutbox.py
+功能: 业务处理过程中产生的企业微信通知先进入发件箱，批次结束时统一写入 d_qiye_sendmsg：
+     - 同一商户在一个批次内的多条通知合并为一条摘要
+     - 同一商户同类通知在去重窗口内只发送一次，避免每个自动查询周期重复提醒；
+       发送记录保存在运行数据目录下的JSON文件中，重启后去重窗口继续有效
+     - 序列号从数据库序列取（序列由 init_database 创建）；未配置序列时进程内首次发送取一次MAX
+       预留号段，之后在内存中顺序分配，不再每次查询MAX，也不锁表
+     - 整批用一次 executemany 插入、一次提交
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class WeChatOutbox:
+    """企业微信通知发件箱"""
+
+    _INSERT_SQL = """
+        INSERT INTO d_qiye_sendmsg (SERIES, STAFFID, MSG, TYPEID, AGENTID)
+        VALUES (:series, :staff_id, :message, :type_id, :agent_id)
+    """
+
+    def __init__(self, staff_id='GP', type_id='002', agent_id='3091828666',
+                 dedup_window_minutes=60, series_sequence=None, state_file=None, logger=None):
+        """
+        :param staff_id: 接收人
+        :param type_id: 消息类型
+        :param agent_id: 企业微信应用ID
+        :param dedup_window_minutes: 同一商户同类通知的去重窗口（分钟），0表示不去重
+        :param series_sequence: 分配SERIES的数据库序列名，为空时取一次MAX后在内存中顺序分配
+        :param state_file: 发送记录文件路径（JSON），为空时发送记录只保存在内存中
+        :param logger: 日志器
+        """
+        self.staff_id = staff_id
+        self.type_id = type_id
+        self.agent_id = agent_id
+        self.dedup_window = max(0, dedup_window_minutes) * 60
+        self.series_sequence = series_sequence
+        self.state_file = state_file
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        self._pending = {}  # (merchant_id, category) -> [message]
+        self._last_sent = self._load()  # (merchant_id, category) -> 发送时间（时间戳，跨重启有效）
+        self._next_series = None  # 未配置序列时内存中下一个可用的SERIES
+
+    @classmethod
+    def from_config(cls, logger=None):
+        """按WECHAT_NOTIFY_CONFIG创建发件箱"""
+        from config import Config
+        from common.ShardRunner import shard_scoped_name
+        notify_config = Config.get_wechat_notify_config()
+        state_name = notify_config.get('STATE_FILE', 'wechat_notify_sent.json')
+        return cls(staff_id=notify_config.get('STAFF_ID', 'GP'),
+                   type_id=notify_config.get('TYPE_ID', '002'),
+                   agent_id=notify_config.get('AGENT_ID', '3091828666'),
+                   dedup_window_minutes=notify_config.get('DEDUP_WINDOW_MINUTES', 60),
+                   series_sequence=notify_config.get('SERIES_SEQUENCE') or None,
+                   state_file=os.path.join(Config.get_runtime_data_dir(), shard_scoped_name(state_name))
+                   if state_name else None,
+                   logger=logger)
+
+    def enqueue(self, merchant_id, message, category='default'):
+        """
+        加入一条通知
+        :return: True=已加入，False=在去重窗口内已通知过，本条忽略
+        """
+        key = (str(merchant_id), category)
+        with self._lock:
+            last_sent = self._last_sent.get(key)
+            if last_sent is not None and time.time() - last_sent < self.dedup_window:
+                self._log('info', f"🔕 商户 {merchant_id} 的[{category}]通知在去重窗口内已发送过，本次忽略")
+                return False
+            self._pending.setdefault(key, []).append(message)
+            return True
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, connection):
+        """
+        把发件箱中的通知写入数据库
+        :param connection: 数据库连接
+        :return: 写入的消息条数，失败返回0（消息保留在发件箱中，下次flush重试）
+        """
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending = self._pending
+            self._pending = {}
+
+        # 同一商户同类通知合并为一条摘要
+        digests = []
+        for key, messages in pending.items():
+            if len(messages) == 1:
+                digests.append((key, messages[0]))
+            else:
+                body = "\n".join(f"{index}. {message}" for index, message in enumerate(messages, 1))
+                digests.append((key, f"商户 {key[0]} 共 {len(messages)} 条提醒:\n{body}"))
+
+        cursor = None
+        try:
+            cursor = connection.cursor()
+            series_list = self._allocate_series(cursor, len(digests))
+            cursor.executemany(self._INSERT_SQL, [
+                {'series': series, 'staff_id': self.staff_id, 'message': message,
+                 'type_id': self.type_id, 'agent_id': self.agent_id}
+                for series, (_, message) in zip(series_list, digests)
+            ])
+            connection.commit()
+        except Exception as e:
+            self._log('error', f"❌ 发送企业微信消息失败: {str(e)}")
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            # 放回发件箱，下次重试
+            with self._lock:
+                for key, messages in pending.items():
+                    self._pending.setdefault(key, [])[:0] = messages
+            return 0
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+        now = time.time()
+        with self._lock:
+            for key, _ in digests:
+                self._last_sent[key] = now
+            self._save()
+
+        self._log('info', f"📨 企业微信消息已写入: {len(digests)} 条 "
+                          f"(商户: {', '.join(key[0] for key, _ in digests)}, 序列号: {series_list[0]}~{series_list[-1]})")
+        return len(digests)
+
+    def _allocate_series(self, cursor, count):
+        """分配count个SERIES"""
+        if self.series_sequence:
+            cursor.execute(f"SELECT {self.series_sequence}.NEXTVAL FROM dual CONNECT BY LEVEL <= :n", {'n': count})
+            return [row[0] for row in cursor.fetchall()]
+
+        # 未配置序列：进程内只取一次MAX，之后在内存中顺序分配
+        with self._lock:
+            if self._next_series is None:
+                cursor.execute("SELECT NVL(MAX(series), 0) FROM d_qiye_sendmsg")
+                self._next_series = int(cursor.fetchone()[0]) + 1
+            start = self._next_series
+            self._next_series += count
+        return list(range(start, start + count))
+
+    def _load(self):
+        """读取发送记录，丢弃已超出去重窗口的记录"""
+        if not self.state_file or not self.dedup_window or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except Exception as e:
+            self._log('error', f"❌ 读取通知发送记录失败，去重窗口从空记录开始: {str(e)}")
+            return {}
+        now = time.time()
+        return {(item['merchant_id'], item['category']): item['sent_at'] for item in records
+                if now - item['sent_at'] < self.dedup_window}
+
+    def _save(self):
+        """写入发送记录文件（调用方已持有锁），只保留去重窗口内的记录"""
+        if not self.state_file:
+            return
+        now = time.time()
+        records = [{'merchant_id': key[0], 'category': key[1], 'sent_at': sent_at}
+                   for key, sent_at in self._last_sent.items() if now - sent_at < self.dedup_window]
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+            temp_file = f"{self.state_file}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(records, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, self.state_file)
+        except Exception as e:
+            self._log('error', f"❌ 保存通知发送记录失败: {str(e)}")
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[企业微信] {message}")
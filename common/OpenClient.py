@@ -2,6 +2,7 @@
 # -*- coding: UTF-8 -*-
 
 import json
+import logging
 import time
 
 import requests
@@ -11,6 +12,15 @@ from common.RequestType import RequestType
 
 _headers = {'Accept-Encoding': 'identity'}
 
+# 请求生命周期事件
+PRE_BUILD = 'pre_build'  # 构建参数前
+POST_SIGN = 'post_sign'  # 签名完成后，event['params']为已签名参数
+PRE_SEND = 'pre_send'  # 发送前，event['params']为已签名参数
+POST_RECEIVE = 'post_receive'  # 收到响应后，event['response_text']为原始响应，event['elapsed']为耗时（秒）
+SEND_ERROR = 'send_error'  # 发送失败，event['error']为异常，event['elapsed']为耗时（秒）
+POST_PARSE = 'post_parse'  # 解析完成后，event['response']为解析后的响应对象
+HOOK_EVENTS = (PRE_BUILD, POST_SIGN, PRE_SEND, POST_RECEIVE, SEND_ERROR, POST_PARSE)
+
 
 class OpenClient:
     """调用客户端"""
@@ -18,6 +28,9 @@ class OpenClient:
     __private_key = ''
     __url = ''
 
+    # 全局生命周期回调 {事件: [callback]}，所有客户端实例共享
+    _hooks = {}
+
     def __init__(self, app_id, private_key, url):
         """客户端
 
@@ -34,6 +47,42 @@ class OpenClient:
         self.__private_key = private_key
         self.__url = url
 
+    @classmethod
+    def add_hook(cls, event, callback):
+        """注册请求生命周期回调
+
+        :param event: 事件名，HOOK_EVENTS之一
+        :type event: str
+
+        :param callback: callback(event_dict)，event_dict包含 event、method、request、
+                         timestamp（time.monotonic()）及该事件的附加字段；回调异常不影响请求
+        """
+        if event not in HOOK_EVENTS:
+            raise ValueError(f'未知的请求生命周期事件: {event}')
+        cls._hooks = {**cls._hooks, event: cls._hooks.get(event, []) + [callback]}
+
+    @classmethod
+    def remove_hook(cls, event, callback):
+        """注销请求生命周期回调"""
+        callbacks = [c for c in cls._hooks.get(event, []) if c is not callback]
+        hooks = {k: v for k, v in cls._hooks.items() if k != event}
+        if callbacks:
+            hooks[event] = callbacks
+        cls._hooks = hooks
+
+    def _emit(self, event, request, **data):
+        # 未注册回调时不构建事件
+        callbacks = self._hooks.get(event)
+        if not callbacks:
+            return
+        payload = {'event': event, 'method': request.get_method(), 'request': request,
+                   'timestamp': time.monotonic(), **data}
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                pass
+
     def execute(self, request, token=None):
         """
 
@@ -50,38 +99,62 @@ class OpenClient:
         if not isinstance(request_type, RequestType):
             raise Exception('get_request_type返回错误类型，正确方式：RequestTypes.XX')
 
-        params = biz_model.__dict__
-        if request.files is not None:
-            response = self._post_file(request, params, token)
-        elif request_type == RequestTypes.GET:
-            response = self._get(request, params, token)
-        elif request_type == RequestTypes.POST_FORM:
-            response = self._post_form(request, params, token)
-        elif request_type == RequestTypes.POST_JSON:
-            response = self._post_json(request, params, token)
-        elif request_type == RequestTypes.POST_UPLOAD:
-            response = self._post_file(request, params, token)
-        else:
+        if request.files is None and request_type not in (RequestTypes.GET, RequestTypes.POST_FORM,
+                                                          RequestTypes.POST_JSON, RequestTypes.POST_UPLOAD):
             raise Exception('get_request_type设置错误')
 
-        print('response_str: ', response)
-        return self._parse_response(response, request)
+        all_params = self._build_params(request, biz_model.__dict__, token)
+        return self.send_signed(request, all_params)
 
-    def _get(self, request, params, token):
-        all_params = self._build_params(request, params, token)
-        return requests.get(self.__url, all_params, headers=_headers).text
+    def sign_request(self, request, token=None):
+        """构建并签名请求参数，不发送请求（供流水线分阶段使用）
 
-    def _post_form(self, request, params, token):
-        all_params = self._build_params(request, params, token)
-        return requests.post(self.__url, data=all_params, headers=_headers).text
+        :param request: 请求对象，BaseRequest的子类
 
-    def _post_json(self, request, params, token):
-        all_params = self._build_params(request, params, token)
-        return requests.post(self.__url, json=all_params, headers=_headers).text
+        :param token: (Optional) token
+        :type token: str
 
-    def _post_file(self, request, params, token):
-        all_params = self._build_params(request, params, token)
-        return requests.request('POST', self.__url, data=all_params, files=request.files, headers=_headers).text
+        :return: 已签名的请求参数
+        :rtype: dict
+        """
+        return self._build_params(request, request.biz_model.__dict__, token)
+
+    def send_signed(self, request, all_params):
+        """发送已签名的请求参数并解析响应
+
+        :param request: 请求对象，BaseRequest的子类
+
+        :param all_params: sign_request返回的已签名参数
+        :type all_params: dict
+
+        :return: 返回请求结果
+        """
+        request_type = request.get_request_type()
+        if not isinstance(request_type, RequestType):
+            raise Exception('get_request_type返回错误类型，正确方式：RequestTypes.XX')
+
+        self._emit(PRE_SEND, request, params=all_params, url=self.__url)
+        started = time.monotonic()
+        try:
+            if request.files is not None or request_type == RequestTypes.POST_UPLOAD:
+                response = requests.request('POST', self.__url, data=all_params, files=request.files,
+                                            headers=_headers).text
+            elif request_type == RequestTypes.GET:
+                response = requests.get(self.__url, all_params, headers=_headers).text
+            elif request_type == RequestTypes.POST_FORM:
+                response = requests.post(self.__url, data=all_params, headers=_headers).text
+            elif request_type == RequestTypes.POST_JSON:
+                response = requests.post(self.__url, json=all_params, headers=_headers).text
+            else:
+                raise Exception('get_request_type设置错误')
+        except Exception as e:
+            self._emit(SEND_ERROR, request, error=e, elapsed=time.monotonic() - started)
+            raise
+        self._emit(POST_RECEIVE, request, response_text=response, elapsed=time.monotonic() - started)
+
+        result = self._parse_response(response, request)
+        self._emit(POST_PARSE, request, response=result)
+        return result
 
     def _build_params(self, request, params, token):
         """构建所有的请求参数
@@ -98,6 +171,7 @@ class OpenClient:
         :return: 返回请求参数
         :rtype: str
         """
+        self._emit(PRE_BUILD, request, params=params)
         all_params = {
             'app_id': self.__app_id,
             'method': request.get_method(),
@@ -114,9 +188,56 @@ class OpenClient:
         # 构建sign
         sign = SignUtil.create_sign(all_params, self.__private_key, 'RSA2')
         all_params['sign'] = sign
-        print('all_params: ', all_params)
+        self._emit(POST_SIGN, request, params=all_params)
         return all_params
 
     def _parse_response(self, resp, request):
         response_dict = json.loads(resp)
         return request.parse_response(response_dict)
+
+
+# 已注册调试日志回调的日志器 {logger: 注销函数}
+_debug_loggers = {}
+
+
+def attach_debug_logging(logger):
+    """
+    注册把已签名参数（签名已脱敏）、原始响应和发送失败按DEBUG级别输出的回调，返回注销函数
+    同一日志器重复注册时返回已有的注销函数
+    """
+    if logger in _debug_loggers:
+        return _debug_loggers[logger]
+
+    def on_post_sign(event):
+        if logger.isEnabledFor(logging.DEBUG):
+            params = {**event['params'], 'sign': '***'}
+            logger.debug(f"[开放平台] {event['method']} 请求参数: {params}")
+
+    def on_post_receive(event):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[开放平台] {event['method']} 响应 ({event['elapsed'] * 1000:.0f}ms): "
+                         f"{event['response_text']}")
+
+    def on_send_error(event):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[开放平台] {event['method']} 请求失败 ({event['elapsed'] * 1000:.0f}ms): "
+                         f"{event['error']}")
+
+    hooks = ((POST_SIGN, on_post_sign), (POST_RECEIVE, on_post_receive), (SEND_ERROR, on_send_error))
+    for event, callback in hooks:
+        OpenClient.add_hook(event, callback)
+
+    def detach():
+        for hook_event, hook_callback in hooks:
+            OpenClient.remove_hook(hook_event, hook_callback)
+        _debug_loggers.pop(logger, None)
+
+    _debug_loggers[logger] = detach
+    return detach
+
+
+def enable_debug_logging(logger):
+    """日志器开启了DEBUG级别时注册调试日志回调（各业务入口创建日志器后调用），未开启时不注册"""
+    if logger is not None and logger.isEnabledFor(logging.DEBUG):
+        attach_debug_logging(logger)
+    return logger
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Oracle连接池
+文件名: OraclePool.py
+功能: 按DB_POOL_CONFIG创建进程内共享的cx_Oracle会话池，批量回写等高频数据库操作从池中借用连接，
+     避免每次操作都重新建立TCP连接和登录会话。连接池不可用时自动退回直接建立连接。
+"""
+
+import threading
+from contextlib import contextmanager
+
+import cx_Oracle
+
+from common.SqlStats import instrument_connection
+
+# 全局连接池（按需创建）
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_oracle_pool(logger=None):
+    """按DB_POOL_CONFIG获取全局会话池，未启用或创建失败时返回None"""
+    global _pool
+    from config import Config
+    pool_config = Config.get_db_pool_config()
+    if not pool_config.get('ENABLED', True):
+        return None
+    with _pool_lock:
+        if _pool is None:
+            user, password, dsn = Config.get_db_connection_info()
+            try:
+                _pool = cx_Oracle.SessionPool(
+                    user=user,
+                    password=password,
+                    dsn=dsn,
+                    min=pool_config.get('MIN', 1),
+                    max=pool_config.get('MAX', 4),
+                    increment=pool_config.get('INCREMENT', 1),
+                    threaded=True,
+                    encoding="UTF-8"
+                )
+                if logger:
+                    logger.info(f"[连接池] ✅ Oracle会话池已创建: {dsn} "
+                                f"(min={pool_config.get('MIN', 1)}, max={pool_config.get('MAX', 4)})")
+            except Exception as e:
+                if logger:
+                    logger.error(f"[连接池] ❌ Oracle会话池创建失败，退回直接连接: {str(e)}")
+                return None
+        return _pool
+
+
+@contextmanager
+def pooled_connection(logger=None, instrument=True):
+    """
+    借用一个数据库连接，退出时归还连接池（无连接池时关闭直连）
+    :param instrument: 是否计入SQL执行统计（采集执行计划等内部语句传False）
+    用法:
+        with pooled_connection(self.logger) as connection:
+            cursor = connection.cursor()
+    """
+    pool = get_oracle_pool(logger)
+    if pool is not None:
+        connection = pool.acquire()
+    else:
+        from config import Config
+        user, password, dsn = Config.get_db_connection_info()
+        connection = cx_Oracle.connect(user=user, password=password, dsn=dsn, encoding="UTF-8")
+
+    try:
+        yield instrument_connection(connection, logger) if instrument else connection
+    finally:
+        if pool is not None:
+            pool.release(connection)
+        else:
+            connection.close()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+分阶段流水线引擎
+文件名: Pipeline.py
+功能: 用有界队列把多个处理阶段串联起来，每个阶段可配置独立的工作线程数；
+     下游处理不过来时上游put会阻塞（背压），整体吞吐由最慢的阶段决定。
+     同时统计每个阶段的处理耗时和阻塞等待时间，便于定位瓶颈。
+"""
+
+import queue
+import threading
+import time
+
+# 阶段结束标记
+_STOP = object()
+
+
+class StageStats:
+    """单个阶段的耗时统计"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.blocked_time = 0.0  # 因下游队列已满而阻塞的时间（背压）
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, success=True):
+        with self._lock:
+            if success:
+                self.processed += 1
+            else:
+                self.failed += 1
+            self.total_time += elapsed
+            if elapsed > self.max_time:
+                self.max_time = elapsed
+
+    def record_blocked(self, elapsed):
+        with self._lock:
+            self.blocked_time += elapsed
+
+    def to_dict(self):
+        count = self.processed + self.failed
+        return {
+            'name': self.name,
+            'workers': self.workers,
+            'processed': self.processed,
+            'failed': self.failed,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / count if count else 0.0,
+            'max_time': self.max_time,
+            'blocked_time': self.blocked_time,
+            # 按工作线程数折算后的单笔耗时，数值最大的阶段即瓶颈
+            'effective_time': self.total_time / count / self.workers if count else 0.0,
+        }
+
+
+class PipelineStage:
+    """流水线阶段定义"""
+
+    def __init__(self, name, handler, workers=1):
+        """
+        :param name: 阶段名称
+        :param handler: 处理函数 handler(item) -> item，返回None表示该条目在本阶段结束
+        :param workers: 工作线程数
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+
+
+class StagePipeline:
+    """分阶段生产者/消费者流水线"""
+
+    def __init__(self, name='pipeline', queue_size=100, logger=None):
+        """
+        :param name: 流水线名称（用于线程名和日志）
+        :param queue_size: 阶段间队列容量，队列满时上游阻塞
+        :param logger: 日志器
+        """
+        self.name = name
+        self.queue_size = max(1, int(queue_size))
+        self.logger = logger
+        self.stages = []
+        self.source_stats = None
+        self.stage_stats = []
+        self._callback_lock = threading.Lock()
+
+    def add_stage(self, name, handler, workers=1):
+        """追加一个处理阶段，支持链式调用"""
+        self.stages.append(PipelineStage(name, handler, workers))
+        return self
+
+    def run(self, source, on_complete=None, on_error=None, source_name='读取'):
+        """
+        运行流水线，阻塞直到所有条目处理完成
+        :param source: 可迭代的数据源（列表或生成器），其迭代耗时计入读取阶段
+        :param on_complete: 条目走完全部阶段后的回调 on_complete(item)
+        :param on_error: 阶段处理异常时的回调 on_error(stage_name, item, exception)
+        :param source_name: 数据源阶段名称
+        :return: 总耗时（秒）
+        """
+        if not self.stages:
+            raise ValueError("流水线至少需要一个处理阶段")
+
+        self.source_stats = StageStats(source_name, 1)
+        self.stage_stats = [StageStats(stage.name, stage.workers) for stage in self.stages]
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+
+        def put(q, item, stats):
+            put_start = time.perf_counter()
+            q.put(item)
+            stats.record_blocked(time.perf_counter() - put_start)
+
+        def feed():
+            iterator = iter(source)
+            while True:
+                item_start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    self.source_stats.record(time.perf_counter() - item_start, False)
+                    self._log_error(f"数据源读取异常，停止投递: {str(e)}")
+                    break
+                self.source_stats.record(time.perf_counter() - item_start)
+                put(queues[0], item, self.source_stats)
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_STOP)
+
+        def work(index):
+            stage = self.stages[index]
+            stats = self.stage_stats[index]
+            in_queue = queues[index]
+            out_queue = queues[index + 1] if index + 1 < len(queues) else None
+
+            while True:
+                item = in_queue.get()
+                if item is _STOP:
+                    break
+
+                item_start = time.perf_counter()
+                try:
+                    result = stage.handler(item)
+                except Exception as e:
+                    stats.record(time.perf_counter() - item_start, False)
+                    self._callback(on_error, stage.name, item, e)
+                    continue
+                stats.record(time.perf_counter() - item_start)
+
+                if result is None:
+                    continue
+                if out_queue is not None:
+                    put(out_queue, result, stats)
+                else:
+                    self._callback(on_complete, result)
+
+            # 本阶段最后一个退出的线程负责通知下游结束
+            with remaining_lock:
+                remaining[index] -= 1
+                last_worker = remaining[index] == 0
+            if last_worker and out_queue is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    out_queue.put(_STOP)
+
+        run_start = time.perf_counter()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(target=work, args=(index,),
+                                          name=f"{self.name}-{stage.name}-{n + 1}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        feed()
+        for thread in threads:
+            thread.join()
+
+        return time.perf_counter() - run_start
+
+    def get_stage_stats(self):
+        """获取各阶段统计（含数据源阶段）"""
+        stats = []
+        if self.source_stats:
+            stats.append(self.source_stats.to_dict())
+        stats.extend(s.to_dict() for s in self.stage_stats)
+        return stats
+
+    def get_bottleneck(self):
+        """获取按线程数折算后耗时最长的阶段名称"""
+        stats = self.get_stage_stats()
+        if not stats:
+            return None
+        return max(stats, key=lambda s: s['effective_time'])['name']
+
+    def _callback(self, func, *args):
+        """串行执行回调，调用方无需自行加锁"""
+        if func is None:
+            return
+        with self._callback_lock:
+            try:
+                func(*args)
+            except Exception as e:
+                self._log_error(f"回调执行异常: {str(e)}")
+
+    def _log_error(self, message):
+        if self.logger:
+            self.logger.error(f"[流水线] ❌ {self.name}: {message}")
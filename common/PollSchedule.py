@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+自适应轮询计划
+文件名: PollSchedule.py
+功能: 为每个待确认的业务键（如银行流水号）单独维护下次查询时间，用最小堆按到期时间取出。
+     仍在处理中的键按指数退避逐渐拉长查询间隔，查到终态后立即退出轮询，
+     使单位时间内的接口调用量只与真正未结算的交易数相关，而不是与整个待处理集合相关。
+"""
+
+import heapq
+import itertools
+import time
+
+
+class AdaptivePollSchedule:
+    """按到期时间排序的逐键轮询计划（指数退避）"""
+
+    def __init__(self, initial_delay=30, max_delay=1800, backoff_factor=2.0):
+        """
+        :param initial_delay: 首次退避间隔（秒）
+        :param max_delay: 退避间隔上限（秒）
+        :param backoff_factor: 退避倍数
+        """
+        self.initial_delay = max(1, initial_delay)
+        self.max_delay = max(self.initial_delay, max_delay)
+        self.backoff_factor = max(1.0, backoff_factor)
+
+        self._heap = []  # (due_time, seq, key)
+        self._entries = {}  # key -> {'due', 'attempts', 'payload'}
+        self._retired = set()  # 已查到终态的键，数据库扫描再次出现时不重新纳入
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sync(self, payloads):
+        """
+        与最新的待处理集合同步：新出现的键立即到期，已不在集合中的键移除
+        :param payloads: {key: payload}
+        :return: 新加入的键数量
+        """
+        added = 0
+        now = time.monotonic()
+        for key, payload in payloads.items():
+            if key in self._retired:
+                continue
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = {'due': now, 'attempts': 0, 'payload': payload}
+                heapq.heappush(self._heap, (now, next(self._seq), key))
+                added += 1
+            else:
+                entry['payload'] = payload
+
+        for key in [k for k in self._entries if k not in payloads]:
+            del self._entries[key]
+        # 已退出轮询的键只需保留仍在待处理集合中的部分
+        self._retired &= set(payloads)
+        return added
+
+    def add(self, key, payload):
+        """
+        加入单个刚查询过、仍未到终态的键，首次在initial_delay秒后到期
+        :return: 是否新加入（已在轮询中或已退出轮询的键不重复加入）
+        """
+        if key in self._entries or key in self._retired:
+            return False
+        due = time.monotonic() + self.initial_delay
+        self._entries[key] = {'due': due, 'attempts': 1, 'payload': payload}
+        heapq.heappush(self._heap, (due, next(self._seq), key))
+        return True
+
+    def pop_due(self, now=None):
+        """取出所有已到期的 (key, payload, attempts)"""
+        now = time.monotonic() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_time, _, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            # 已移除或已被重新排期的旧堆节点直接丢弃
+            if entry is None or entry['due'] != due_time:
+                continue
+            due.append((key, entry['payload'], entry['attempts']))
+        return due
+
+    def backoff(self, key):
+        """键仍未到终态：按指数退避重新排期，返回下次查询间隔（秒）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        delay = min(self.max_delay, self.initial_delay * (self.backoff_factor ** entry['attempts']))
+        entry['attempts'] += 1
+        entry['due'] = time.monotonic() + delay
+        heapq.heappush(self._heap, (entry['due'], next(self._seq), key))
+        return delay
+
+    def retire(self, key):
+        """键已到终态，退出轮询"""
+        self._entries.pop(key, None)
+        self._retired.add(key)
+
+    def seconds_until_next(self):
+        """距离最近一个到期键的秒数，无待轮询键时返回None"""
+        while self._heap:
+            due_time, _, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is None or entry['due'] != due_time:
+                heapq.heappop(self._heap)
+                continue
+            return max(0.0, due_time - time.monotonic())
+        return None
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+待处理单据优先级排序
+文件名: Priority.py
+功能: 批量处理前按可配置规则给待处理单据打分，分数高的先发送，运行窗口有限时先处理最有价值的单据:
+     - 金额: 金额越大分数越高（超过封顶金额按封顶计）
+     - 等待时长: 支付时间越早分数越高（超过封顶小时数按封顶计）
+     - 商户等级: 按配置的商户等级分加分
+     - 下游等待: 下游步骤正在等待该单据时加分（如整单只差这几行上传即可分账、商户有提现单在等待资金）
+     各项先归一化到0~1再乘以权重求和；分数相同的保持数据库查询原有顺序。
+     配置了单次运行上限时，超出上限的低分单据本次不处理，留待下次运行。
+"""
+
+from datetime import datetime
+
+_TIME_FORMATS = ('%Y%m%d%H%M%S', '%Y-%m-%d %H:%M:%S')
+
+# 提现单已审核但可用资金不足，等待分账/充值入账的商户
+_AWAITING_WITHDRAW_SQL = """
+    SELECT DISTINCT MERCHANTNO FROM p_bl_draw_hd
+    WHERE CASE WHEN IS_UNPAID_FEE = 'Y' AND STATUS = '003' AND CANCELSIGN = 'N' THEN 'Y' END = 'Y'
+    AND AVAILABLE_FEE < WITHDRAW_AMOUNT
+"""
+
+
+class PriorityScorer:
+    """按金额、等待时长、商户等级、下游等待给单据打分排序"""
+
+    def __init__(self, amount_weight=1.0, amount_cap=1000000, age_weight=1.0, age_cap_hours=72,
+                 tier_weight=1.0, merchant_tiers=None, downstream_weight=2.0, max_items_per_run=0, logger=None):
+        """
+        :param amount_weight: 金额权重
+        :param amount_cap: 金额封顶（分）
+        :param age_weight: 等待时长权重
+        :param age_cap_hours: 等待时长封顶（小时）
+        :param tier_weight: 商户等级权重
+        :param merchant_tiers: {商户号: 等级分(0~1)}，未配置的商户为0
+        :param downstream_weight: 下游等待权重
+        :param max_items_per_run: 单次运行最多处理条数，0表示不限
+        :param logger: 日志器
+        """
+        self.amount_weight = amount_weight
+        self.amount_cap = max(1, amount_cap)
+        self.age_weight = age_weight
+        self.age_cap_hours = max(1, age_cap_hours)
+        self.tier_weight = tier_weight
+        self.merchant_tiers = {str(k): v for k, v in (merchant_tiers or {}).items()}
+        self.downstream_weight = downstream_weight
+        self.max_items_per_run = max(0, int(max_items_per_run or 0))
+        self.logger = logger
+
+    @classmethod
+    def from_config(cls, logger=None):
+        """按PRIORITY_CONFIG创建，未启用时返回None"""
+        from config import Config
+        priority_config = Config.get_priority_config()
+        if not priority_config.get('ENABLED', True):
+            return None
+        return cls(amount_weight=priority_config.get('AMOUNT_WEIGHT', 1.0),
+                   amount_cap=priority_config.get('AMOUNT_CAP_FEN', 1000000),
+                   age_weight=priority_config.get('AGE_WEIGHT', 1.0),
+                   age_cap_hours=priority_config.get('AGE_CAP_HOURS', 72),
+                   tier_weight=priority_config.get('TIER_WEIGHT', 1.0),
+                   merchant_tiers=priority_config.get('MERCHANT_TIERS', {}),
+                   downstream_weight=priority_config.get('DOWNSTREAM_WEIGHT', 2.0),
+                   max_items_per_run=priority_config.get('MAX_ITEMS_PER_RUN', 0),
+                   logger=logger)
+
+    def score(self, amount=None, paytime=None, merchant_id=None, downstream_waiting=False, now=None):
+        """计算单据分数"""
+        total = 0.0
+        if amount:
+            total += self.amount_weight * min(float(amount) / self.amount_cap, 1.0)
+        age_hours = self._age_hours(paytime, now or datetime.now())
+        if age_hours is not None:
+            total += self.age_weight * min(age_hours / self.age_cap_hours, 1.0)
+        if merchant_id is not None:
+            total += self.tier_weight * float(self.merchant_tiers.get(str(merchant_id), 0))
+        if downstream_waiting:
+            total += self.downstream_weight
+        return total
+
+    def order(self, items, amount=None, paytime=None, merchant=None, waiting=None, label=''):
+        """
+        按分数从高到低排序，超过单次运行上限的部分不返回
+        :param items: 待处理单据列表
+        :param amount: amount(item) -> 金额（分）
+        :param paytime: paytime(item) -> 支付时间（datetime或字符串）
+        :param merchant: merchant(item) -> 商户号
+        :param waiting: waiting(item) -> 下游是否在等待该单据
+        :param label: 日志前缀中的业务名称
+        :return: (本次处理的单据, 延后到下次运行的单据)
+        """
+        if not items:
+            return [], []
+        now = datetime.now()
+        scored = []
+        for index, item in enumerate(items):
+            value = self.score(amount(item) if amount else None,
+                               paytime(item) if paytime else None,
+                               merchant(item) if merchant else None,
+                               waiting(item) if waiting else False,
+                               now)
+            scored.append((-value, index, item))
+        scored.sort(key=lambda entry: (entry[0], entry[1]))
+
+        ordered = [item for _, _, item in scored]
+        selected, deferred = ordered, []
+        if self.max_items_per_run and len(ordered) > self.max_items_per_run:
+            selected, deferred = ordered[:self.max_items_per_run], ordered[self.max_items_per_run:]
+
+        waiting_count = sum(1 for item in selected if waiting and waiting(item))
+        self._log('info', f"📶 {label}按优先级排序 {len(items)} 条: 最高分 {-scored[0][0]:.2f}，"
+                          f"最低分 {-scored[-1][0]:.2f}，下游等待 {waiting_count} 条")
+        if deferred:
+            self._log('warning', f"⏳ {label}超过单次运行上限 {self.max_items_per_run} 条，"
+                                 f"{len(deferred)} 条低优先级单据延后到下次运行")
+        return selected, deferred
+
+    @staticmethod
+    def _age_hours(paytime, now):
+        if not paytime:
+            return None
+        if not hasattr(paytime, 'strftime'):
+            text = str(paytime).strip()
+            for time_format in _TIME_FORMATS:
+                try:
+                    paytime = datetime.strptime(text[:len(now.strftime(time_format))], time_format)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+        return max(0.0, (now - paytime).total_seconds() / 3600)
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[优先级] {message}")
+
+
+def get_merchants_awaiting_withdraw(logger=None):
+    """查询有提现单在等待资金入账的商户号，查询失败时返回空集合（不影响排序以外的处理）"""
+    from common.OraclePool import pooled_connection
+    try:
+        with pooled_connection(logger) as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(_AWAITING_WITHDRAW_SQL)
+                return {str(row[0]) for row in cursor.fetchall() if row[0]}
+            finally:
+                cursor.close()
+    except Exception as e:
+        if logger:
+            logger.error(f"[优先级] ❌ 查询等待提现的商户失败，本次不按下游等待加分: {str(e)}")
+        return set()
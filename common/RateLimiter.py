@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+接口调用限流
+文件名: RateLimiter.py
+功能: 令牌桶限流。按接口方法名取全局共享的限流器，同一进程内所有调用该接口的线程（定时查询、批量查询、对账）
+     共用一个桶，合计调用速率不超过配置的每秒次数；允许短时突发不超过桶容量。
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """令牌桶限流器（线程安全）"""
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: 每秒补充的令牌数（即平均每秒允许的调用次数）
+        :param burst: 桶容量（允许的突发调用次数），默认与rate相同
+        """
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst if burst is not None else rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """取出令牌，令牌不足时阻塞等待，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+# 按接口方法名共享的限流器
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(method):
+    """按RATE_LIMIT_CONFIG获取接口方法的全局限流器，未启用或该接口不限流时返回None"""
+    from config import Config
+    limit_config = Config.get_rate_limit_config()
+    if not limit_config.get('ENABLED', True):
+        return None
+    rate = limit_config.get('METHOD_QPS', {}).get(method, limit_config.get('DEFAULT_QPS', 0))
+    if not rate or rate <= 0:
+        return None
+    with _limiters_lock:
+        if method not in _limiters:
+            _limiters[method] = TokenBucket(rate, limit_config.get('BURST') or None)
+        return _limiters[method]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+本地与平台状态批量对账
+文件名: Reconciler.py
+功能: 流式读取本地记录（不一次性载入内存），在线程池中并发查询平台对应记录（查询受接口限流控制），
+     两侧按规范化的键和字段比对。所有记录按键哈希分到固定数量的分区，分区分别统计差异，
+     不一致的记录按分区写入差异文件，一次扫描即可定位全部差异。
+
+差异类型:
+    missing     平台不存在该记录
+    mismatch    两侧都存在但字段不一致（差异文件中列出不一致的字段）
+    unverified  平台查询失败，本次无法确认
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+
+class _Partition:
+    """单个哈希分区的统计"""
+
+    def __init__(self, index):
+        self.index = index
+        self.rows = 0
+        self.differences = {'missing': 0, 'mismatch': 0, 'unverified': 0}
+
+    def to_dict(self):
+        return {
+            'partition': self.index,
+            'rows': self.rows,
+            'consistent': not any(self.differences.values()),
+            'differences': dict(self.differences),
+        }
+
+
+class Reconciler:
+    """按哈希分区并发比对本地记录和平台记录"""
+
+    MISSING = 'missing'
+    MISMATCH = 'mismatch'
+    UNVERIFIED = 'unverified'
+
+    def __init__(self, name, partitions=64, workers=8, output_dir=None, logger=None):
+        """
+        :param name: 对账任务名（用于输出目录）
+        :param partitions: 哈希分区数
+        :param workers: 并发查询平台的线程数（实际速率另受接口限流控制）
+        :param output_dir: 差异文件输出目录，默认取运行数据目录下的 reconcile/
+        :param logger: 日志器
+        """
+        if output_dir is None:
+            from config import Config
+            output_dir = os.path.join(Config.get_runtime_data_dir(), 'reconcile')
+        self.name = name
+        self.partitions = max(1, int(partitions))
+        self.workers = max(1, int(workers))
+        self.output_dir = output_dir
+        self.logger = logger
+
+    def partition_of(self, key):
+        return zlib.crc32(str(key).encode('utf-8')) % self.partitions
+
+    def run(self, local_records, fetch_remote, compare, progress_interval=1000):
+        """
+        执行对账
+        :param local_records: 本地记录迭代器，产出 (key, local_fields)；key须已规范化
+        :param fetch_remote: fetch_remote(key, local_fields) -> 平台记录的规范化字段dict；平台不存在返回None；
+                             查询失败抛出异常（记为unverified）
+        :param compare: compare(local_fields, remote_fields) -> 不一致的字段名列表（空列表表示一致）
+        :param progress_interval: 每比对多少条输出一次进度
+        :return: 汇总dict（同时写入输出目录的 summary.json）
+        """
+        run_dir = os.path.join(self.output_dir, f"{self.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(run_dir, exist_ok=True)
+        partitions = [_Partition(index) for index in range(self.partitions)]
+        diff_files = {}
+        lock = threading.Lock()
+        counters = {'rows': 0, 'consistent': 0}
+        start = time.perf_counter()
+
+        def check(key, local_fields):
+            try:
+                remote_fields = fetch_remote(key, local_fields)
+            except Exception as e:
+                return key, local_fields, None, self.UNVERIFIED, str(e)
+            if remote_fields is None:
+                return key, local_fields, None, self.MISSING, None
+            fields = compare(local_fields, remote_fields)
+            return key, local_fields, remote_fields, self.MISMATCH if fields else None, fields
+
+        def record(outcome):
+            key, local_fields, remote_fields, kind, detail = outcome
+            partition = partitions[self.partition_of(key)]
+            with lock:
+                partition.rows += 1
+                counters['rows'] += 1
+                if kind is None:
+                    counters['consistent'] += 1
+                else:
+                    partition.differences[kind] += 1
+                    diff_file = diff_files.get(partition.index)
+                    if diff_file is None:
+                        diff_file = diff_files[partition.index] = open(
+                            os.path.join(run_dir, f"part-{partition.index:03d}.jsonl"), 'a', encoding='utf-8')
+                    diff_file.write(json.dumps({'key': key, 'type': kind, 'local': local_fields,
+                                                'remote': remote_fields, 'detail': detail},
+                                               ensure_ascii=False, default=str) + "\n")
+                if counters['rows'] % progress_interval == 0:
+                    self._log('info', f"📈 已比对 {counters['rows']} 条，一致 {counters['consistent']} 条，"
+                                      f"{counters['rows'] / max(time.perf_counter() - start, 0.001):.1f} 条/秒")
+
+        self._log('info', f"🔎 开始对账 {self.name}: 分区 {self.partitions} 个，并发 {self.workers}，输出目录 {run_dir}")
+        try:
+            # 在途查询数有上限，本地记录按需读取，不会把整张表读入内存
+            max_in_flight = self.workers * 4
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"reconcile-{self.name}") as executor:
+                in_flight = set()
+                for key, local_fields in local_records:
+                    if len(in_flight) >= max_in_flight:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            record(future.result())
+                    in_flight.add(executor.submit(check, key, local_fields))
+                for future in in_flight:
+                    record(future.result())
+        finally:
+            for diff_file in diff_files.values():
+                diff_file.close()
+
+        elapsed = time.perf_counter() - start
+        totals = {kind: sum(p.differences[kind] for p in partitions) for kind in (self.MISSING, self.MISMATCH,
+                                                                                   self.UNVERIFIED)}
+        summary = {
+            'name': self.name,
+            'rows': counters['rows'],
+            'consistent': counters['consistent'],
+            'differences': totals,
+            'inconsistent_partitions': [p.index for p in partitions if not p.to_dict()['consistent']],
+            'elapsed': elapsed,
+            'output_dir': run_dir,
+            'partitions': [p.to_dict() for p in partitions],
+        }
+        with open(os.path.join(run_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        self._log('info', f"🏁 对账完成 {self.name}: 共 {counters['rows']} 条，一致 {counters['consistent']} 条，"
+                          f"平台缺失 {totals[self.MISSING]}，不一致 {totals[self.MISMATCH]}，"
+                          f"无法确认 {totals[self.UNVERIFIED]}；不一致分区 {len(summary['inconsistent_partitions'])}/"
+                          f"{self.partitions}，耗时 {elapsed:.2f}秒")
+        return summary
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[批量对账] {message}")
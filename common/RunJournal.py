@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+批量任务运行日志（断点续跑）
+文件名: RunJournal.py
+功能: 以追加写的JSON Lines文件记录每笔业务在一次批量运行中的状态流转
+     (claimed → sent → acked → written_back / failed)，按组flush+fsync落盘；
+     sent 在发出请求前立即落盘，保证中断后续跑能识别出结果不确定的条目。
+     进程中途退出后，下次运行先回放日志，从中断处继续，而不是重新扫描和规划整个待处理集合。
+
+状态说明:
+    claimed       已纳入本次运行（记录业务数据，续跑时无需再查库）
+    sent          即将发出接口请求（此后中断则结果不确定，不能自动重发）
+    acked         接口已返回（记录回写所需的结果）
+    written_back  数据库状态已回写，终态
+    failed        处理失败并已记录，终态
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from common.ShardRunner import shard_scoped_name
+
+
+class RunJournal:
+    """追加写运行日志，支持分组fsync和断点续跑"""
+
+    CLAIMED = 'claimed'
+    SENT = 'sent'
+    ACKED = 'acked'
+    WRITTEN_BACK = 'written_back'
+    FAILED = 'failed'
+
+    TERMINAL_STATES = (WRITTEN_BACK, FAILED)
+
+    def __init__(self, job_name, journal_dir=None, fsync_batch=20, fsync_interval=1.0, logger=None):
+        """
+        :param job_name: 任务名，每个任务一个日志文件
+        :param journal_dir: 日志目录，默认取配置中的运行数据目录
+        :param fsync_batch: 累计多少条记录强制落盘一次
+        :param fsync_interval: 距上次落盘超过多少秒强制落盘
+        :param logger: 日志器
+        """
+        if journal_dir is None:
+            from config import Config
+            journal_dir = os.path.join(Config.get_runtime_data_dir(), 'journal')
+        os.makedirs(journal_dir, exist_ok=True)
+
+        self.job_name = job_name
+        self.path = os.path.join(journal_dir, f"{job_name}.jsonl")
+        self.fsync_batch = max(1, int(fsync_batch))
+        self.fsync_interval = fsync_interval
+        self.logger = logger
+        self.run_id = None
+
+        self._file = None
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    @classmethod
+    def from_config(cls, job_name, logger=None):
+        """按RUN_JOURNAL_CONFIG创建运行日志，未启用时返回None"""
+        from config import Config
+        journal_config = Config.get_run_journal_config()
+        if not journal_config.get('ENABLED', True):
+            return None
+        # 分片运行时每个分片进程各写一份日志
+        return cls(shard_scoped_name(job_name),
+                   fsync_batch=journal_config.get('FSYNC_BATCH', 20),
+                   fsync_interval=journal_config.get('FSYNC_INTERVAL', 1.0),
+                   logger=logger)
+
+    # ===== 回放 =====
+    def resume_run(self):
+        """
+        回放日志，若上一次运行未正常结束则恢复其run_id并返回各条目最新状态
+        :return: {key: {'state', 'data', 'extra'}}，日志不存在或上次运行已结束时返回None
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        run_id = None
+        entries = {}
+        finished = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 最后一行可能在写入时被中断，忽略残缺记录
+                        continue
+
+                    event = record.get('event')
+                    if event == 'run_start':
+                        run_id = record.get('run_id')
+                        entries = {}
+                        finished = False
+                    elif event == 'run_end':
+                        finished = True
+                    elif event == 'item' and record.get('run_id') == run_id:
+                        key = record['key']
+                        entry = entries.setdefault(key, {'state': None, 'data': None, 'extra': {}})
+                        entry['state'] = record['state']
+                        if record.get('data') is not None:
+                            entry['data'] = record['data']
+                        if record.get('extra'):
+                            entry['extra'].update(record['extra'])
+        except Exception as e:
+            self._log('error', f"❌ 回放运行日志失败: {str(e)}")
+            return None
+
+        if run_id is None or finished:
+            return None
+
+        self.run_id = run_id
+        self._open()
+        self._log('info', f"♻️ 发现未完成的运行 {run_id}，共 {len(entries)} 条记录，准备续跑")
+        return entries
+
+    # ===== 写入 =====
+    def start_run(self, items, key_func):
+        """
+        开始新的运行，清空旧日志并把本次所有条目记为claimed
+        :param items: 本次待处理的业务数据列表
+        :param key_func: 从业务数据生成唯一键的函数
+        :return: run_id
+        """
+        self.close()
+        self.run_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self._open(truncate=True)
+        self._write({'event': 'run_start', 'run_id': self.run_id, 'job': self.job_name, 'total': len(items)})
+        for item in items:
+            self._write({'event': 'item', 'run_id': self.run_id, 'key': key_func(item),
+                         'state': self.CLAIMED, 'data': item})
+        self.flush(force=True)
+        return self.run_id
+
+    def record(self, key, state, **extra):
+        """记录条目状态流转，extra中可附带续跑所需的结果信息；sent状态立即落盘"""
+        if self._file is None:
+            return
+        record = {'event': 'item', 'run_id': self.run_id, 'key': key, 'state': state}
+        if extra:
+            record['extra'] = extra
+        self._write(record)
+        # sent未落盘就发出请求时，进程中断后会被当作未发送而重发
+        self.flush(force=state == self.SENT)
+
+    def finish_run(self):
+        """标记本次运行正常结束"""
+        if self._file is None:
+            return
+        self._write({'event': 'run_end', 'run_id': self.run_id})
+        self.flush(force=True)
+        self.close()
+
+    def flush(self, force=False):
+        """按组落盘：累计条数或时间间隔达到阈值时flush+fsync"""
+        with self._lock:
+            if self._file is None or self._unsynced == 0:
+                return
+            if not force and self._unsynced < self.fsync_batch \
+                    and time.monotonic() - self._last_sync < self.fsync_interval:
+                return
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except Exception as e:
+                self._log('error', f"❌ 运行日志落盘失败: {str(e)}")
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        self.flush(force=True)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # ===== 内部方法 =====
+    def _open(self, truncate=False):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'w' if truncate else 'a', encoding='utf-8')
+
+    def _write(self, record):
+        record['ts'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._unsynced += 1
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[运行日志] {self.job_name}: {message}")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+按哈希分片的多进程批量执行
+文件名: ShardRunner.py
+功能: 启动N个工作进程，每个进程只处理商户号哈希落在本分片的单据，各自创建OpenClient、签名器和数据库连接，
+     签名、JSON序列化等CPU工作分散到多个核上，不受单进程GIL限制；分片之间按商户号互不重叠，无需相互协调。
+     父进程只汇总各分片上报的进度和结果。
+     工作进程内的运行日志、增量水位等本地状态文件按分片各用一份（文件名带分片后缀），互不覆盖。
+     分片条件由 shard_predicate() 生成后拼入查询SQL，各分片只从数据库读取本分片的行；
+     Python端的 shard_of() 与SQL使用同一哈希（商户号MD5的前8位十六进制取模），两边结果一致。
+实现: 工作进程以spawn方式启动（cx_Oracle/OCI和已有线程在fork后不可安全使用），进度和结果经队列回传父进程。
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+# 当前进程所属分片 (index, count)，非分片运行时为None
+_current_shard = None
+
+
+def shard_of(key, shard_count):
+    """按键的稳定哈希计算分片号（不受PYTHONHASHSEED影响，与shard_predicate在数据库中的计算一致）"""
+    return int(hashlib.md5(str(key).encode('utf-8')).hexdigest()[:8], 16) % shard_count
+
+
+def shard_predicate(key_expression):
+    """
+    当前分片的SQL过滤条件，与shard_of使用同一哈希（STANDARD_HASH需要Oracle 12c及以上）
+    :param key_expression: 分片键的SQL表达式，如 hd.ymshanghuhao
+    :return: (条件, 绑定参数)，非分片运行时返回 (None, {})
+    """
+    if _current_shard is None:
+        return None, {}
+    index, count = _current_shard
+    condition = (f"MOD(TO_NUMBER(SUBSTR(RAWTOHEX(STANDARD_HASH(TO_CHAR({key_expression}), 'MD5')), 1, 8), "
+                 f"'XXXXXXXX'), :shard_count) = :shard_index")
+    return condition, {'shard_count': count, 'shard_index': index}
+
+
+def set_current_shard(index, count):
+    global _current_shard
+    _current_shard = (int(index), int(count))
+
+
+def get_current_shard():
+    """当前进程所属分片 (index, count)，非分片运行时返回None"""
+    return _current_shard
+
+
+def in_current_shard(key):
+    """单据是否属于当前进程的分片（非分片运行时总是True）"""
+    if _current_shard is None:
+        return True
+    index, count = _current_shard
+    return shard_of(key, count) == index
+
+
+def shard_scoped_name(name):
+    """
+    分片运行时给本地状态文件名/任务名加分片后缀，非分片运行时原样返回
+    例: watermarks.json → watermarks.shard0of4.json，order_upload → order_upload.shard0of4
+    """
+    if _current_shard is None:
+        return name
+    suffix = f"shard{_current_shard[0]}of{_current_shard[1]}"
+    base, ext = os.path.splitext(name)
+    return f"{base}.{suffix}{ext}"
+
+
+def _shard_logger(index, count):
+    from common.LogPipeline import route_logger
+    logger = logging.getLogger(f"分片{index + 1}/{count}")
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    # 工作进程内的日志经本进程的异步管道输出
+    return route_logger(logger)
+
+
+def _worker_main(task, index, count, result_queue):
+    """工作进程入口：设定分片后执行任务，进度和结果经队列回传"""
+    set_current_shard(index, count)
+    logger = _shard_logger(index, count)
+
+    def progress(done, total, message=''):
+        result_queue.put(('progress', index, done, total, message))
+
+    try:
+        summary = task(logger, progress)
+        result_queue.put(('done', index, summary, None))
+    except Exception as e:
+        import traceback
+        logger.error(f"[分片执行] ❌ 分片任务异常: {str(e)}\n{traceback.format_exc()}")
+        result_queue.put(('done', index, None, str(e)))
+
+
+class ShardedBatchRunner:
+    """按商户号哈希分片的多进程批量执行器"""
+
+    def __init__(self, task, shard_count=None, progress_interval=5, logger=None):
+        """
+        :param task: 分片任务 task(logger, progress) -> 结果汇总dict；须为模块级函数（spawn时按名称导入）
+                     progress(done, total, message) 上报本分片进度
+        :param shard_count: 分片（工作进程）数，为空时取CPU核数
+        :param progress_interval: 父进程输出汇总进度的间隔（秒）
+        :param logger: 日志器
+        """
+        self.task = task
+        self.shard_count = max(1, int(shard_count or os.cpu_count() or 1))
+        self.progress_interval = progress_interval
+        self.logger = logger
+
+    def run(self):
+        """
+        启动全部分片并等待结束
+        :return: {'shards': {index: 结果汇总}, 'errors': {index: 错误信息}, 'totals': 各分片数值字段之和, 'elapsed'}
+        """
+        context = multiprocessing.get_context('spawn')
+        result_queue = context.Queue()
+        processes = {}
+        for index in range(self.shard_count):
+            process = context.Process(target=_worker_main, name=f"shard-{index}",
+                                      args=(self.task, index, self.shard_count, result_queue))
+            process.start()
+            processes[index] = process
+        self._log('info', f"🚀 已启动 {self.shard_count} 个分片进程")
+
+        start = time.perf_counter()
+        progress = {index: (0, 0) for index in processes}
+        shards, errors = {}, {}
+        last_report = start
+        while len(shards) + len(errors) < self.shard_count:
+            try:
+                message = result_queue.get(timeout=1)
+            except queue.Empty:
+                message = None
+
+            if message is not None:
+                kind, index = message[0], message[1]
+                if kind == 'progress':
+                    progress[index] = (message[2], message[3])
+                elif message[3] is None:
+                    shards[index] = message[2] or {}
+                    self._log('info', f"✅ 分片{index + 1} 完成: {shards[index]}")
+                else:
+                    errors[index] = message[3]
+                    self._log('error', f"❌ 分片{index + 1} 失败: {message[3]}")
+
+            # 未回传结果就退出的进程（被杀、崩溃）按失败计
+            for index, process in processes.items():
+                if index not in shards and index not in errors and not process.is_alive() \
+                        and process.exitcode not in (None, 0) and result_queue.empty():
+                    errors[index] = f"进程异常退出 (exitcode={process.exitcode})"
+                    self._log('error', f"❌ 分片{index + 1} {errors[index]}")
+
+            now = time.perf_counter()
+            if now - last_report >= self.progress_interval:
+                last_report = now
+                done = sum(d for d, _ in progress.values())
+                total = sum(t for _, t in progress.values())
+                detail = ', '.join(f"{i + 1}:{d}/{t}" for i, (d, t) in sorted(progress.items()))
+                self._log('info', f"📈 总进度 {done}/{total} (完成分片 {len(shards)}/{self.shard_count}; {detail})")
+
+        for process in processes.values():
+            process.join(timeout=10)
+
+        totals = {}
+        for summary in shards.values():
+            for key, value in summary.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[key] = totals.get(key, 0) + value
+
+        elapsed = time.perf_counter() - start
+        self._log('info', f"🏁 分片执行结束: 成功 {len(shards)} 个，失败 {len(errors)} 个，"
+                          f"耗时 {elapsed:.2f}秒，合计 {totals}")
+        return {'shards': shards, 'errors': errors, 'totals': totals, 'elapsed': elapsed}
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[分片执行] {message}")
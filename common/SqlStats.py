@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+SQL执行统计
+文件名: SqlStats.py
+功能: 包装数据库连接和游标，按语句指纹（去掉字面量、压缩空白后的SQL）汇总:
+     执行次数、执行耗时、取数耗时、返回行数、往返次数（按arraysize估算）。
+     开启执行计划采集后，执行耗时超过阈值的语句自动用 EXPLAIN PLAN 记录一次执行计划；
+     EXPLAIN PLAN 会写入PLAN_TABLE，因此在从连接池另借的连接上执行并单独提交，不混入业务事务。
+     汇总结果可按总耗时排序输出为表格，用于判断优先优化哪条查询。
+"""
+
+import re
+import threading
+import time
+from collections import deque
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+_EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT', 'MERGE')
+
+
+def fingerprint(sql):
+    """语句指纹：字面量替换为?，空白压缩为一个空格，统一大写"""
+    text = _STRING_LITERAL.sub('?', sql)
+    text = _NUMBER_LITERAL.sub('?', text)
+    return _WHITESPACE.sub(' ', text).strip().upper()
+
+
+class _StatementStats:
+    """单个语句指纹的统计"""
+
+    def __init__(self, sql):
+        self.sql = _WHITESPACE.sub(' ', sql).strip()
+        self.executions = 0
+        self.exec_time = 0.0
+        self.max_exec_time = 0.0
+        self.fetch_time = 0.0
+        self.rows = 0
+        self.round_trips = 0
+        self.errors = 0
+        self.plan = None
+
+    def to_dict(self):
+        return {
+            'sql': self.sql,
+            'executions': self.executions,
+            'exec_time': self.exec_time,
+            'avg_exec_time': self.exec_time / self.executions if self.executions else 0.0,
+            'max_exec_time': self.max_exec_time,
+            'fetch_time': self.fetch_time,
+            'total_time': self.exec_time + self.fetch_time,
+            'rows': self.rows,
+            'round_trips': self.round_trips,
+            'errors': self.errors,
+            'plan': self.plan,
+        }
+
+
+class SqlStatsRegistry:
+    """SQL执行统计汇总"""
+
+    def __init__(self, slow_threshold_ms=500, capture_plans=False, logger=None):
+        """
+        :param slow_threshold_ms: 慢语句阈值（毫秒）
+        :param capture_plans: 是否为慢语句采集执行计划（每个指纹只采集一次）
+        :param logger: 日志器
+        """
+        self.slow_threshold = max(0, slow_threshold_ms) / 1000.0
+        self.capture_plans = capture_plans
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record_execute(self, sql, elapsed, rows=0, error=False):
+        """记录一次执行，返回是否需要采集执行计划"""
+        key = fingerprint(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _StatementStats(sql)
+            stats.executions += 1
+            stats.exec_time += elapsed
+            stats.max_exec_time = max(stats.max_exec_time, elapsed)
+            stats.rows += rows
+            stats.round_trips += 1
+            if error:
+                stats.errors += 1
+            need_plan = (self.capture_plans and not error and stats.plan is None
+                         and elapsed >= self.slow_threshold)
+        if elapsed >= self.slow_threshold and self.logger:
+            self.logger.warning(f"[SQL统计] 🐢 慢语句 {elapsed * 1000:.0f}ms: {stats.sql[:200]}")
+        return need_plan
+
+    def record_fetch(self, sql, elapsed, rows, round_trips):
+        key = fingerprint(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                return
+            stats.fetch_time += elapsed
+            stats.rows += rows
+            stats.round_trips += round_trips
+
+    def record_plan(self, sql, plan):
+        with self._lock:
+            stats = self._stats.get(fingerprint(sql))
+            if stats is not None:
+                stats.plan = plan
+
+    def summary(self, order_by='total_time', limit=None):
+        """按指定字段倒序返回各语句统计"""
+        with self._lock:
+            rows = [stats.to_dict() for stats in self._stats.values()]
+        rows.sort(key=lambda row: row.get(order_by, 0), reverse=True)
+        return rows[:limit] if limit else rows
+
+    def format_summary(self, order_by='total_time', limit=20):
+        """输出汇总表格"""
+        rows = self.summary(order_by, limit)
+        lines = [f"{'次数':>6} {'总耗时(s)':>10} {'平均(ms)':>9} {'最大(ms)':>9} {'取数(s)':>8} "
+                 f"{'行数':>8} {'往返':>6} {'错误':>4}  SQL"]
+        for row in rows:
+            lines.append(f"{row['executions']:>6} {row['total_time']:>10.3f} {row['avg_exec_time'] * 1000:>9.1f} "
+                         f"{row['max_exec_time'] * 1000:>9.1f} {row['fetch_time']:>8.3f} {row['rows']:>8} "
+                         f"{row['round_trips']:>6} {row['errors']:>4}  {row['sql'][:120]}")
+            if row['plan']:
+                lines.extend(f"{'':>8}{plan_line}" for plan_line in row['plan'].splitlines())
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class InstrumentedCursor:
+    """记录执行和取数统计的游标包装，其余属性和方法透传给原游标"""
+
+    def __init__(self, cursor, registry):
+        self._cursor = cursor
+        self._registry = registry
+        self._sql = None
+        self._buffer = deque()  # 逐行迭代时已取回、尚未返回的行
+
+    def execute(self, sql, *args, **kwargs):
+        self._sql = sql
+        self._buffer.clear()
+        start = time.perf_counter()
+        try:
+            result = self._cursor.execute(sql, *args, **kwargs)
+        except Exception:
+            self._registry.record_execute(sql, time.perf_counter() - start, error=True)
+            raise
+        elapsed = time.perf_counter() - start
+        # DML的影响行数在执行时就确定，查询的行数在取数时累计
+        rows = self._cursor.rowcount if self._cursor.description is None else 0
+        if self._registry.record_execute(sql, elapsed, rows=max(0, rows or 0)):
+            self._capture_plan(sql, args[0] if args else kwargs or None)
+        return result
+
+    def executemany(self, sql, parameters, *args, **kwargs):
+        self._sql = sql
+        self._buffer.clear()
+        start = time.perf_counter()
+        try:
+            result = self._cursor.executemany(sql, parameters, *args, **kwargs)
+        except Exception:
+            self._registry.record_execute(sql, time.perf_counter() - start, error=True)
+            raise
+        self._registry.record_execute(sql, time.perf_counter() - start, rows=max(0, self._cursor.rowcount or 0))
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(self._cursor.fetchone, lambda row: 1 if row is not None else 0)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._timed_fetch(lambda: self._cursor.fetchmany(*args, **kwargs), len)
+
+    def fetchall(self):
+        return self._timed_fetch(self._cursor.fetchall, len)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # 逐行迭代时每次按arraysize取一批（一次往返），不一次性把结果集全部读入内存
+        if not self._buffer:
+            arraysize = getattr(self._cursor, 'arraysize', 100) or 100
+            self._buffer.extend(self._timed_fetch(lambda: self._cursor.fetchmany(arraysize), len, round_trips=1))
+            if not self._buffer:
+                raise StopIteration
+        return self._buffer.popleft()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _timed_fetch(self, fetch, count_rows, round_trips=None):
+        start = time.perf_counter()
+        result = fetch()
+        elapsed = time.perf_counter() - start
+        if self._sql is not None:
+            rows = count_rows(result)
+            if round_trips is None:
+                # 驱动每次往返取arraysize行，按行数估算往返次数
+                arraysize = getattr(self._cursor, 'arraysize', 100) or 100
+                round_trips = rows // arraysize + 1
+            self._registry.record_fetch(self._sql, elapsed, rows, round_trips)
+        return result
+
+    def _capture_plan(self, sql, params):
+        """
+        为慢语句采集执行计划（失败不影响业务）
+        在单独借用的连接上执行并提交，PLAN_TABLE的写入不进入业务连接上尚未提交的事务
+        """
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return
+        # OraclePool依赖本模块，在使用时再导入
+        from common.OraclePool import pooled_connection
+        statement_id = f"SQLSTATS_{threading.get_ident() % 100000000}"
+        try:
+            with pooled_connection(instrument=False) as plan_connection:
+                plan_cursor = plan_connection.cursor()
+                try:
+                    plan_cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {sql}", params or {})
+                    plan_cursor.execute("SELECT PLAN_TABLE_OUTPUT FROM TABLE(DBMS_XPLAN.DISPLAY('PLAN_TABLE', :sid, 'BASIC ROWS COST'))",
+                                        {'sid': statement_id})
+                    plan = "\n".join(row[0] for row in plan_cursor.fetchall())
+                    plan_cursor.execute("DELETE FROM PLAN_TABLE WHERE STATEMENT_ID = :sid", {'sid': statement_id})
+                    plan_connection.commit()
+                finally:
+                    plan_cursor.close()
+            self._registry.record_plan(sql, plan)
+        except Exception as e:
+            self._registry.record_plan(sql, f"(执行计划采集失败: {str(e)})")
+
+
+class InstrumentedConnection:
+    """返回InstrumentedCursor的连接包装，其余属性和方法透传给原连接"""
+
+    def __init__(self, connection, registry):
+        self._connection = connection
+        self._registry = registry
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs), self._registry)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __enter__(self):
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._connection.__exit__(*exc_info)
+
+
+# 全局统计（按需创建）
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_sql_stats(logger=None):
+    """按SQL_STATS_CONFIG获取全局SQL统计，未启用时返回None"""
+    global _registry
+    from config import Config
+    stats_config = Config.get_sql_stats_config()
+    if not stats_config.get('ENABLED', True):
+        return None
+    with _registry_lock:
+        if _registry is None:
+            _registry = SqlStatsRegistry(slow_threshold_ms=stats_config.get('SLOW_THRESHOLD_MS', 500),
+                                         capture_plans=stats_config.get('CAPTURE_PLANS', False),
+                                         logger=logger)
+        return _registry
+
+
+def instrument_connection(connection, logger=None):
+    """给数据库连接加上SQL执行统计，未启用或连接为空时原样返回"""
+    if connection is None or isinstance(connection, InstrumentedConnection):
+        return connection
+    registry = get_sql_stats(logger)
+    if registry is None:
+        return connection
+    return InstrumentedConnection(connection, registry)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+结构化事件日志
+文件名: StructLog.py
+功能: 每个处理步骤输出一条紧凑的 key=value 事件日志，代替逐字段多行输出:
+     - 先按日志级别判断，级别被过滤时不做任何格式化
+     - 字段值可以传入函数（无参可调用对象），只有日志真正输出时才求值
+     - 消息在处理器格式化时才拼接，被处理器级别或过滤器丢弃的日志同样不拼接；
+       经异步日志管道输出时在监听线程拼接，字段值（包括函数）在记录日志后不应再修改
+     - 完整请求/响应等大段内容放在 dump()，只在DEBUG级别开启时才序列化
+"""
+
+import json
+import logging
+
+
+class _Event:
+    """延迟拼接的事件消息，logging在格式化时调用str()"""
+
+    __slots__ = ('prefix', 'name', 'fields')
+
+    def __init__(self, prefix, name, fields):
+        self.prefix = prefix
+        self.name = name
+        self.fields = fields
+
+    def __str__(self):
+        parts = [f"{self.prefix} {self.name}"]
+        for key, value in self.fields.items():
+            if callable(value):
+                value = value()
+            if value is None or value == '':
+                continue
+            text = str(value)
+            if ' ' in text:
+                text = json.dumps(text, ensure_ascii=False)
+            parts.append(f"{key}={text}")
+        return ' '.join(parts)
+
+
+class _Dump:
+    """延迟序列化的大段内容"""
+
+    __slots__ = ('prefix', 'title', 'payload')
+
+    def __init__(self, prefix, title, payload):
+        self.prefix = prefix
+        self.title = title
+        self.payload = payload
+
+    def __str__(self):
+        payload = self.payload() if callable(self.payload) else self.payload
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload, indent=2, ensure_ascii=False, default=str)
+        return f"{self.prefix} {self.title}:\n{payload}"
+
+
+class StructLogger:
+    """按级别过滤、延迟求值的结构化事件日志器"""
+
+    def __init__(self, logger, prefix):
+        """
+        :param logger: 底层logging日志器
+        :param prefix: 日志前缀，如 [订单上传]
+        """
+        self.logger = logger
+        self.prefix = prefix
+
+    def enabled(self, level=logging.DEBUG):
+        return self.logger is not None and self.logger.isEnabledFor(level)
+
+    def event(self, name, level=logging.INFO, **fields):
+        """输出一条事件日志：name 后接 key=value 字段，值为None或空串的字段省略"""
+        if self.enabled(level):
+            self.logger.log(level, _Event(self.prefix, name, fields))
+
+    def info(self, name, **fields):
+        self.event(name, logging.INFO, **fields)
+
+    def warning(self, name, **fields):
+        self.event(name, logging.WARNING, **fields)
+
+    def error(self, name, **fields):
+        self.event(name, logging.ERROR, **fields)
+
+    def debug(self, name, **fields):
+        self.event(name, logging.DEBUG, **fields)
+
+    def dump(self, title, payload):
+        """DEBUG级别输出大段内容（dict/list按缩进JSON输出），payload可以是返回内容的函数"""
+        if self.enabled(logging.DEBUG):
+            self.logger.debug(_Dump(self.prefix, title, payload))
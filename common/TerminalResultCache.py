@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+终态查询结果缓存
+文件名: TerminalResultCache.py
+功能: 持久化缓存已到终态（不会再变化）的接口查询结果，按业务键（如银行流水号）索引。
+     查询前先查缓存，命中则直接返回，数据库回写失败的交易下次重试回写时无需再调用接口。
+     条目数超过上限时按写入时间淘汰最旧的一批。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class TerminalResultCache:
+    """终态结果缓存：sqlite持久化，条目数有上限"""
+
+    _CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS terminal_result_cache (
+        cache_key   TEXT NOT NULL,
+        namespace   TEXT NOT NULL,
+        status      TEXT,
+        payload     TEXT NOT NULL,
+        create_time TEXT NOT NULL,
+        PRIMARY KEY (namespace, cache_key)
+    )
+    """
+
+    def __init__(self, db_path, max_entries=50000, logger=None):
+        """
+        :param db_path: sqlite文件路径
+        :param max_entries: 最大条目数，超过后淘汰最旧的10%
+        :param logger: 日志器
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.max_entries = max(1, int(max_entries))
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self._CREATE_TABLE)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_terminal_result_time ON terminal_result_cache (create_time)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM terminal_result_cache").fetchone()[0]
+        self._log('info', f"🗃️ 终态结果缓存已加载: {self._count} 条记录 ({db_path})")
+
+    def get(self, namespace, key):
+        """
+        查询缓存
+        :return: 缓存的结果字典，未命中返回None
+        """
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT payload FROM terminal_result_cache WHERE namespace = ? AND cache_key = ?",
+                    (namespace, key)).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            self._log('error', f"❌ 读取缓存失败 {namespace}/{key}: {str(e)}")
+            return None
+
+    def put(self, namespace, key, payload, status=None):
+        """写入一条终态结果"""
+        try:
+            with self._lock:
+                exists = self._conn.execute(
+                    "SELECT 1 FROM terminal_result_cache WHERE namespace = ? AND cache_key = ?",
+                    (namespace, key)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO terminal_result_cache "
+                    "(cache_key, namespace, status, payload, create_time) VALUES (?, ?, ?, ?, ?)",
+                    (key, namespace, status, json.dumps(payload, ensure_ascii=False, default=str),
+                     datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                self._conn.commit()
+                if not exists:
+                    self._count += 1
+                if self._count > self.max_entries:
+                    self._evict()
+            return True
+        except Exception as e:
+            self._log('error', f"❌ 写入缓存失败 {namespace}/{key}: {str(e)}")
+            return False
+
+    def count(self):
+        with self._lock:
+            return self._count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self):
+        """淘汰最旧的10%条目（调用方已持有锁）"""
+        evict_count = max(1, self._count - int(self.max_entries * 0.9))
+        self._conn.execute(
+            "DELETE FROM terminal_result_cache WHERE rowid IN "
+            "(SELECT rowid FROM terminal_result_cache ORDER BY create_time LIMIT ?)", (evict_count,))
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM terminal_result_cache").fetchone()[0]
+        self._log('info', f"🧹 缓存超过上限，已淘汰 {evict_count} 条最旧记录")
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[结果缓存] {message}")
+
+
+# 全局缓存实例（按需创建）
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_terminal_result_cache(logger=None):
+    """按TERMINAL_RESULT_CACHE_CONFIG获取全局终态结果缓存，未启用时返回None"""
+    global _cache
+    from config import Config
+    cache_config = Config.get_terminal_result_cache_config()
+    if not cache_config.get('ENABLED', True):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = TerminalResultCache(
+                    os.path.join(Config.get_runtime_data_dir(), cache_config.get('DB_FILE', 'result_cache.db')),
+                    max_entries=cache_config.get('MAX_ENTRIES', 50000),
+                    logger=logger)
+            except Exception as e:
+                if logger:
+                    logger.error(f"[结果缓存] ❌ 终态结果缓存初始化失败，本次不使用缓存: {str(e)}")
+                return None
+        return _cache
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+增量抽取水位线
+文件名: Watermark.py
+功能: 按业务步骤记录已抽取数据的高水位 (paytime, xpbillid)，日内的每次运行只扫描水位之后新到的行；
+     按固定间隔做一次全量扫描，补上水位之下遗漏的行（如迟到提交的数据）。
+     抽取出的行先登记到 WatermarkTracker，处理确认成功后才推进水位，且只推进到第一笔
+     未成功（失败、未处理或运行中断）的行之前，失败的行下次增量运行仍会被扫描到。
+     水位保存在运行数据目录下的JSON文件中，重启后继续使用。
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from common.ShardRunner import shard_scoped_name
+
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class WatermarkStore:
+    """按步骤保存的 (时间, 单号) 高水位"""
+
+    def __init__(self, state_file, logger=None):
+        """
+        :param state_file: 水位状态文件路径（JSON）
+        :param logger: 日志器
+        """
+        self.state_file = state_file
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._state = self._load()
+
+    def get(self, stage):
+        """
+        获取步骤的水位
+        :return: (paytime, xpbillid)，尚无水位返回None；paytime保持抽取时的类型（datetime或字符串）
+        """
+        with self._lock:
+            mark = self._state.get(stage, {}).get('watermark')
+        if not mark:
+            return None
+        paytime = datetime.strptime(mark['time'], _TIME_FORMAT) if mark.get('is_datetime') else mark['time']
+        return paytime, mark['key']
+
+    def advance(self, stage, paytime, key):
+        """推进水位（只前进不后退）"""
+        if paytime is None or key is None:
+            return
+        is_datetime = hasattr(paytime, 'strftime')
+        time_str = paytime.strftime(_TIME_FORMAT) if is_datetime else str(paytime)
+        with self._lock:
+            entry = self._state.setdefault(stage, {})
+            current = entry.get('watermark')
+            if current and (current['time'], current['key']) >= (time_str, str(key)):
+                return
+            entry['watermark'] = {'time': time_str, 'key': str(key), 'is_datetime': is_datetime}
+            self._save()
+
+    def needs_full_sweep(self, stage, interval_minutes):
+        """距上次全量扫描是否已超过间隔（尚无水位时总是全量）"""
+        with self._lock:
+            entry = self._state.get(stage, {})
+            if not entry.get('watermark'):
+                return True
+            return time.time() - entry.get('last_full_sweep', 0) >= interval_minutes * 60
+
+    def request_full_sweep(self, stage):
+        """下次运行强制全量扫描（如水位之下有行本次被延后未处理）"""
+        with self._lock:
+            entry = self._state.get(stage)
+            if entry is not None and entry.get('last_full_sweep'):
+                entry['last_full_sweep'] = 0
+                self._save()
+
+    def mark_full_sweep(self, stage):
+        with self._lock:
+            self._state.setdefault(stage, {})['last_full_sweep'] = time.time()
+            self._save()
+
+    def _load(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            self._log('error', f"❌ 读取水位文件失败，本次全量扫描: {str(e)}")
+            return {}
+
+    def _save(self):
+        """写入状态文件（调用方已持有锁）"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+            temp_file = f"{self.state_file}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._state, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, self.state_file)
+        except Exception as e:
+            self._log('error', f"❌ 保存水位文件失败: {str(e)}")
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(f"[增量抽取] {message}")
+
+
+class WatermarkTracker:
+    """一次抽取的行按 (时间, 单号) 升序登记，处理结果确认后再推进水位"""
+
+    def __init__(self, store, stage, full_sweep=False):
+        """
+        :param store: 水位存储
+        :param stage: 业务步骤名
+        :param full_sweep: 本次是否为全量扫描，提交时记录全量扫描时间
+        """
+        self.store = store
+        self.stage = stage
+        self.full_sweep = full_sweep
+        self._lock = threading.Lock()
+        self._rows = []  # [(paytime, key)]，按抽取顺序
+        self._pending = {}  # key -> 尚未确认成功的条目数
+        self._failed = set()
+
+    def add(self, paytime, key, pending=1):
+        """
+        登记一行（须按 (paytime, key) 升序调用）
+        :param pending: 该行生成的待处理条目数（如一行拆成微信、支付宝两笔订单），0表示无需处理
+        """
+        with self._lock:
+            if key not in self._pending:
+                self._rows.append((paytime, key))
+                self._pending[key] = 0
+            self._pending[key] += pending
+
+    def mark_done(self, key, success=True):
+        """确认行中一个条目的处理结果，任一条目失败则该行不再推进水位"""
+        with self._lock:
+            if key not in self._pending:
+                return
+            if success:
+                self._pending[key] = max(0, self._pending[key] - 1)
+            else:
+                self._failed.add(key)
+
+    def commit(self):
+        """
+        水位推进到第一笔未成功行之前的最后一行
+        :return: 推进到的 (paytime, key)，没有可推进的行返回None
+        """
+        with self._lock:
+            mark = None
+            for paytime, key in self._rows:
+                if self._pending[key] > 0 or key in self._failed:
+                    break
+                mark = (paytime, key)
+        if mark is not None:
+            self.store.advance(self.stage, *mark)
+        if self.full_sweep:
+            self.store.mark_full_sweep(self.stage)
+        return mark
+
+
+# 全局水位存储（按需创建）
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_watermark_store(logger=None):
+    """按INCREMENTAL_EXTRACT_CONFIG获取全局水位存储，未启用时返回None"""
+    global _store
+    from config import Config
+    extract_config = Config.get_incremental_extract_config()
+    if not extract_config.get('ENABLED', True):
+        return None
+    with _store_lock:
+        if _store is None:
+            # 分片运行时每个分片进程各用一份水位文件
+            _store = WatermarkStore(
+                os.path.join(Config.get_runtime_data_dir(),
+                             shard_scoped_name(extract_config.get('STATE_FILE', 'watermarks.json'))),
+                logger=logger)
+        return _store
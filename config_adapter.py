@@ -261,6 +261,11 @@ class ConfigAdapter:
         config = self.get_account_balance_query_config()
         return config.get('AUTO_QUERY_INTERVAL', 10)
     
+    def get_account_balance_query_workers(self) -> int:
+        """获取账户余额并发查询线程数"""
+        config = self.get_account_balance_query_config()
+        return config.get('QUERY_WORKERS', 4)
+
     def get_default_merchant_id_for_balance(self) -> str:
         """获取默认查询余额的商户号"""
         config = self.get_account_balance_query_config()
@@ -70,6 +70,18 @@ CREATE TABLE P_BL_FZ_CONFIG_TEMPLATE (
 )
 """
 
+# 5. 定时任务租约表（多台主机运行定时任务服务时，保证每个任务同一时间只在一台主机执行）
+CREATE_JOB_LEASE_TABLE = """
+CREATE TABLE P_BL_FZ_JOB_LEASE (
+    JOB_NAME VARCHAR2(100) PRIMARY KEY,          -- 任务名称
+    OWNER_ID VARCHAR2(200) NOT NULL,             -- 持有者(主机名:进程号)
+    LEASE_UNTIL TIMESTAMP NOT NULL,              -- 租约到期时间(数据库时间)
+    ACQUIRE_TIME TIMESTAMP,                      -- 获取时间
+    HEARTBEAT_TIME TIMESTAMP,                    -- 最近续约时间
+    FINISH_TIME TIMESTAMP                        -- 最近一次执行完成时间
+)
+"""
+
 # 创建序列
 CREATE_SEQUENCES = [
     "CREATE SEQUENCE SEQ_P_BL_FZ_ENV_CONFIG START WITH 1 INCREMENT BY 1",
@@ -84,6 +96,73 @@ CREATE_INDEXES = [
     "CREATE INDEX IDX_CONFIG_TEMPLATE_TYPE ON P_BL_FZ_CONFIG_TEMPLATE(TEMPLATE_TYPE)"
 ]
 
+# 6. 结构版本表（记录已执行的业务表迁移）
+CREATE_SCHEMA_VERSION_TABLE = """
+CREATE TABLE P_BL_FZ_SCHEMA_VERSION (
+    VERSION NUMBER(10) PRIMARY KEY,              -- 迁移版本号
+    DESCRIPTION VARCHAR2(500),                   -- 迁移说明
+    APPLIED_TIME TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- 执行时间
+    APPLIED_BY VARCHAR2(50)                      -- 执行人
+)
+"""
+
+# 业务表索引迁移（按版本号顺序执行，已执行的版本不再重复执行）
+# 待处理条件使用函数索引: CASE WHEN <待处理条件> THEN 'N' END，只有待处理的行进入索引，
+# 已处理的历史数据表达式为NULL不占索引空间。业务查询中的条件必须与索引表达式写法一致才能使用索引。
+BUSINESS_INDEX_MIGRATIONS = [
+    {
+        'version': 1,
+        'description': '业务待处理标记函数索引',
+        'statements': [
+            # 订单上传: 未上传
+            "CREATE INDEX IDX_FZ_DT_PENDING_UPLOAD ON P_BL_SELL_PAYAMOUNT_HZ_DT "
+            "(CASE WHEN NVL(ISUPLOAD_FZ, 'N') = 'N' THEN 'N' END)",
+            # 分账申请: 未申请分账
+            "CREATE INDEX IDX_FZ_DT_PENDING_SPLIT ON P_BL_SELL_PAYAMOUNT_HZ_DT "
+            "(CASE WHEN IS_FZ_REQUEST = 'N' THEN 'N' END)",
+            # 分账结果查询: 已执行、结果未确认
+            "CREATE INDEX IDX_FZ_DT_PENDING_QUERY ON P_BL_SELL_PAYAMOUNT_HZ_DT "
+            "(CASE WHEN IS_FZ_EXECUTE = 'Y' AND FZ_EXECUTE_RESULT = 'N' THEN 'N' END)",
+            # 挂账充值: 分账已确认、未充值
+            "CREATE INDEX IDX_FZ_DT_PENDING_RECHARGE ON P_BL_SELL_PAYAMOUNT_HZ_DT "
+            "(CASE WHEN NVL(ISRECHARGE_FZ, 'N') = 'N' AND FZ_UPLOADRESULT_CONFIRM = 'Y' THEN 'N' END)",
+            # 余额检查: 对账完成、余额未确认
+            "CREATE INDEX IDX_FZ_HD_PENDING_BALANCE ON P_BL_SELL_PAYAMOUNT_HZ_HD "
+            "(CASE WHEN BALANCE_MONEY_SIGN = 'N' AND ALLRESULT_CHECK_SIGN = 'Y' THEN 'N' END)",
+            # 提现申请: 待提现
+            "CREATE INDEX IDX_FZ_DRAW_PENDING ON P_BL_DRAW_HD "
+            "(CASE WHEN IS_UNPAID_FEE = 'Y' AND STATUS = '003' AND CANCELSIGN = 'N' THEN 'Y' END)",
+            # 按银行流水号回查分账记录
+            "CREATE INDEX IDX_FZ_DT_REQUESTBACK_NO ON P_BL_SELL_PAYAMOUNT_HZ_DT (FZ_REQUESTBACK_NO)",
+            # 订单上传增量抽取水位 (paytime, xpbillid)
+            "CREATE INDEX IDX_FZ_DT_PAYTIME ON P_BL_SELL_PAYAMOUNT_HZ_DT (PAYTIME, XPBILLID)",
+        ],
+        # 用EXPLAIN PLAN确认待处理查询走了对应的索引: (索引名, 代表性查询)
+        'explain': [
+            ('IDX_FZ_DT_PENDING_UPLOAD',
+             "SELECT dt.billid FROM P_BL_SELL_PAYAMOUNT_HZ_DT dt "
+             "WHERE CASE WHEN NVL(dt.ISUPLOAD_FZ, 'N') = 'N' THEN 'N' END = 'N'"),
+            ('IDX_FZ_DT_PENDING_SPLIT',
+             "SELECT dt.billid FROM P_BL_SELL_PAYAMOUNT_HZ_DT dt "
+             "WHERE CASE WHEN dt.IS_FZ_REQUEST = 'N' THEN 'N' END = 'N'"),
+            ('IDX_FZ_DT_PENDING_QUERY',
+             "SELECT dt.billid FROM P_BL_SELL_PAYAMOUNT_HZ_DT dt "
+             "WHERE CASE WHEN dt.IS_FZ_EXECUTE = 'Y' AND dt.FZ_EXECUTE_RESULT = 'N' THEN 'N' END = 'N'"),
+            ('IDX_FZ_DT_PENDING_RECHARGE',
+             "SELECT dt.billid FROM P_BL_SELL_PAYAMOUNT_HZ_DT dt "
+             "WHERE CASE WHEN NVL(dt.ISRECHARGE_FZ, 'N') = 'N' AND dt.FZ_UPLOADRESULT_CONFIRM = 'Y' THEN 'N' END = 'N'"),
+            ('IDX_FZ_HD_PENDING_BALANCE',
+             "SELECT hd.billid FROM P_BL_SELL_PAYAMOUNT_HZ_HD hd "
+             "WHERE CASE WHEN hd.BALANCE_MONEY_SIGN = 'N' AND hd.ALLRESULT_CHECK_SIGN = 'Y' THEN 'N' END = 'N'"),
+            ('IDX_FZ_DRAW_PENDING',
+             "SELECT billid FROM P_BL_DRAW_HD "
+             "WHERE CASE WHEN IS_UNPAID_FEE = 'Y' AND STATUS = '003' AND CANCELSIGN = 'N' THEN 'Y' END = 'Y'"),
+            ('IDX_FZ_DT_REQUESTBACK_NO',
+             "SELECT dt.billid FROM P_BL_SELL_PAYAMOUNT_HZ_DT dt WHERE dt.FZ_REQUESTBACK_NO = '0'"),
+        ],
+    },
+]
+
 # 插入默认环境配置
 INSERT_DEFAULT_ENV_CONFIG = """
 INSERT INTO P_BL_FZ_ENV_CONFIG (ID, CURRENT_ENV, AUTO_SWITCH, CREATE_TIME)
@@ -190,7 +269,9 @@ def get_all_ddl_statements():
         CREATE_SYS_CONFIG_TABLE,
         CREATE_ENV_CONFIG_TABLE,
         CREATE_BUSINESS_CONFIG_TABLE,
-        CREATE_CONFIG_TEMPLATE_TABLE
+        CREATE_CONFIG_TEMPLATE_TABLE,
+        CREATE_JOB_LEASE_TABLE,
+        CREATE_SCHEMA_VERSION_TABLE
     ])
 
     # 添加序列创建语句
@@ -215,6 +296,8 @@ def get_drop_statements():
         "DROP TABLE P_BL_FZ_ENV_CONFIG CASCADE CONSTRAINTS",
         "DROP TABLE P_BL_FZ_BUSINESS_CONFIG CASCADE CONSTRAINTS",
         "DROP TABLE P_BL_FZ_CONFIG_TEMPLATE CASCADE CONSTRAINTS",
+        "DROP TABLE P_BL_FZ_JOB_LEASE CASCADE CONSTRAINTS",
+        "DROP TABLE P_BL_FZ_SCHEMA_VERSION CASCADE CONSTRAINTS",
         "DROP SEQUENCE SEQ_P_BL_FZ_ENV_CONFIG",
         "DROP SEQUENCE SEQ_P_BL_FZ_BUSINESS_CONFIG"
     ]
@@ -228,6 +311,8 @@ if __name__ == '__main__':
     print("2. P_BL_FZ_ENV_CONFIG - 环境设置表")
     print("3. P_BL_FZ_BUSINESS_CONFIG - 业务功能配置表")
     print("4. P_BL_FZ_CONFIG_TEMPLATE - 配置模板表")
+    print("5. P_BL_FZ_JOB_LEASE - 定时任务租约表")
+    print("6. P_BL_FZ_SCHEMA_VERSION - 结构版本表")
     print("\n使用方法:")
     print("from database_config import get_all_ddl_statements")
     print("ddl_list = get_all_ddl_statements()")
\ No newline at end of file
@@ -18,7 +18,8 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
 from config_manager import ConfigManager
-from database_config import get_all_ddl_statements, get_drop_statements
+from database_config import get_all_ddl_statements, get_drop_statements, BUSINESS_INDEX_MIGRATIONS, \
+    CREATE_SCHEMA_VERSION_TABLE
 
 
 class DatabaseInitializer:
@@ -162,6 +163,32 @@ class DatabaseInitializer:
             self.logger.error(f"创建表失败: {str(e)}")
             return False, f"创建失败: {str(e)}"
 
+    def create_notify_series_sequence(self, sequence_name: str) -> tuple[bool, str]:
+        """创建企业微信消息表 d_qiye_sendmsg.SERIES 使用的序列，起始值接在当前最大序列号之后"""
+        try:
+            connection = self.get_connection()
+            cursor = connection.cursor()
+
+            cursor.execute("SELECT NVL(MAX(series), 0) + 1 FROM d_qiye_sendmsg")
+            start = int(cursor.fetchone()[0])
+            try:
+                cursor.execute(f"CREATE SEQUENCE {sequence_name} START WITH {start} INCREMENT BY 1 CACHE 20")
+                message = f"已创建序列: {sequence_name} (起始值 {start})"
+            except cx_Oracle.DatabaseError as e:
+                error_code = e.args[0].code if e.args and hasattr(e.args[0], 'code') else 0
+                if error_code != 955:  # 名称已被使用
+                    raise
+                message = f"序列已存在，跳过: {sequence_name}"
+            self.logger.info(message)
+
+            cursor.close()
+            connection.close()
+            return True, message
+
+        except Exception as e:
+            self.logger.error(f"创建企业微信消息序列失败: {str(e)}")
+            return False, f"创建序列失败: {str(e)}"
+
     def migrate_default_configs(self) -> tuple[bool, str]:
         """迁移默认配置数据"""
         try:
@@ -385,7 +412,8 @@ MIIEowIBAAKCAQEAoHkgAKyHM/oum3dJ4yOrqWTbrevNt/M+ndkPnWPyqBkHUEq43QIoUm4U+mZExAND
                 'P_BL_FZ_SYS_CONFIG',
                 'P_BL_FZ_ENV_CONFIG',
                 'P_BL_FZ_BUSINESS_CONFIG',
-                'P_BL_FZ_CONFIG_TEMPLATE'
+                'P_BL_FZ_CONFIG_TEMPLATE',
+                'P_BL_FZ_JOB_LEASE'
             ]
 
             missing_tables = []
@@ -415,6 +443,103 @@ MIIEowIBAAKCAQEAoHkgAKyHM/oum3dJ4yOrqWTbrevNt/M+ndkPnWPyqBkHUEq43QIoUm4U+mZExAND
             self.logger.error(f"验证安装失败: {str(e)}")
             return False, f"验证失败: {str(e)}"
 
+    def apply_business_index_migrations(self) -> tuple[bool, str]:
+        """按版本号执行业务表索引迁移，已执行的版本跳过"""
+        try:
+            connection = self.get_connection()
+            cursor = connection.cursor()
+
+            # 只执行业务索引迁移、未做过完整安装时版本表可能还不存在
+            try:
+                cursor.execute(CREATE_SCHEMA_VERSION_TABLE)
+                self.logger.info("已创建表: P_BL_FZ_SCHEMA_VERSION")
+            except cx_Oracle.DatabaseError as e:
+                error_code = e.args[0].code if e.args and hasattr(e.args[0], 'code') else 0
+                if error_code != 955:  # 表已存在
+                    raise
+
+            cursor.execute("SELECT VERSION FROM P_BL_FZ_SCHEMA_VERSION")
+            applied_versions = {row[0] for row in cursor.fetchall()}
+
+            applied_count = 0
+            for migration in sorted(BUSINESS_INDEX_MIGRATIONS, key=lambda m: m['version']):
+                version = migration['version']
+                if version in applied_versions:
+                    self.logger.info(f"迁移版本 {version} 已执行，跳过")
+                    continue
+
+                self.logger.info(f"执行迁移版本 {version}: {migration['description']}")
+                for ddl in migration['statements']:
+                    index_name = ddl.split()[2]
+                    try:
+                        cursor.execute(ddl)
+                        self.logger.info(f"已创建索引: {index_name}")
+                    except cx_Oracle.DatabaseError as e:
+                        error_code = e.args[0].code if e.args and hasattr(e.args[0], 'code') else 0
+                        if error_code in [955, 1408]:  # 名称已被使用，相同列已有索引
+                            self.logger.info(f"索引已存在，跳过: {index_name}")
+                            continue
+                        raise
+
+                # 以DDL方式建索引会隐式提交，版本记录单独提交
+                cursor.execute("""
+                    INSERT INTO P_BL_FZ_SCHEMA_VERSION (VERSION, DESCRIPTION, APPLIED_TIME, APPLIED_BY)
+                    VALUES (:version, :description, CURRENT_TIMESTAMP, 'SYSTEM')
+                """, {'version': version, 'description': migration['description']})
+                connection.commit()
+                applied_count += 1
+
+            cursor.close()
+            connection.close()
+
+            return True, f"业务索引迁移完成，本次执行 {applied_count} 个版本"
+
+        except Exception as e:
+            self.logger.error(f"业务索引迁移失败: {str(e)}")
+            return False, f"迁移失败: {str(e)}"
+
+    def verify_business_indexes(self) -> tuple[bool, str]:
+        """用EXPLAIN PLAN确认待处理查询使用了对应的索引"""
+        try:
+            connection = self.get_connection()
+            cursor = connection.cursor()
+
+            unused = []
+            for migration in BUSINESS_INDEX_MIGRATIONS:
+                for index_name, sql in migration.get('explain', []):
+                    statement_id = f"FZ_IDX_{index_name}"[:30]
+                    cursor.execute("DELETE FROM PLAN_TABLE WHERE STATEMENT_ID = :sid", {'sid': statement_id})
+                    cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {sql}")
+                    cursor.execute("""
+                        SELECT COUNT(*) FROM PLAN_TABLE
+                        WHERE STATEMENT_ID = :sid AND OPERATION = 'INDEX' AND OBJECT_NAME = :index_name
+                    """, {'sid': statement_id, 'index_name': index_name})
+                    used = cursor.fetchone()[0] > 0
+
+                    if used:
+                        self.logger.info(f"✅ {index_name}: 执行计划使用了索引")
+                    else:
+                        cursor.execute("""
+                            SELECT OPERATION || ' ' || NVL(OPTIONS, '') || ' ' || NVL(OBJECT_NAME, '')
+                            FROM PLAN_TABLE WHERE STATEMENT_ID = :sid ORDER BY ID
+                        """, {'sid': statement_id})
+                        plan = ' -> '.join(row[0].strip() for row in cursor.fetchall())
+                        self.logger.warning(f"⚠️ {index_name}: 执行计划未使用索引: {plan}")
+                        unused.append(index_name)
+                    cursor.execute("DELETE FROM PLAN_TABLE WHERE STATEMENT_ID = :sid", {'sid': statement_id})
+
+            connection.commit()
+            cursor.close()
+            connection.close()
+
+            if unused:
+                return False, f"以下索引未被执行计划使用（可能需要收集统计信息）: {', '.join(unused)}"
+            return True, "所有待处理查询的执行计划均使用了索引"
+
+        except Exception as e:
+            self.logger.error(f"验证业务索引失败: {str(e)}")
+            return False, f"验证失败: {str(e)}"
+
     def full_install(self, rebuild: bool = False) -> tuple[bool, str]:
         """完整安装"""
         try:
@@ -437,6 +562,14 @@ MIIEowIBAAKCAQEAoHkgAKyHM/oum3dJ4yOrqWTbrevNt/M+ndkPnWPyqBkHUEq43QIoUm4U+mZExAND
                 return False, f"创建表失败: {message}"
             self.logger.info(f"✅ {message}")
 
+            # 企业微信消息序列（业务表不存在时只告警，不影响配置系统安装）
+            from config import Config
+            sequence_name = Config.get_wechat_notify_config().get('SERIES_SEQUENCE')
+            if sequence_name:
+                self.logger.info("🔢 创建企业微信消息序列...")
+                success, message = self.create_notify_series_sequence(sequence_name)
+                self.logger.info(f"{'✅' if success else '⚠️'} {message}")
+
             # 迁移配置
             self.logger.info("📦 迁移配置数据...")
             success, message = self.migrate_default_configs()
@@ -524,8 +657,9 @@ def main():
     print("3. 仅迁移配置数据")
     print("4. 重建系统（删除后重新安装）")
     print("5. 验证安装")
+    print("6. 业务表索引迁移（含执行计划验证）")
 
-    choice = input("\n请选择操作 (1-5): ")
+    choice = input("\n请选择操作 (1-6): ")
 
     if choice == "1":
         # 完整安装
@@ -564,6 +698,14 @@ def main():
         success, message = initializer.verify_installation()
         print(f"\n{'✅' if success else '❌'} {message}")
 
+    elif choice == "6":
+        # 业务表索引迁移，大表建索引耗时较长，建议在业务低峰执行
+        success, message = initializer.apply_business_index_migrations()
+        print(f"\n{'✅' if success else '❌'} {message}")
+        if success:
+            success, message = initializer.verify_business_indexes()
+            print(f"{'✅' if success else '⚠️'} {message}")
+
     else:
         print("\n❌ 无效的选择")
 
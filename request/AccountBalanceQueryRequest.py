@@ -16,7 +16,9 @@ from typing import Optional, List, Dict, Any
 from datetime import datetime
 import json
 
-from common.OpenClient import OpenClient
+from common.OpenClient import OpenClient, enable_debug_logging
+from common.BalanceCache import get_balance_cache
+from common.LogPipeline import route_logger
 from request.BaseRequest import BaseRequest
 from model.AccountBalanceQueryModel import (
     AccountBalanceQueryRequest, 
@@ -56,6 +58,7 @@ class AccountBalanceQueryRequestHandler:
             logger: 日志记录器，如果不提供则创建默认的
         """
         self.logger = logger or self._create_default_logger()
+        enable_debug_logging(self.logger)
         
         # 初始化OpenClient，传入必要的参数
         try:
@@ -86,7 +89,7 @@ class AccountBalanceQueryRequestHandler:
             handler.setFormatter(formatter)
             logger.addHandler(handler)
             logger.setLevel(logging.INFO)
-        return logger
+        return route_logger(logger)
     
     def query_single_balance(self, merchant_id: int, 
                            account_type: Optional[str] = None,
@@ -106,7 +109,21 @@ class AccountBalanceQueryRequestHandler:
         """
         if account_type is None:
             account_type = self.default_account_type
-        
+
+        # 短期缓存 + 同一账户并发查询合并
+        balance_cache = get_balance_cache(self.logger)
+        if balance_cache is None:
+            return self._query_single_balance_remote(merchant_id, account_type, sub_node_id, store_no)
+        return balance_cache.get_or_load(
+            ('handler', str(merchant_id), account_type, store_no or '', sub_node_id or ''),
+            lambda: self._query_single_balance_remote(merchant_id, account_type, sub_node_id, store_no),
+            cacheable=lambda response: response.is_success()
+        )
+
+    def _query_single_balance_remote(self, merchant_id: int, account_type: str,
+                                     sub_node_id: Optional[str],
+                                     store_no: Optional[str]) -> AccountBalanceQueryResponse:
+        """调用接口查询单个商户的账户余额（不经过缓存）"""
         self.logger.info(f"[账户余额查询] 开始查询单个商户余额 - 商户号: {merchant_id}, 账户类型: {account_type}")
         
         try:
@@ -10,6 +10,7 @@
 
 import json
 import logging
+from dataclasses import asdict
 from datetime import datetime
 from typing import Optional
 
@@ -18,10 +19,12 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from common.OpenClient import OpenClient
+from common.OpenClient import OpenClient, enable_debug_logging
+from common.TerminalResultCache import get_terminal_result_cache
+from common.RateLimiter import get_rate_limiter
 from common import RequestTypes
 from request.BaseRequest import BaseRequest
-from model.SplitQueryModel import BalancePayQueryRequest, BalancePayQueryResponse
+from model.SplitQueryModel import BalancePayQueryRequest, BalancePayQueryResponse, BalancePayQueryData
 from config import Config
 
 
@@ -61,9 +64,14 @@ class BalancePayQueryAPIRequest(BaseRequest):
 class BalancePayQueryRequestHandler:
     """余额支付查询请求处理类"""
 
+    # 终态状态：0=失败, 1=成功, 2=已退款，到达后不会再变化，可以缓存
+    TERMINAL_STATUSES = ("0", "1", "2")
+    CACHE_NAMESPACE = 'bkfunds.balance.pay.query'
+
     def __init__(self, logger: Optional[logging.Logger] = None):
         """初始化请求处理器"""
         self.logger = logger or logging.getLogger(__name__)
+        enable_debug_logging(self.logger)
 
         # 初始化OpenClient，传入必要的参数
         try:
@@ -79,17 +87,25 @@ class BalancePayQueryRequestHandler:
         # 接口相关配置
         self.node_id = Config.get_split_query_node_id()  # 使用同一个机构号配置
 
+        # 终态结果缓存（未启用或初始化失败时为None）
+        self.result_cache = get_terminal_result_cache(self.logger)
+
+        # 接口限流（同一进程内所有查询共用，未配置时为None）
+        self.rate_limiter = get_rate_limiter(self.CACHE_NAMESPACE)
+
         self.logger.info(f"[余额支付查询] 初始化完成，当前环境: {Config.get_env_name()}")
         self.logger.info(f"[余额支付查询] 机构号: {self.node_id}")
         self.logger.info(f"[余额支付查询] API地址: {Config.get_url()}")
 
-    def query_balance_pay_result(self, trade_no: str, node_id: Optional[str] = None) -> BalancePayQueryResponse:
+    def query_balance_pay_result(self, trade_no: str, node_id: Optional[str] = None,
+                                 use_cache: bool = True) -> BalancePayQueryResponse:
         """
         查询余额支付结果
 
         Args:
             trade_no: 银行流水号
             node_id: 机构号（可选，默认使用配置中的机构号）
+            use_cache: 是否使用终态缓存（对账时需要平台当前状态，传False）
 
         Returns:
             BalancePayQueryResponse: 查询结果响应
@@ -97,6 +113,13 @@ class BalancePayQueryRequestHandler:
         try:
             self.logger.info(f"[余额支付查询] 开始查询交易结果, 流水号: {trade_no}")
 
+            # 终态结果不会再变化，命中缓存直接返回
+            cached_response = self._get_cached_result(trade_no) if use_cache else None
+            if cached_response is not None:
+                self.logger.info(f"[余额支付查询] 命中终态缓存, 流水号: {trade_no}, "
+                                 f"状态: {cached_response.data.get_status_text()}")
+                return cached_response
+
             # 创建请求模型
             request_model = BalancePayQueryRequest(
                 node_id=node_id or self.node_id,
@@ -125,6 +148,8 @@ class BalancePayQueryRequestHandler:
             if not self.open_client:
                 raise Exception("请求客户端未正确初始化")
 
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
             response_data = self.open_client.execute(request)
 
             # 解析响应
@@ -140,6 +165,7 @@ class BalancePayQueryRequestHandler:
                     self.logger.info(f"[余额支付查询] 实际到账: {response.data.get_real_amount_yuan()}元")
                     self.logger.info(f"[余额支付查询] 交易时间: {response.data.trade_time}")
                     self.logger.info(f"[余额支付查询] 完成时间: {response.data.finish_time}")
+                    self._cache_terminal_result(trade_no, response)
             else:
                 self.logger.error(f"[余额支付查询] 查询失败, 流水号: {trade_no}")
                 self.logger.error(f"[余额支付查询] 错误信息: {response.get_error_message()}")
@@ -156,6 +182,25 @@ class BalancePayQueryRequestHandler:
                 success=False
             )
 
+    def _get_cached_result(self, trade_no: str) -> Optional[BalancePayQueryResponse]:
+        """从终态缓存恢复查询结果，未命中返回None"""
+        if not self.result_cache:
+            return None
+        cached = self.result_cache.get(self.CACHE_NAMESPACE, trade_no)
+        if not cached or not cached.get('data'):
+            return None
+        try:
+            data = BalancePayQueryData(**cached.pop('data'))
+            return BalancePayQueryResponse(data=data, **cached)
+        except Exception as e:
+            self.logger.warning(f"[余额支付查询] 终态缓存内容无效, 忽略: {trade_no}, {str(e)}")
+            return None
+
+    def _cache_terminal_result(self, trade_no: str, response: BalancePayQueryResponse):
+        """查询结果已到终态时写入缓存"""
+        if self.result_cache and response.data and response.data.status in self.TERMINAL_STATUSES:
+            self.result_cache.put(self.CACHE_NAMESPACE, trade_no, asdict(response), status=response.data.status)
+
     def batch_query_balance_pay_results(self, trade_nos: list) -> dict:
         """
         批量查询余额支付结果
@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""单元测试配置：把项目根目录和接口文件目录加入导入路径，测试不依赖Oracle数据库"""
+
+import os
+import sys
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, '接口文件'))
+sys.path.insert(0, _ROOT)
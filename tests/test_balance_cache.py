@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""余额缓存并发合并与失效测试"""
+
+import threading
+import time
+
+from common import BalanceCache
+from common.BalanceCache import SingleFlightTTLCache, invalidate_merchant_balance
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.001)
+
+
+def _start_slow_load(cache, key, value, callers=5):
+    """callers个线程同时查询同一个键，加载函数阻塞到返回的release被set"""
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return value
+
+    def call():
+        try:
+            results.append(cache.get_or_load(key, loader))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    threads[0].start()
+    _wait_until(lambda: calls)
+    for thread in threads[1:]:
+        thread.start()
+    _wait_until(lambda: cache.get_stats()['coalesced'] == callers - 1)
+    return release, threads, calls, results
+
+
+def test_cached_value_is_reused_within_ttl():
+    cache = SingleFlightTTLCache(ttl_seconds=60)
+    calls = []
+    for _ in range(3):
+        assert cache.get_or_load('k', lambda: calls.append(1) or 'v') == 'v'
+    assert len(calls) == 1
+    assert cache.get_stats()['hits'] == 2
+
+
+def test_entry_expires_after_ttl():
+    cache = SingleFlightTTLCache(ttl_seconds=0.05)
+    cache.get_or_load('k', lambda: 'old')
+    time.sleep(0.1)
+    assert cache.get_or_load('k', lambda: 'new') == 'new'
+
+
+def test_concurrent_loads_are_coalesced():
+    cache = SingleFlightTTLCache(ttl_seconds=0)
+    release, threads, calls, results = _start_slow_load(cache, 'k', 'balance')
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['balance'] * 5
+    assert len(calls) == 1
+    # TTL为0时只合并并发查询，不缓存
+    assert cache.get_stats()['size'] == 0
+
+
+def test_loader_error_is_shared_with_waiters_and_not_cached():
+    cache = SingleFlightTTLCache(ttl_seconds=60)
+    release = threading.Event()
+    results = []
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError('接口异常')
+
+    def call():
+        try:
+            results.append(cache.get_or_load('k', failing))
+        except RuntimeError as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    _wait_until(lambda: cache.get_stats()['loads'] + cache.get_stats()['coalesced'] == 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(results) == 3 and all(isinstance(r, RuntimeError) for r in results)
+    assert cache.get_or_load('k', lambda: 'ok') == 'ok'
+
+
+def test_uncacheable_result_is_not_stored():
+    cache = SingleFlightTTLCache(ttl_seconds=60)
+    cache.get_or_load('k', lambda: None, cacheable=lambda value: value is not None)
+    assert cache.get_or_load('k', lambda: 'v') == 'v'
+
+
+def test_invalidate_by_predicate():
+    cache = SingleFlightTTLCache(ttl_seconds=60)
+    cache.get_or_load(('q', 'M1'), lambda: 1)
+    cache.get_or_load(('q', 'M2'), lambda: 2)
+    cache.invalidate(lambda key: key[1] == 'M1')
+
+    assert cache.get_or_load(('q', 'M1'), lambda: 10) == 10
+    assert cache.get_or_load(('q', 'M2'), lambda: 20) == 2
+
+
+def test_invalidate_while_waiters_share_load_discards_result():
+    # 余额在查询进行中被分账扣减：等待中的调用方拿到这次结果，但结果不进缓存
+    cache = SingleFlightTTLCache(ttl_seconds=60)
+    release, threads, calls, results = _start_slow_load(cache, 'k', 'stale', callers=3)
+    cache.invalidate()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['stale'] * 3
+    assert cache.get_or_load('k', lambda: 'fresh') == 'fresh'
+
+
+def test_invalidate_merchant_balance_matches_merchant_id_as_string(monkeypatch):
+    cache = SingleFlightTTLCache(ttl_seconds=60)
+    monkeypatch.setattr(BalanceCache, '_balance_cache', cache)
+    cache.get_or_load(('split', '100001', '1', None), lambda: 1)
+    cache.get_or_load(('gui', 100002, '1', None), lambda: 2)
+
+    invalidate_merchant_balance(100001)
+    invalidate_merchant_balance('100002')
+    assert cache.get_stats()['size'] == 0
+
+
+def test_invalidate_merchant_balance_without_cache_is_noop(monkeypatch):
+    monkeypatch.setattr(BalanceCache, '_balance_cache', None)
+    invalidate_merchant_balance('100001')
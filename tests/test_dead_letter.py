@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""死信队列退避与搁置测试"""
+
+from datetime import datetime
+from decimal import Decimal
+
+from common.DeadLetter import DeadLetterStore
+
+
+def _store(tmp_path, **kwargs):
+    return DeadLetterStore(str(tmp_path / 'dead_letter.db'), **kwargs)
+
+
+def test_backoff_doubles_up_to_cap(tmp_path):
+    store = _store(tmp_path, base_delay_minutes=10, max_delay_minutes=60)
+    assert [store.backoff_minutes(n) for n in range(1, 6)] == [10, 20, 40, 60, 60]
+
+
+def test_item_is_due_only_after_base_delay(tmp_path):
+    store = _store(tmp_path, base_delay_minutes=10)
+    store.add('upload', 'X1', {'billid': 'X1'}, DeadLetterStore.BUSINESS, '失败')
+    assert store.claim_due() == []
+
+    eager = _store(tmp_path / 'eager', base_delay_minutes=0)
+    eager.add('upload', 'X1', {'billid': 'X1'}, DeadLetterStore.BUSINESS, '失败')
+    items = eager.claim_due()
+    assert [item['item_key'] for item in items] == ['X1']
+    assert items[0]['attempts'] == 1
+
+
+def test_claim_pushes_next_retry_back(tmp_path):
+    store = _store(tmp_path, base_delay_minutes=0, max_delay_minutes=0)
+    store.add('split', 'S1', {}, DeadLetterStore.EXCEPTION)
+    assert len(store.claim_due()) == 1
+    # 退避为0时立即再次到期，重试次数累加
+    assert store.claim_due()[0]['attempts'] == 2
+
+
+def test_payload_round_trips_datetime_and_decimal(tmp_path):
+    store = _store(tmp_path, base_delay_minutes=0)
+    paytime = datetime(2025, 8, 29, 12, 30, 0)
+    store.add('recharge', 'R1', {'paytime': paytime, 'amount': Decimal('12.34')}, DeadLetterStore.WRITEBACK)
+    payload = store.claim_due()[0]['payload']
+    assert payload == {'paytime': paytime, 'amount': Decimal('12.34')}
+
+
+def test_item_is_parked_after_max_attempts(tmp_path):
+    store = _store(tmp_path, max_attempts=2, base_delay_minutes=0, max_delay_minutes=0)
+    store.add('withdraw', 'W1', {}, DeadLetterStore.BUSINESS)
+    for _ in range(2):
+        item = store.claim_due()[0]
+        store.mark_failed(item['stage'], item['item_key'], item['attempts'])
+
+    assert store.claim_due() == []
+    assert store.contains('withdraw', 'W1')
+
+
+def test_resolve_removes_item(tmp_path):
+    store = _store(tmp_path, base_delay_minutes=0)
+    store.add('upload', 'U1', {}, DeadLetterStore.BUSINESS)
+    assert store.resolve('upload', 'U1')
+    assert not store.contains('upload', 'U1')
+    assert not store.resolve('upload', 'U1')
+    assert store.claim_due() == []
+
+
+def test_keys_survive_reopen(tmp_path):
+    _store(tmp_path).add('upload', 'U1', {}, DeadLetterStore.BUSINESS)
+    assert _store(tmp_path).contains('upload', 'U1')
+
+
+def _make_due(store):
+    store._conn.execute("UPDATE dead_letter SET next_eligible_time = '2000-01-01 00:00:00'")
+    store._conn.commit()
+
+
+def test_item_claimed_by_one_process_is_not_claimed_by_another(tmp_path):
+    daemon = _store(tmp_path)
+    gui = _store(tmp_path)
+    daemon.add('split', 'S1', {}, DeadLetterStore.EXCEPTION)
+    _make_due(daemon)
+
+    assert [item['item_key'] for item in daemon.claim_due()] == ['S1']
+    assert gui.claim_due() == []
+
+
+class _InterleavedConnection:
+    """读出到期单据后、更新之前先运行另一个进程的取出操作"""
+
+    def __init__(self, connection, between):
+        self._connection = connection
+        self._between = between
+
+    def execute(self, sql, *args):
+        cursor = self._connection.execute(sql, *args)
+        if sql.startswith("SELECT stage, item_key, payload") and self._between:
+            rows = cursor.fetchall()
+            between, self._between = self._between, None
+            between()
+            return _Rows(rows)
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class _Rows:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_concurrent_claim_hands_each_item_to_one_process(tmp_path):
+    daemon = _store(tmp_path)
+    gui = _store(tmp_path)
+    daemon.add('upload', 'U1', {}, DeadLetterStore.BUSINESS)
+    daemon.add('upload', 'U2', {}, DeadLetterStore.BUSINESS)
+    _make_due(daemon)
+
+    gui_claimed = []
+    daemon._conn = _InterleavedConnection(daemon._conn, lambda: gui_claimed.extend(gui.claim_due(limit=1)))
+    daemon_claimed = daemon.claim_due()
+
+    keys = [item['item_key'] for item in gui_claimed + daemon_claimed]
+    assert sorted(keys) == ['U1', 'U2']
+    assert all(item['attempts'] == 1 for item in gui_claimed + daemon_claimed)
+
+
+def test_item_added_by_other_process_can_be_resolved(tmp_path):
+    # 界面进程在定时服务加载之后记入失败单据，定时服务重新处理成功时要能移出
+    daemon = _store(tmp_path)
+    gui = _store(tmp_path)
+    gui.add('upload', 'U1', {}, DeadLetterStore.BUSINESS)
+
+    assert daemon.contains('upload', 'U1')
+    assert daemon.resolve('upload', 'U1')
+    assert not gui.contains('upload', 'U1')
+
+
+def test_parked_item_is_not_claimed_until_requeued(tmp_path):
+    store = _store(tmp_path, max_attempts=1, base_delay_minutes=0, max_delay_minutes=0)
+    store.add('recharge', 'R1', {}, DeadLetterStore.BUSINESS)
+    item = store.claim_due()[0]
+    store.mark_failed('recharge', 'R1', item['attempts'], error=RuntimeError('余额不足'))
+
+    assert store.claim_due() == []
+    assert store.list_items(status=DeadLetterStore.PARKED)[0]['last_error'] == '余额不足'
+    assert store.requeue('recharge') == 1
+    assert store.claim_due()[0]['attempts'] == 1
+
+
+def test_re_adding_keeps_attempts_and_schedule(tmp_path):
+    store = _store(tmp_path, base_delay_minutes=0, max_delay_minutes=0)
+    store.add('split', 'S1', {'v': 1}, DeadLetterStore.EXCEPTION)
+    store.claim_due()
+    store.add('split', 'S1', {'v': 2}, DeadLetterStore.BUSINESS, '再次失败')
+
+    item = store.claim_due()[0]
+    assert item['attempts'] == 2
+    assert item['payload'] == {'v': 2}
+    assert item['failure_class'] == DeadLetterStore.BUSINESS
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""幂等台账测试：台账文件由多个进程共用"""
+
+import multiprocessing
+
+from common.IdempotencyLedger import BloomFilter, IdempotencyLedger
+
+METHOD = 'bkfunds.balance.pay.apply'
+
+
+def _put_in_other_process(db_path, order_id):
+    ledger = IdempotencyLedger(db_path)
+    ledger.put(METHOD, order_id, 'JMS', request_no='R-' + order_id, trade_no='T-' + order_id)
+    ledger.close()
+
+
+def test_key_written_by_other_process_after_load_is_found(tmp_path):
+    db_path = str(tmp_path / 'idempotency.db')
+    ledger = IdempotencyLedger(db_path)
+    assert ledger.get(METHOD, 'XP1', 'JMS') is None
+
+    process = multiprocessing.get_context('spawn').Process(target=_put_in_other_process, args=(db_path, 'XP1'))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+
+    record = ledger.get(METHOD, 'XP1', 'JMS')
+    assert record['request_no'] == 'R-XP1'
+    assert record['trade_no'] == 'T-XP1'
+
+
+def test_both_instances_see_each_others_writes(tmp_path):
+    db_path = str(tmp_path / 'idempotency.db')
+    daemon = IdempotencyLedger(db_path)
+    gui = IdempotencyLedger(db_path)
+
+    daemon.put(METHOD, 'XP1', 'JMS', request_no='R1')
+    gui.put(METHOD, 'XP2', 'GS', request_no='R2')
+
+    assert gui.get(METHOD, 'XP1', 'JMS')['request_no'] == 'R1'
+    assert daemon.get(METHOD, 'XP2', 'GS')['request_no'] == 'R2'
+    assert daemon.get(METHOD, 'XP1', 'GS') is None
+
+
+def test_replaced_key_is_still_found_by_other_instance(tmp_path):
+    db_path = str(tmp_path / 'idempotency.db')
+    writer = IdempotencyLedger(db_path)
+    writer.put(METHOD, 'XP1', 'JMS', request_no='R1')
+    reader = IdempotencyLedger(db_path)
+    writer.put(METHOD, 'XP1', 'JMS', request_no='R1-retry')
+
+    assert reader.get(METHOD, 'XP1', 'JMS')['request_no'] == 'R1-retry'
+    assert reader.count() == 1
+
+
+def test_records_survive_reopen(tmp_path):
+    db_path = str(tmp_path / 'idempotency.db')
+    IdempotencyLedger(db_path).put(METHOD, 'XP1', '', request_no='R1')
+    assert IdempotencyLedger(db_path).get(METHOD, 'XP1')['request_no'] == 'R1'
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [f"{METHOD}|XP{n}|JMS" for n in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"{METHOD}|OTHER{n}|JMS" in bloom for n in range(1000))
+    assert false_positives < 50
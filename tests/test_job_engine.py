@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""多阶段作业引擎流转与结束测试"""
+
+import threading
+from dataclasses import dataclass
+
+import pytest
+
+from common.JobEngine import JobEngine
+
+
+@dataclass
+class First:
+    value: int
+
+
+@dataclass
+class Second:
+    value: int
+
+
+def _run_in_thread(engine, seeds, **kwargs):
+    """在线程中运行，卡住时测试失败而不是挂起"""
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('elapsed', engine.run(seeds, **kwargs)), daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), "作业引擎未结束"
+    return result['elapsed']
+
+
+def test_items_flow_through_all_stages():
+    done = []
+    lock = threading.Lock()
+
+    def finish(item):
+        with lock:
+            done.append(item.value)
+
+    engine = JobEngine('t', queue_size=2)
+    engine.add_stage('一', lambda item: [Second(item.value * 10)], First, Second, workers=3) \
+        .add_stage('二', finish, Second, workers=2)
+    _run_in_thread(engine, (First(n) for n in range(50)))
+
+    assert sorted(done) == [n * 10 for n in range(50)]
+    stats = {row['name']: row for row in engine.get_stage_stats()}
+    assert stats['一']['processed'] == 50
+    assert stats['二']['processed'] == 50
+
+
+def test_terminates_with_no_seeds():
+    engine = JobEngine('t')
+    engine.add_stage('一', lambda item: [], First)
+    _run_in_thread(engine, [])
+
+
+def test_terminates_when_handler_raises():
+    def handler(item):
+        if item.value % 2:
+            raise ValueError('失败')
+        return []
+
+    engine = JobEngine('t')
+    engine.add_stage('一', handler, First, workers=2)
+    _run_in_thread(engine, [First(n) for n in range(10)])
+
+    stats = engine.get_stage_stats()[0]
+    assert (stats['processed'], stats['failed']) == (5, 5)
+
+
+def test_stop_event_skips_remaining_items():
+    stop_event = threading.Event()
+    seen = []
+
+    def handler(item):
+        seen.append(item.value)
+        stop_event.set()
+        return []
+
+    engine = JobEngine('t')
+    engine.add_stage('一', handler, First)
+    _run_in_thread(engine, [First(n) for n in range(20)], stop_event=stop_event)
+    assert len(seen) < 20
+
+
+def test_follow_up_run_accumulates_stats():
+    engine = JobEngine('t')
+    engine.add_stage('一', lambda item: [], First)
+    _run_in_thread(engine, [First(1), First(2)])
+    _run_in_thread(engine, [First(3)], reset_stats=False)
+    assert engine.get_stage_stats()[0]['processed'] == 3
+
+
+def test_unrouted_emit_type_is_rejected():
+    engine = JobEngine('t')
+    engine.add_stage('一', lambda item: [], First, Second)
+    with pytest.raises(ValueError):
+        engine.run([])
+
+
+def test_duplicate_accept_type_is_rejected():
+    engine = JobEngine('t')
+    engine.add_stage('一', lambda item: [], First)
+    with pytest.raises(ValueError):
+        engine.add_stage('二', lambda item: [], First)
+
+
+def test_fan_out_through_tiny_queues_terminates():
+    # 上游一条产出多条，下游队列容量为1，阻塞投递不能让作业卡住
+    done = []
+    engine = JobEngine('t', queue_size=1)
+    engine.add_stage('拆分', lambda item: [Second(item.value * 100 + n) for n in range(20)], First, Second) \
+        .add_stage('处理', lambda item: done.append(item.value), Second)
+    _run_in_thread(engine, [First(n) for n in range(5)])
+
+    assert len(done) == 100
+    stats = {row['name']: row for row in engine.get_stage_stats()}
+    assert stats['拆分']['processed'] == 5
+
+
+def test_seeds_can_enter_any_stage():
+    seen = []
+    engine = JobEngine('t')
+    engine.add_stage('一', lambda item: [Second(item.value)], First, Second) \
+        .add_stage('二', lambda item: seen.append(item.value), Second)
+    _run_in_thread(engine, [First(1), Second(2)])
+    assert sorted(seen) == [1, 2]
+
+
+def test_wrong_output_type_is_dropped():
+    seen = []
+    engine = JobEngine('t')
+    engine.add_stage('一', lambda item: [First(0), Second(item.value)], First, Second) \
+        .add_stage('二', lambda item: seen.append(item.value), Second)
+    _run_in_thread(engine, [First(1)])
+    assert seen == [1]
+
+
+def test_unroutable_seed_is_dropped():
+    engine = JobEngine('t')
+    engine.add_stage('一', lambda item: [], First)
+    _run_in_thread(engine, [Second(1), First(1)])
+    assert engine.get_stage_stats()[0]['processed'] == 1
+
+
+def test_engine_without_stages_is_rejected():
+    with pytest.raises(ValueError):
+        JobEngine('t').run([])
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""任务租约心跳与到期测试（需要cx_Oracle才能导入，不连接数据库）"""
+
+import re
+import time
+
+import pytest
+
+pytest.importorskip('cx_Oracle')
+
+from common.JobLease import JobLease  # noqa: E402
+
+
+class _ScriptedLease(JobLease):
+    """不访问数据库的租约：获取和续约结果按脚本返回"""
+
+    def __init__(self, acquired=True, renew_results=(), lease_seconds=0.3, heartbeat_seconds=0.02):
+        super().__init__(owner_id='test-host:1')
+        # 绕过最小租约时长，缩短测试时间
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.acquired = acquired
+        self.renew_results = list(renew_results)
+        self.renew_calls = 0
+        self.released = []
+
+    def acquire(self, job_name):
+        return self.acquired
+
+    def renew(self, job_name):
+        self.renew_calls += 1
+        return self.renew_results.pop(0) if self.renew_results else True
+
+    def release(self, job_name, keep_seconds=0):
+        self.released.append((job_name, keep_seconds))
+        return True
+
+
+def _wait_for(event, timeout=3):
+    return event.wait(timeout)
+
+
+def test_taken_over_lease_sets_lost_event():
+    lease = _ScriptedLease(renew_results=[True, False])
+    with lease.hold('结算全流程') as guard:
+        assert guard
+        assert _wait_for(guard.lost)
+    assert lease.released == [('结算全流程', 0)]
+
+
+def test_renew_errors_until_lease_expiry_set_lost_event():
+    # 数据库一直不可用：续约结果未知，超过租约时长后其他主机可能已接管
+    lease = _ScriptedLease(renew_results=[None] * 1000, lease_seconds=0.2)
+    with lease.hold('分账') as guard:
+        start = time.monotonic()
+        assert _wait_for(guard.lost)
+        assert time.monotonic() - start >= 0.15
+
+
+def test_short_renew_error_within_lease_keeps_lease():
+    lease = _ScriptedLease(renew_results=[None, None, True], lease_seconds=5)
+    with lease.hold('分账') as guard:
+        time.sleep(0.2)
+        assert lease.renew_calls >= 3
+        assert not guard.lost.is_set()
+
+
+def test_lease_not_acquired_runs_nothing_and_releases_nothing():
+    lease = _ScriptedLease(acquired=False)
+    with lease.hold('提现', keep_seconds=60) as guard:
+        assert not guard
+    assert lease.released == []
+    assert lease.renew_calls == 0
+
+
+def test_release_keeps_lease_for_interval_jobs():
+    lease = _ScriptedLease()
+    with lease.hold('失败重试', keep_seconds=60):
+        pass
+    assert lease.released == [('失败重试', 60)]
+
+
+@pytest.mark.parametrize('sql', [JobLease._ACQUIRE_SQL, JobLease._RENEW_SQL, JobLease._RELEASE_SQL])
+def test_lease_statements_use_session_independent_database_time(sql):
+    # SYSTIMESTAMP带时区，与TIMESTAMP列比较或写入时按会话时区换算，不同时区的主机对到期判断不一致
+    assert 'SYSTIMESTAMP' in sql
+    assert 'SYSTIMESTAMP' not in re.sub(r'CAST\(SYSTIMESTAMP AS TIMESTAMP\)', '', sql)
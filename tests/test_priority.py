@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""优先级排序测试"""
+
+from datetime import datetime, timedelta
+
+from common.Priority import PriorityScorer
+
+
+def _order(scorer, items, **kwargs):
+    return scorer.order(items, amount=lambda item: item.get('amount'),
+                        paytime=lambda item: item.get('paytime'),
+                        merchant=lambda item: item.get('merchant'),
+                        waiting=lambda item: item.get('waiting', False), **kwargs)
+
+
+def test_larger_amount_first():
+    scorer = PriorityScorer(age_weight=0, tier_weight=0)
+    selected, deferred = _order(scorer, [{'id': 1, 'amount': 100}, {'id': 2, 'amount': 5000}])
+    assert [item['id'] for item in selected] == [2, 1]
+    assert deferred == []
+
+
+def test_older_paytime_first():
+    scorer = PriorityScorer(amount_weight=0, tier_weight=0)
+    now = datetime.now()
+    items = [{'id': 1, 'paytime': now - timedelta(hours=1)}, {'id': 2, 'paytime': now - timedelta(hours=10)}]
+    selected, _ = _order(scorer, items)
+    assert [item['id'] for item in selected] == [2, 1]
+
+
+def test_downstream_waiting_outranks_amount():
+    scorer = PriorityScorer(age_weight=0, tier_weight=0, downstream_weight=2.0)
+    items = [{'id': 1, 'amount': 1000000}, {'id': 2, 'amount': 1, 'waiting': True}]
+    selected, _ = _order(scorer, items)
+    assert [item['id'] for item in selected] == [2, 1]
+
+
+def test_merchant_tier_bonus():
+    scorer = PriorityScorer(amount_weight=0, age_weight=0, merchant_tiers={'M2': 1})
+    selected, _ = _order(scorer, [{'id': 1, 'merchant': 'M1'}, {'id': 2, 'merchant': 'M2'}])
+    assert [item['id'] for item in selected] == [2, 1]
+
+
+def test_ties_keep_original_order():
+    scorer = PriorityScorer()
+    items = [{'id': n} for n in range(5)]
+    selected, _ = _order(scorer, items)
+    assert [item['id'] for item in selected] == [0, 1, 2, 3, 4]
+
+
+def test_max_items_per_run_defers_lowest_scores():
+    scorer = PriorityScorer(age_weight=0, tier_weight=0, max_items_per_run=2)
+    items = [{'id': n, 'amount': n * 100} for n in range(1, 5)]
+    selected, deferred = _order(scorer, items)
+    assert [item['id'] for item in selected] == [4, 3]
+    assert [item['id'] for item in deferred] == [2, 1]
+
+
+def test_empty_input():
+    assert PriorityScorer().order([]) == ([], [])
+
+
+def test_amount_is_capped():
+    scorer = PriorityScorer(amount_cap=1000, age_weight=0, tier_weight=0)
+    assert scorer.score(amount=1000) == scorer.score(amount=50000) == 1.0
+    assert scorer.score(amount=500) == 0.5
+
+
+def test_string_paytimes_from_database_are_parsed():
+    scorer = PriorityScorer(amount_weight=0, tier_weight=0, age_cap_hours=10)
+    now = datetime(2025, 8, 29, 12, 0, 0)
+    assert scorer.score(paytime='20250829070000', now=now) == 0.5
+    assert scorer.score(paytime='2025-08-29 07:00:00.000', now=now) == 0.5
+
+
+def test_unparseable_or_future_paytime_adds_nothing():
+    scorer = PriorityScorer(amount_weight=0, tier_weight=0)
+    now = datetime(2025, 8, 29, 12, 0, 0)
+    assert scorer.score(paytime='not a time', now=now) == 0
+    assert scorer.score(paytime=datetime(2025, 8, 30), now=now) == 0
+
+
+def test_merchant_tiers_match_numeric_merchant_ids():
+    scorer = PriorityScorer(amount_weight=0, age_weight=0, merchant_tiers={100001: 0.5})
+    assert scorer.score(merchant_id='100001') == 0.5
+    assert scorer.score(merchant_id=100002) == 0
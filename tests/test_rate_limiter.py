@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""令牌桶限流测试"""
+
+import threading
+import time
+
+from common.RateLimiter import TokenBucket
+
+
+def test_burst_is_served_without_waiting():
+    bucket = TokenBucket(rate=5, burst=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_waits_once_bucket_is_empty():
+    bucket = TokenBucket(rate=20, burst=1)
+    bucket.acquire()
+    start = time.monotonic()
+    waited = bucket.acquire()
+    assert waited > 0
+    assert time.monotonic() - start >= 0.04
+
+
+def test_average_rate_is_bounded():
+    bucket = TokenBucket(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    # 首个令牌来自桶内，其余10个按每秒50个补充
+    assert time.monotonic() - start >= 0.18
+
+
+def test_burst_defaults_to_rate():
+    assert TokenBucket(rate=4).capacity == 4
+    assert TokenBucket(rate=0.5).capacity == 1
+
+
+def test_threads_share_one_rate():
+    # 定时查询、批量查询、对账多个线程合计不超过配置速率
+    bucket = TokenBucket(rate=100, burst=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    # 20次调用，1次来自桶内，其余19次按每秒100个补充
+    assert time.monotonic() - start >= 0.17
+
+
+def test_idle_time_does_not_grow_burst_beyond_capacity():
+    bucket = TokenBucket(rate=100, burst=2)
+    time.sleep(0.1)
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() > 0
+
+
+def test_limiter_is_shared_per_method(monkeypatch):
+    from config import Config
+    from common import RateLimiter
+
+    monkeypatch.setattr(RateLimiter, '_limiters', {})
+    monkeypatch.setattr(Config, 'get_rate_limit_config', classmethod(lambda cls: {
+        'ENABLED': True, 'DEFAULT_QPS': 0, 'BURST': 0, 'METHOD_QPS': {'bkfunds.balance.pay.query': 10}}))
+
+    limiter = RateLimiter.get_rate_limiter('bkfunds.balance.pay.query')
+    assert limiter is RateLimiter.get_rate_limiter('bkfunds.balance.pay.query')
+    assert limiter.capacity == 10
+    # 未配置速率的接口不限流
+    assert RateLimiter.get_rate_limiter('bkfunds.balance.pay.apply') is None
+
+
+def test_disabled_limiter(monkeypatch):
+    from config import Config
+    from common import RateLimiter
+
+    monkeypatch.setattr(Config, 'get_rate_limit_config', classmethod(lambda cls: {'ENABLED': False}))
+    assert RateLimiter.get_rate_limiter('bkfunds.balance.pay.query') is None
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""运行日志回放测试"""
+
+from common.RunJournal import RunJournal
+
+
+def _key(item):
+    return item['id']
+
+
+def test_resume_returns_latest_state_of_unfinished_run(tmp_path):
+    journal = RunJournal('upload', journal_dir=str(tmp_path))
+    journal.start_run([{'id': 'A'}, {'id': 'B'}, {'id': 'C'}], _key)
+    journal.record('A', RunJournal.SENT)
+    journal.record('A', RunJournal.ACKED, bank_seq='S1')
+    journal.record('A', RunJournal.WRITTEN_BACK)
+    journal.record('B', RunJournal.SENT)
+    journal.close()
+
+    entries = RunJournal('upload', journal_dir=str(tmp_path)).resume_run()
+    assert entries['A']['state'] == RunJournal.WRITTEN_BACK
+    assert entries['A']['extra'] == {'bank_seq': 'S1'}
+    assert entries['A']['data'] == {'id': 'A'}
+    assert entries['B']['state'] == RunJournal.SENT
+    assert entries['C']['state'] == RunJournal.CLAIMED
+
+
+def test_finished_run_is_not_resumed(tmp_path):
+    journal = RunJournal('upload', journal_dir=str(tmp_path))
+    journal.start_run([{'id': 'A'}], _key)
+    journal.record('A', RunJournal.FAILED)
+    journal.finish_run()
+
+    assert RunJournal('upload', journal_dir=str(tmp_path)).resume_run() is None
+
+
+def test_missing_journal_is_not_resumed(tmp_path):
+    assert RunJournal('upload', journal_dir=str(tmp_path)).resume_run() is None
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    journal = RunJournal('split', journal_dir=str(tmp_path))
+    journal.start_run([{'id': 'A'}], _key)
+    journal.record('A', RunJournal.SENT)
+    journal.close()
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write('{"event": "item", "run_id": ')
+
+    entries = RunJournal('split', journal_dir=str(tmp_path)).resume_run()
+    assert entries['A']['state'] == RunJournal.SENT
+
+
+def test_resumed_run_keeps_appending_to_same_run(tmp_path):
+    journal = RunJournal('upload', journal_dir=str(tmp_path))
+    run_id = journal.start_run([{'id': 'A'}], _key)
+    journal.close()
+
+    resumed = RunJournal('upload', journal_dir=str(tmp_path))
+    resumed.resume_run()
+    assert resumed.run_id == run_id
+    resumed.record('A', RunJournal.WRITTEN_BACK)
+    resumed.close()
+
+    entries = RunJournal('upload', journal_dir=str(tmp_path)).resume_run()
+    assert entries['A']['state'] == RunJournal.WRITTEN_BACK
+
+
+def test_sent_is_on_disk_before_request_goes_out(tmp_path):
+    # 分组落盘阈值很大时，sent仍需立即落盘；进程在发送后崩溃，续跑必须看到sent
+    journal = RunJournal('split', journal_dir=str(tmp_path), fsync_batch=1000, fsync_interval=3600)
+    journal.start_run([{'id': 'A'}, {'id': 'B'}], _key)
+    journal.record('A', RunJournal.SENT)
+
+    entries = RunJournal('split', journal_dir=str(tmp_path)).resume_run()
+    assert entries['A']['state'] == RunJournal.SENT
+    assert entries['B']['state'] == RunJournal.CLAIMED
+
+
+def test_new_run_discards_previous_run(tmp_path):
+    journal = RunJournal('upload', journal_dir=str(tmp_path))
+    journal.start_run([{'id': 'OLD'}], _key)
+    journal.record('OLD', RunJournal.SENT)
+    journal.start_run([{'id': 'NEW'}], _key)
+    journal.close()
+
+    entries = RunJournal('upload', journal_dir=str(tmp_path)).resume_run()
+    assert list(entries) == ['NEW']
+
+
+def test_record_without_open_run_is_ignored(tmp_path):
+    journal = RunJournal('upload', journal_dir=str(tmp_path))
+    journal.record('A', RunJournal.SENT)
+    journal.finish_run()
+    assert journal.resume_run() is None
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""分账前余额预检测试（需要分账演示模块的运行依赖，不连接数据库和接口）"""
+
+import logging
+
+import pytest
+
+pytest.importorskip('cx_Oracle')
+pytest.importorskip('requests')
+
+from split_account_demo import SplitAccountDemo  # noqa: E402
+
+
+class _Balance:
+    def __init__(self, available_balance):
+        self.available_balance = available_balance
+
+
+class _Response:
+    def __init__(self, available_balance):
+        self.data = _Balance(available_balance)
+
+    def is_success(self):
+        return True
+
+    def get_error_message(self):
+        return ''
+
+
+class _BalanceHandler:
+    """按商户号返回固定可用余额的余额查询处理器"""
+
+    def __init__(self, balances):
+        self.balances = balances
+        self.queries = []
+
+    def query_single_balance(self, merchant_id, account_type=None):
+        self.queries.append(merchant_id)
+        return _Response(self.balances[str(merchant_id)])
+
+
+def _demo(balances):
+    demo = SplitAccountDemo.__new__(SplitAccountDemo)
+    demo.logger = logging.getLogger('test_split_preflight')
+    demo.balance_handler = _BalanceHandler(balances)
+    demo.deferred_orders = []
+    return demo
+
+
+def _regular_order(xpbillid, payer, jms_amount, gs_amount):
+    return {'billid': 'B1', 'xpbillid': xpbillid, 'payer_merchant_id': payer, 'payer_type': '1',
+            'payee_jms_merchant_id': '200001', 'payee_gs_merchant_id': '200002', 'payee_target_merchant_id': None,
+            'jms_amount': jms_amount, 'gs_amount': gs_amount, 'marketing_transfer_amount': 0,
+            'total_amount': jms_amount + gs_amount}
+
+
+def _marketing_order(xpbillid, payer, jms_amount, gs_amount, marketing_amount):
+    # 营销转账模式：total_amount含常规分账金额，但付款方（营销子账号）只扣营销转账金额
+    return {'billid': 'B1', 'xpbillid': xpbillid, 'payer_merchant_id': payer, 'payer_type': '1',
+            'payee_jms_merchant_id': None, 'payee_gs_merchant_id': None, 'payee_target_merchant_id': '300001',
+            'jms_amount': jms_amount, 'gs_amount': gs_amount, 'marketing_transfer_amount': marketing_amount,
+            'total_amount': jms_amount + gs_amount + marketing_amount, 'payaccoutgsyx': payer}
+
+
+def test_marketing_order_needs_only_marketing_transfer_amount():
+    demo = _demo({'100001': 500})
+    order = _marketing_order('XP1', '100001', jms_amount=3000, gs_amount=2000, marketing_amount=500)
+
+    runnable, deferred = demo.preflight_split_orders([order])
+    assert runnable == [order]
+    assert deferred == []
+
+
+def test_marketing_order_deferred_when_transfer_not_covered():
+    demo = _demo({'100001': 499})
+    order = _marketing_order('XP1', '100001', jms_amount=0, gs_amount=0, marketing_amount=500)
+
+    runnable, deferred = demo.preflight_split_orders([order])
+    assert runnable == []
+    assert deferred == [order]
+    assert order['defer_reason'] == SplitAccountDemo.DEFER_INSUFFICIENT_BALANCE
+
+
+def test_balance_is_allocated_cumulatively_per_payer():
+    demo = _demo({'100001': 1000, '100002': 100})
+    orders = [_regular_order('XP1', '100001', 400, 200),
+              _regular_order('XP2', '100002', 50, 50),
+              _regular_order('XP3', '100001', 300, 200),
+              _marketing_order('XP4', '100001', 5000, 5000, 400)]
+
+    runnable, deferred = demo.preflight_split_orders(orders)
+    assert [order['xpbillid'] for order in runnable] == ['XP1', 'XP2', 'XP4']
+    assert [order['xpbillid'] for order in deferred] == ['XP3']
+    # 每个付款方只查询一次余额
+    assert sorted(demo.balance_handler.queries) == [100001, 100002]
+
+
+def test_batch_split_spends_balance_on_higher_priority_orders_first(monkeypatch):
+    import split_account_demo
+
+    demo = _demo({'100001': 1000})
+    low = _regular_order('XP_LOW', '100001', 600, 0)
+    high = _regular_order('XP_HIGH', '100001', 800, 0)
+    sent = []
+    monkeypatch.setattr(split_account_demo.RunJournal, 'from_config', classmethod(lambda cls, *args, **kwargs: None))
+    demo.get_split_orders_from_database = lambda: [low, high]
+    # 数据库顺序为 low、high，优先级排序把 high 排在前面
+    demo._prioritize_orders = lambda orders: sorted(orders, key=lambda order: -order['total_amount'])
+    demo.split_single_order = lambda order, journal=None: sent.append(order['xpbillid']) or []
+
+    demo.batch_split_orders()
+    assert sent == ['XP_HIGH']
+    assert [order['xpbillid'] for order in demo.deferred_orders] == ['XP_LOW']
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""SQL语句指纹测试"""
+
+import pytest
+
+from common.SqlStats import InstrumentedConnection, SqlStatsRegistry, fingerprint
+
+
+def test_literals_are_replaced():
+    assert fingerprint("select * from t where a = 'x' and b = 12.5") == "SELECT * FROM T WHERE A = ? AND B = ?"
+
+
+def test_escaped_quote_inside_string():
+    assert fingerprint("select 'it''s' from dual") == "SELECT ? FROM DUAL"
+
+
+def test_whitespace_and_case_are_normalised():
+    assert fingerprint("SELECT  a\n  FROM   t\n") == fingerprint("select a from t")
+
+
+def test_bind_variables_are_kept():
+    assert fingerprint("select a from t where id = :id") == "SELECT A FROM T WHERE ID = :ID"
+
+
+def test_identifiers_with_digits_are_kept():
+    assert fingerprint("select col1 from p_bl_draw_hd2") == "SELECT COL1 FROM P_BL_DRAW_HD2"
+
+
+def test_same_statement_with_different_values_shares_fingerprint():
+    assert fingerprint("update t set x = 1 where id = 'A'") == fingerprint("update t set x = 2 where id = 'B'")
+
+
+class _FakeCursor:
+    """按arraysize分批返回结果的DB-API游标"""
+
+    def __init__(self, rows=(), arraysize=2):
+        self.rows = list(rows)
+        self.arraysize = arraysize
+        self.executed = []
+        self.description = None
+        self.rowcount = 0
+        self.fetchmany_calls = 0
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        self.description = [('c',)] if sql.lstrip().upper().startswith(('SELECT', 'WITH')) else None
+        self.rowcount = 3 if self.description is None else 0
+
+    def fetchmany(self, size=None):
+        self.fetchmany_calls += 1
+        batch, self.rows = self.rows[:size or self.arraysize], self.rows[size or self.arraysize:]
+        return batch
+
+    def fetchall(self):
+        batch, self.rows = self.rows, []
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_iterating_cursor_fetches_one_batch_per_round_trip():
+    registry = SqlStatsRegistry(slow_threshold_ms=10000)
+    fake = _FakeCursor(rows=[(n,) for n in range(5)], arraysize=2)
+    cursor = InstrumentedConnection(_FakeConnection(fake), registry).cursor()
+    cursor.execute("select c from t")
+
+    seen = []
+    for row in cursor:
+        seen.append(row)
+        if len(seen) == 1:
+            # 逐行迭代不应一次性取回整个结果集
+            assert fake.fetchmany_calls == 1
+    assert seen == [(n,) for n in range(5)]
+
+    stats = registry.summary()[0]
+    assert stats['executions'] == 1
+    assert stats['rows'] == 5
+    # 1次执行 + 3批数据 + 1次空批确认结束
+    assert stats['round_trips'] == 5
+
+
+def test_dml_rows_come_from_rowcount():
+    registry = SqlStatsRegistry(slow_threshold_ms=10000)
+    cursor = InstrumentedConnection(_FakeConnection(_FakeCursor()), registry).cursor()
+    cursor.execute("update t set a = 1 where b = 2")
+    cursor.execute("update t set a = 5 where b = 6")
+    stats = registry.summary()[0]
+    assert (stats['executions'], stats['rows']) == (2, 6)
+
+
+def test_failed_execute_is_counted_as_error():
+    class _Failing(_FakeCursor):
+        def execute(self, sql, params=None):
+            raise RuntimeError('ORA-00942')
+
+    registry = SqlStatsRegistry()
+    cursor = InstrumentedConnection(_FakeConnection(_Failing()), registry).cursor()
+    with pytest.raises(RuntimeError):
+        cursor.execute("select * from missing")
+    assert registry.summary()[0]['errors'] == 1
+
+
+def test_plan_is_requested_once_per_slow_fingerprint():
+    registry = SqlStatsRegistry(slow_threshold_ms=100, capture_plans=True)
+    assert not registry.record_execute("select 1 from t", 0.05)
+    assert registry.record_execute("select 2 from t", 0.2)
+    registry.record_plan("select 3 from t", "PLAN")
+    assert not registry.record_execute("select 4 from t", 0.2)
+
+
+def test_summary_is_ordered_by_total_time():
+    registry = SqlStatsRegistry(slow_threshold_ms=10000)
+    registry.record_execute("select a from t1", 0.1)
+    registry.record_execute("select a from t2", 0.3)
+    registry.record_execute("select a from t1", 0.1)
+    assert [row['sql'] for row in registry.summary()] == ["select a from t2", "select a from t1"]
+
+
+def test_plan_is_captured_outside_business_transaction(monkeypatch):
+    pytest.importorskip('cx_Oracle')
+    from contextlib import contextmanager
+    from common import OraclePool
+
+    plan_cursor = _FakeCursor(rows=[('| 0 | SELECT STATEMENT |',)])
+    plan_connection = _FakeConnection(plan_cursor)
+
+    @contextmanager
+    def fake_pooled_connection(logger=None, instrument=True):
+        assert not instrument
+        yield plan_connection
+
+    monkeypatch.setattr(OraclePool, 'pooled_connection', fake_pooled_connection)
+
+    registry = SqlStatsRegistry(slow_threshold_ms=0, capture_plans=True)
+    business_cursor = _FakeCursor()
+    business = InstrumentedConnection(_FakeConnection(business_cursor), registry)
+    business.cursor().execute("update t set a = :a where b = :b", {'a': 1, 'b': 2})
+
+    # 业务连接上只有业务语句，EXPLAIN PLAN 和清理语句在另借的连接上执行并提交
+    assert business_cursor.executed == [("update t set a = :a where b = :b", {'a': 1, 'b': 2})]
+    assert plan_cursor.executed[0][0].startswith("EXPLAIN PLAN")
+    assert plan_cursor.executed[0][1] == {'a': 1, 'b': 2}
+    assert plan_connection.commits == 1
+    assert registry.summary()[0]['plan'] == '| 0 | SELECT STATEMENT |'
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""增量抽取水位测试"""
+
+from datetime import datetime
+
+from common.Watermark import WatermarkStore, WatermarkTracker
+
+
+def test_no_watermark_means_full_sweep(tmp_path):
+    store = WatermarkStore(str(tmp_path / 'wm.json'))
+    assert store.get('upload') is None
+    assert store.needs_full_sweep('upload', 60)
+
+
+def test_watermark_only_moves_forward(tmp_path):
+    store = WatermarkStore(str(tmp_path / 'wm.json'))
+    store.advance('upload', datetime(2025, 8, 29, 10, 0, 0), 'XP002')
+    store.advance('upload', datetime(2025, 8, 29, 9, 0, 0), 'XP009')
+    store.advance('upload', datetime(2025, 8, 29, 10, 0, 0), 'XP001')
+    assert store.get('upload') == (datetime(2025, 8, 29, 10, 0, 0), 'XP002')
+
+    store.advance('upload', datetime(2025, 8, 29, 10, 0, 0), 'XP003')
+    assert store.get('upload') == (datetime(2025, 8, 29, 10, 0, 0), 'XP003')
+
+
+def test_string_paytime_keeps_its_type(tmp_path):
+    store = WatermarkStore(str(tmp_path / 'wm.json'))
+    store.advance('split', '20250829100000', 'XP1')
+    assert store.get('split') == ('20250829100000', 'XP1')
+
+
+def test_watermark_persists_across_instances(tmp_path):
+    path = str(tmp_path / 'wm.json')
+    store = WatermarkStore(path)
+    store.advance('upload', datetime(2025, 8, 29, 10, 0, 0), 'XP1')
+    store.mark_full_sweep('upload')
+
+    reloaded = WatermarkStore(path)
+    assert reloaded.get('upload') == (datetime(2025, 8, 29, 10, 0, 0), 'XP1')
+    assert not reloaded.needs_full_sweep('upload', 60)
+
+
+def test_request_full_sweep(tmp_path):
+    store = WatermarkStore(str(tmp_path / 'wm.json'))
+    store.advance('upload', datetime(2025, 8, 29, 10, 0, 0), 'XP1')
+    store.mark_full_sweep('upload')
+    store.request_full_sweep('upload')
+    assert store.needs_full_sweep('upload', 60)
+
+
+def test_corrupt_state_file_falls_back_to_full_sweep(tmp_path):
+    path = tmp_path / 'wm.json'
+    path.write_text('{not json', encoding='utf-8')
+    store = WatermarkStore(str(path))
+    assert store.get('upload') is None
+    assert store.needs_full_sweep('upload', 60)
+
+
+def _tracker(tmp_path, full_sweep=False):
+    store = WatermarkStore(str(tmp_path / 'wm.json'))
+    rows = [(datetime(2025, 8, 29, 10, n, 0), f"XP{n}") for n in range(4)]
+    tracker = WatermarkTracker(store, 'upload', full_sweep)
+    for paytime, key in rows:
+        tracker.add(paytime, key)
+    return store, tracker, rows
+
+
+def test_tracker_does_not_move_watermark_before_commit(tmp_path):
+    # 抽取后、上传前进程崩溃：水位不能越过尚未上传的行
+    store, tracker, rows = _tracker(tmp_path)
+    for _, key in rows:
+        tracker.mark_done(key)
+    assert store.get('upload') is None
+
+
+def test_tracker_stops_before_first_failed_row(tmp_path):
+    store, tracker, rows = _tracker(tmp_path)
+    tracker.mark_done('XP0')
+    tracker.mark_done('XP1', success=False)
+    tracker.mark_done('XP2')
+    tracker.mark_done('XP3')
+    assert tracker.commit() == rows[0]
+    assert store.get('upload') == rows[0]
+
+
+def test_tracker_stops_before_unprocessed_row(tmp_path):
+    # 运行被停止或订单被延后：后面的行即使成功也不推进水位
+    store, tracker, rows = _tracker(tmp_path)
+    tracker.mark_done('XP0')
+    tracker.mark_done('XP1')
+    tracker.mark_done('XP3')
+    assert tracker.commit() == rows[1]
+
+
+def test_row_with_two_orders_needs_both(tmp_path):
+    store = WatermarkStore(str(tmp_path / 'wm.json'))
+    tracker = WatermarkTracker(store, 'upload')
+    tracker.add(datetime(2025, 8, 29, 10, 0, 0), 'XP0', pending=2)
+    tracker.mark_done('XP0')
+    assert tracker.commit() is None
+    tracker.mark_done('XP0')
+    assert tracker.commit() == (datetime(2025, 8, 29, 10, 0, 0), 'XP0')
+
+
+def test_row_without_orders_does_not_block(tmp_path):
+    store = WatermarkStore(str(tmp_path / 'wm.json'))
+    tracker = WatermarkTracker(store, 'upload')
+    tracker.add(datetime(2025, 8, 29, 10, 0, 0), 'XP0', pending=0)
+    tracker.add(datetime(2025, 8, 29, 10, 1, 0), 'XP1')
+    tracker.mark_done('XP1')
+    assert tracker.commit() == (datetime(2025, 8, 29, 10, 1, 0), 'XP1')
+
+
+def test_failed_run_keeps_previous_watermark(tmp_path):
+    store, tracker, rows = _tracker(tmp_path)
+    store.advance('upload', datetime(2025, 8, 29, 9, 0, 0), 'XP_OLD')
+    tracker.mark_done('XP0', success=False)
+    assert tracker.commit() is None
+    assert store.get('upload') == (datetime(2025, 8, 29, 9, 0, 0), 'XP_OLD')
+
+
+def test_full_sweep_is_recorded_on_commit(tmp_path):
+    store, tracker, rows = _tracker(tmp_path, full_sweep=True)
+    tracker.mark_done('XP0')
+    assert store.needs_full_sweep('upload', 60)
+    tracker.commit()
+    assert not store.needs_full_sweep('upload', 60)
+
+
+def test_unknown_key_is_ignored(tmp_path):
+    store, tracker, rows = _tracker(tmp_path)
+    tracker.mark_done('NOT_EXTRACTED')
+    assert tracker.commit() is None
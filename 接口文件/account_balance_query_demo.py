@@ -19,6 +19,7 @@ from datetime import datetime
 import threading
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import hashlib
 import base64
@@ -29,6 +30,11 @@ from Crypto.Hash import SHA256
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from common.BalanceCache import get_balance_cache
+from common.LogPipeline import route_logger
+from common.NotificationOutbox import WeChatOutbox
+from common.SqlStats import instrument_connection
+
 try:
     from config_adapter import config_adapter
 except ImportError:
@@ -54,6 +60,10 @@ except ImportError:
         def get_account_balance_auto_interval():
             return 10
 
+        @staticmethod
+        def get_account_balance_query_workers():
+            return 4
+
         @staticmethod
         def get_db_connection_info():
             return "mmserp", "mu89so7mu", "47.102.84.152:1521/mmserp"
@@ -115,12 +125,13 @@ class MerchantInfo:
 
     def __init__(self, merchant_id: int, store_no: str = "",
                  bill_id: str = "", total_amount: float = 0,
-                 merchant_name: str = ""):
+                 merchant_name: str = "", bill_time=None):
         self.merchant_id = merchant_id
         self.store_no = store_no
         self.bill_id = bill_id
         self.total_amount = total_amount
         self.merchant_name = merchant_name
+        self.bill_time = bill_time  # 账单时间，同一账户内按此排优先级
 
 
 class DatabaseManager:
@@ -129,6 +140,7 @@ class DatabaseManager:
     def __init__(self, logger: logging.Logger):
         self.logger = logger
         self.connection = None
+        self.outbox = WeChatOutbox.from_config(logger)
 
     def connect(self):
         """连接数据库"""
@@ -140,12 +152,12 @@ class DatabaseManager:
             user, password, dsn = config_adapter.get_db_connection_info()
 
             # 建立连接
-            self.connection = cx_Oracle.connect(
+            self.connection = instrument_connection(cx_Oracle.connect(
                 user=user,
                 password=password,
                 dsn=dsn,
                 encoding="UTF-8"
-            )
+            ), self.logger)
 
             self.logger.info(f"[数据库] 数据库连接成功 - {user}@{dsn}")
             return True
@@ -171,10 +183,10 @@ class DatabaseManager:
             SELECT hd.ymshanghuhao as merchant_id, 
                    hd.storeid as store_no, 
                    hd.billid, 
-                   hd.totalamount
+                   hd.totalamount,
+                   hd.uptime
             FROM P_BL_SELL_PAYAMOUNT_HZ_hd hd 
-            WHERE hd.allresult_check_sign='Y' 
-            AND hd.BALANCE_MONEY_SIGN='N'
+            WHERE CASE WHEN hd.BALANCE_MONEY_SIGN = 'N' AND hd.ALLRESULT_CHECK_SIGN = 'Y' THEN 'N' END = 'N'
             AND ROWNUM <= 100
             ORDER BY hd.uptime DESC
             """
@@ -184,13 +196,14 @@ class DatabaseManager:
 
             merchants = []
             for row in results:
-                merchant_id, store_no, bill_id, total_amount = row
+                merchant_id, store_no, bill_id, total_amount, bill_time = row
                 merchants.append(MerchantInfo(
                     merchant_id=int(merchant_id) if merchant_id else 0,
                     store_no=store_no or "",
                     bill_id=bill_id or "",
                     total_amount=float(total_amount) / 100.0 if total_amount else 0.0,  # 转换为元
-                    merchant_name=""  # 移除无效的字段
+                    merchant_name="",  # 移除无效的字段
+                    bill_time=bill_time
                 ))
 
             cursor.close()
@@ -248,51 +261,24 @@ class DatabaseManager:
                     pass
             return False
 
-    def send_wechat_message(self, merchant_id: int, message: str) -> bool:
-        """发送企业微信消息"""
-        try:
-            if not self.connection:
-                if not self.connect():
-                    return False
-
-            cursor = self.connection.cursor()
-
-            # 获取下一个序列号
-            max_series_sql = "SELECT NVL(MAX(series), 0) + 1 FROM d_qiye_sendmsg"
-            cursor.execute(max_series_sql)
-            next_series = cursor.fetchone()[0]
-
-            # 插入消息SQL
-            sql = """
-            INSERT INTO d_qiye_sendmsg (SERIES, STAFFID, MSG, TYPEID, AGENTID)
-            VALUES (:series, :staff_id, :message, '002', '3091828666')
-            """
-
-            # 根据商户ID查找对应的员工ID
-            staff_id = f"GP"
-
-            cursor.execute(sql, {
-                'series': next_series,
-                'staff_id': staff_id,
-                'message': message
-            })
-
-            # 提交事务
-            self.connection.commit()
-            cursor.close()
+    def send_wechat_message(self, merchant_id: int, message: str, category: str = 'default') -> bool:
+        """
+        发送企业微信消息：先放入发件箱，由flush_wechat_messages统一写入
+        同一商户同类消息在去重窗口内只发送一次
 
-            self.logger.info(f"[数据库] 发送企业微信消息成功 - 商户: {merchant_id}, 序列号: {next_series}")
-            return True
+        Returns:
+            bool: 是否已放入发件箱（去重窗口内重复的返回False）
+        """
+        return self.outbox.enqueue(merchant_id, message, category)
 
-        except Exception as e:
-            self.logger.error(f"[数据库] 发送企业微信消息失败: {str(e)}")
-            # 回滚事务
-            if self.connection:
-                try:
-                    self.connection.rollback()
-                except:
-                    pass
-            return False
+    def flush_wechat_messages(self) -> int:
+        """把发件箱中的企业微信消息合并后批量写入数据库，返回写入条数"""
+        if not self.outbox.pending_count():
+            return 0
+        if not self.connection:
+            if not self.connect():
+                return 0
+        return self.outbox.flush(self.connection)
 
     def close(self):
         """关闭数据库连接"""
@@ -367,7 +353,19 @@ class ApiClient:
 
     def query_balance(self, merchant_id: int, account_type: str = "1",
                       store_no: str = "") -> AccountBalanceQueryResponse:
-        """查询商户余额"""
+        """查询商户余额（短期缓存，同一账户的并发查询合并为一次接口调用）"""
+        balance_cache = get_balance_cache(self.logger)
+        if balance_cache is None:
+            return self._query_balance_remote(merchant_id, account_type, store_no)
+        return balance_cache.get_or_load(
+            ('api_client', str(merchant_id), account_type, store_no or ''),
+            lambda: self._query_balance_remote(merchant_id, account_type, store_no),
+            cacheable=lambda response: response.is_success()
+        )
+
+    def _query_balance_remote(self, merchant_id: int, account_type: str = "1",
+                              store_no: str = "") -> AccountBalanceQueryResponse:
+        """调用接口查询商户余额（不经过缓存）"""
         try:
             # 构建业务参数
             biz_content = {
@@ -531,7 +529,7 @@ class AccountBalanceQueryDemo:
             handler.setFormatter(formatter)
             logger.addHandler(handler)
             logger.setLevel(logging.INFO)
-        return logger
+        return route_logger(logger)
 
     def set_progress_callback(self, callback: Callable):
         """设置进度回调函数"""
@@ -634,89 +632,45 @@ class AccountBalanceQueryDemo:
                     })
                 return {}
 
-            self.logger.info(f"[账户余额查询] 找到 {len(merchant_list)} 个商户需要查询")
+            # 按(商户号, 门店号)分组，每个账户只查询一次余额
+            account_bills = {}
+            for merchant_info in merchant_list:
+                account_bills.setdefault((merchant_info.merchant_id, merchant_info.store_no), []).append(merchant_info)
+
+            self.logger.info(
+                f"[账户余额查询] 找到 {len(merchant_list)} 笔待检查账单，涉及 {len(account_bills)} 个账户")
 
             if self.progress_callback:
-                self.progress_callback(f"开始批量查询 {len(merchant_list)} 个商户...", 20)
+                self.progress_callback(f"开始并发查询 {len(account_bills)} 个账户余额...", 20)
+
+            # 并发查询各账户余额（批量查询固定为付款账户）
+            balances = self._query_account_balances(list(account_bills.keys()))
 
-            # 执行批量查询
+            if self.progress_callback:
+                self.progress_callback("余额查询完成，开始核对账单...", 80)
+
+            # 执行余额核对
             results = {}
             success_count = 0
             sufficient_count = 0
             insufficient_count = 0
 
-            for i, merchant_info in enumerate(merchant_list):
-                try:
-                    # 更新进度
-                    progress = 20 + (i + 1) * 60 / len(merchant_list)
-                    if self.progress_callback:
-                        self.progress_callback(f"查询商户 {merchant_info.merchant_id}...", progress)
-
-                    # 查询余额（批量查询固定为付款账户）
-                    response = self.api_client.query_balance(
-                        merchant_id=merchant_info.merchant_id,
-                        account_type="1",  # 付款账户
-                        store_no=merchant_info.store_no
-                    )
+            for (merchant_id, store_no), bills in account_bills.items():
+                response = balances[(merchant_id, store_no)]
+                results[merchant_id] = response
 
-                    results[merchant_info.merchant_id] = response
-
-                    if response.is_success():
-                        success_count += 1
-
-                        # 检查余额是否足够
-                        total_balance = response.get_total_balance_yuan()
-                        required_amount = merchant_info.total_amount
-
-                        if total_balance >= required_amount:
-                            # 余额充足，更新标志位
-                            update_success = self.db_manager.update_balance_sign(
-                                merchant_info.merchant_id,
-                                merchant_info.bill_id
-                            )
-
-                            if update_success:
-                                sufficient_count += 1
-                                self.logger.info(
-                                    f"[账户余额查询] 商户 {merchant_info.merchant_id} 余额充足({total_balance:.2f}元>={required_amount:.2f}元)，已更新标志位")
-                            else:
-                                self.logger.error(f"[账户余额查询] 商户 {merchant_info.merchant_id} 更新标志位失败")
-                        else:
-                            # 余额不足，发送通知
-                            insufficient_count += 1
-                            message = (f"你好，我是小木木，现在友情提醒你，"
-                                       f"商户 {merchant_info.merchant_id} 账户余额不足，"
-                                       f"当前余额: {total_balance:.2f}元，"
-                                       f"需要金额: {required_amount:.2f}元，"
-                                       f"请及时充值。"
-                                       f"时间戳：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-
-                            self.db_manager.send_wechat_message(
-                                merchant_info.merchant_id,
-                                message
-                            )
-
-                            self.logger.warning(
-                                f"[账户余额查询] 商户 {merchant_info.merchant_id} 余额不足({total_balance:.2f}元<{required_amount:.2f}元)，已发送通知")
-                    else:
-                        self.logger.error(
-                            f"[账户余额查询] 商户 {merchant_info.merchant_id} 查询失败: {response.get_error_message()}")
-
-                    # 添加小延迟避免频繁调用
-                    time.sleep(0.2)
-
-                except Exception as e:
-                    self.logger.error(f"[账户余额查询] 处理商户 {merchant_info.merchant_id} 时异常: {str(e)}")
-
-                    # 创建错误响应
-                    error_response = AccountBalanceQueryResponse(
-                        request_id=f"error_{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                        code=50000,
-                        msg="处理异常",
-                        sub_msg=str(e),
-                        success=False
-                    )
-                    results[merchant_info.merchant_id] = error_response
+                if not response.is_success():
+                    self.logger.error(
+                        f"[账户余额查询] 商户 {merchant_id} 查询失败: {response.get_error_message()}")
+                    continue
+
+                success_count += 1
+                sufficient, insufficient = self._allocate_balance(merchant_id, response, bills)
+                sufficient_count += sufficient
+                insufficient_count += insufficient
+
+            # 本批次的余额不足通知合并后一次写入
+            self.db_manager.flush_wechat_messages()
 
             self.logger.info(
                 f"[账户余额查询] 批量查询完成 - 总数: {len(results)}, 成功: {success_count}, 余额充足: {sufficient_count}, 余额不足: {insufficient_count}")
@@ -746,6 +700,89 @@ class AccountBalanceQueryDemo:
 
             return {}
 
+    def _query_account_balances(self, accounts: List[tuple]) -> Dict[tuple, AccountBalanceQueryResponse]:
+        """
+        并发查询多个账户的付款账户余额
+
+        Args:
+            accounts: [(商户号, 门店号)]
+
+        Returns:
+            dict: (商户号, 门店号) -> 查询结果
+        """
+        def query(account):
+            merchant_id, store_no = account
+            try:
+                return self.api_client.query_balance(
+                    merchant_id=merchant_id,
+                    account_type="1",  # 付款账户
+                    store_no=store_no
+                )
+            except Exception as e:
+                self.logger.error(f"[账户余额查询] 查询商户 {merchant_id} 余额时异常: {str(e)}")
+                return AccountBalanceQueryResponse(
+                    request_id=f"error_{datetime.now().strftime('%Y%m%d%H%M%S')}",
+                    code=50000,
+                    msg="处理异常",
+                    sub_msg=str(e),
+                    success=False
+                )
+
+        if not accounts:
+            return {}
+
+        workers = max(1, min(config_adapter.get_account_balance_query_workers(), len(accounts)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='balance-query') as executor:
+            return dict(zip(accounts, executor.map(query, accounts)))
+
+    def _allocate_balance(self, merchant_id: int, response: AccountBalanceQueryResponse,
+                          bills: List[MerchantInfo]) -> tuple:
+        """
+        按优先级（账单时间从早到晚）累计占用账户余额，余额够的账单更新标志位，
+        第一笔不够的账单及其后的账单都视为余额不足，合并发送一条通知
+
+        Returns:
+            tuple: (余额充足账单数, 余额不足账单数)
+        """
+        total_balance = response.get_total_balance_yuan()
+        ordered_bills = sorted(bills, key=lambda b: (b.bill_time is None, b.bill_time or 0, b.bill_id))
+
+        allocated = 0.0
+        sufficient_count = 0
+        shortfall_bills = []
+
+        for index, bill in enumerate(ordered_bills):
+            if allocated + bill.total_amount > total_balance:
+                shortfall_bills = ordered_bills[index:]
+                break
+
+            allocated += bill.total_amount
+            if self.db_manager.update_balance_sign(merchant_id, bill.bill_id):
+                sufficient_count += 1
+                self.logger.info(
+                    f"[账户余额查询] 商户 {merchant_id} 账单 {bill.bill_id} 余额充足"
+                    f"(累计占用 {allocated:.2f}元/余额 {total_balance:.2f}元)，已更新标志位")
+            else:
+                self.logger.error(f"[账户余额查询] 商户 {merchant_id} 账单 {bill.bill_id} 更新标志位失败")
+
+        if shortfall_bills:
+            required_amount = allocated + sum(bill.total_amount for bill in shortfall_bills)
+            message = (f"你好，我是小木木，现在友情提醒你，"
+                       f"商户 {merchant_id} 账户余额不足，"
+                       f"当前余额: {total_balance:.2f}元，"
+                       f"需要金额: {required_amount:.2f}元"
+                       f"（{len(shortfall_bills)} 笔账单待处理），"
+                       f"请及时充值。"
+                       f"时间戳：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+            queued = self.db_manager.send_wechat_message(merchant_id, message, 'insufficient_balance')
+
+            self.logger.warning(
+                f"[账户余额查询] 商户 {merchant_id} 余额不足({total_balance:.2f}元<{required_amount:.2f}元)，"
+                f"{len(shortfall_bills)} 笔账单未通过，{'已加入通知' if queued else '近期已通知过'}")
+
+        return sufficient_count, len(shortfall_bills)
+
     def start_auto_query(self):
         """启动自动查询"""
         if self.auto_query_running:
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+失败单据重试演示
+文件名: dead_letter_redrive_demo.py
+功能: 从死信队列中取出已到重试时间的失败单据，按原业务方法小批量重新处理:
+    上传   → OrderUploadDemo.upload_single_order
+    分账   → SplitAccountDemo.split_single_order
+    充值   → RechargeAfterSplitDemo.recharge_single_order
+    提现   → WithdrawDemo.withdraw_single_order
+    各业务类在首次遇到该步骤的单据时才创建。成功的单据移出队列，失败的按指数退避推迟，
+    超过最大重试次数后转为搁置，人工处理后可用 --requeue 放回队列。
+
+用法:
+    python dead_letter_redrive_demo.py            # 重试一批到期单据
+    python dead_letter_redrive_demo.py --list     # 查看队列
+    python dead_letter_redrive_demo.py --requeue  # 把搁置的单据放回队列
+"""
+
+import logging
+import sys
+
+from common.DeadLetter import get_dead_letter_store
+from common.LogPipeline import route_logger
+from config import Config
+
+
+class DeadLetterRedriveDemo:
+    """失败单据重试演示类"""
+
+    def __init__(self, logger=None):
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger('DeadLetterRedrive')
+            if not self.logger.handlers:
+                handler = logging.StreamHandler()
+                formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+                handler.setFormatter(formatter)
+                self.logger.addHandler(handler)
+                self.logger.setLevel(logging.INFO)
+        # 日志经异步管道输出，不阻塞业务线程
+        route_logger(self.logger)
+
+        self.store = get_dead_letter_store(self.logger)
+        self._demos = {}
+
+    def _demo(self, stage):
+        """按业务步骤创建（并复用）对应的业务类"""
+        if stage not in self._demos:
+            if stage == 'upload':
+                from order_upload_demo import OrderUploadDemo
+                self._demos[stage] = OrderUploadDemo(self.logger)
+            elif stage == 'split':
+                from split_account_demo import SplitAccountDemo
+                self._demos[stage] = SplitAccountDemo(self.logger)
+            elif stage == 'recharge':
+                from recharge_after_split_demo import RechargeAfterSplitDemo
+                self._demos[stage] = RechargeAfterSplitDemo(self.logger)
+            elif stage == 'withdraw':
+                from withdraw_demo import WithdrawDemo
+                self._demos[stage] = WithdrawDemo(self.logger)
+        return self._demos[stage]
+
+    # ===== 各业务步骤的重试方法，返回单据是否最终处理成功 =====
+    def _redrive_upload(self, order_data):
+        return self._demo('upload').upload_single_order(order_data)
+
+    def _redrive_split(self, order_data):
+        demo = self._demo('split')
+        demo.split_single_order(order_data)
+        # 分账结果和回写结果都成功时业务类已把单据移出队列
+        return not self.store.contains(demo.DEAD_LETTER_STAGE,
+                                       f"{order_data['billid']}|{order_data.get('xpbillid', '')}")
+
+    def _redrive_recharge(self, order_data):
+        return self._demo('recharge').recharge_single_order(order_data)
+
+    def _redrive_withdraw(self, order_data):
+        result = self._demo('withdraw').withdraw_single_order(order_data)
+        return result['success'] and result.get('writeback', False)
+
+    def redrive(self, batch_size=None):
+        """
+        重试一批到期的失败单据
+        :return: {'total', 'success', 'failed', 'parked'}，未启用死信队列时返回None
+        """
+        if not self.store:
+            self.logger.warning("[失败重试] ⚠️ 死信队列未启用")
+            return None
+        if batch_size is None:
+            batch_size = Config.get_dead_letter_config().get('BATCH_SIZE', 20)
+        handlers = {
+            'upload': self._redrive_upload,
+            'split': self._redrive_split,
+            'recharge': self._redrive_recharge,
+            'withdraw': self._redrive_withdraw,
+        }
+        return self.store.redrive(handlers, batch_size)
+
+    def print_queue(self, limit=100):
+        """输出队列统计和明细"""
+        if not self.store:
+            print("⚠️ 死信队列未启用")
+            return
+        stats = self.store.stats()
+        print("📮 死信队列统计:")
+        if not stats:
+            print("   (空)")
+        for (stage, status), count in sorted(stats.items()):
+            print(f"   {stage:<10} {status:<8} {count} 条")
+
+        items = self.store.list_items(limit=limit)
+        if items:
+            print(f"\n{'步骤':<10} {'单据':<36} {'失败类型':<10} {'次数':>4} {'状态':<8} {'下次重试':<20} 原因")
+            for item in items:
+                print(f"{item['stage']:<10} {item['item_key']:<36} {item['failure_class']:<10} "
+                      f"{item['attempts']:>4} {item['status']:<8} {item['next_eligible_time']:<20} "
+                      f"{(item['last_error'] or '')[:80]}")
+
+
+# ===== 主函数和调用示例 =====
+def run_demo(args=None):
+    """运行演示程序"""
+    args = sys.argv[1:] if args is None else args
+    print("📮 MUMUSO失败单据重试")
+    print("=" * 80)
+
+    demo = DeadLetterRedriveDemo()
+    if '--list' in args:
+        demo.print_queue()
+        return True
+
+    if '--requeue' in args:
+        if demo.store:
+            count = demo.store.requeue()
+            print(f"♻️ 已将 {count} 条搁置单据放回队列")
+        return True
+
+    ready, msg = Config.is_config_ready()
+    if not ready:
+        print(f"⚠️ 配置检查失败: {msg}")
+        return False
+
+    summary = demo.redrive()
+    if summary is not None:
+        print(f"\n🎉 重试完成: 共 {summary['total']} 条，成功 {summary['success']} 条，"
+              f"失败 {summary['failed']} 条，转为搁置 {summary['parked']} 条")
+    return True
+
+
+if __name__ == '__main__':
+    try:
+        run_demo()
+    except KeyboardInterrupt:
+        print("\n👋 程序退出")
+    except Exception as e:
+        print(f"❌ 程序异常: {str(e)}")
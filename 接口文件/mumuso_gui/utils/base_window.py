@@ -19,13 +19,10 @@ class LogHandler(logging.Handler):
     def __init__(self, log_queue):
         super().__init__()
         self.log_queue = log_queue
-        print(f"[DEBUG] LogHandler.__init__() - log_queue: {log_queue is not None}")
 
     def emit(self, record):
         try:
-            print(f"[DEBUG] LogHandler.emit() 开始 - 记录: {record.getMessage()}")
             log_entry = self.format(record)
-            print(f"[DEBUG] 格式化后的日志: {log_entry}")
 
             # 从日志消息中提取模块名
             module_name = "系统"
@@ -44,8 +41,6 @@ class LogHandler(logging.Handler):
             elif '[配置管理]' in log_entry:
                 module_name = "配置管理"
 
-            print(f"[DEBUG] 提取的模块名: {module_name}")
-
             log_dict = {
                 'level': record.levelname,
                 'message': log_entry,
@@ -53,18 +48,11 @@ class LogHandler(logging.Handler):
                 'time': datetime.now().strftime('%H:%M:%S')
             }
 
-            print(f"[DEBUG] 准备放入队列的日志字典: {log_dict}")
-
             if self.log_queue:
                 self.log_queue.put(log_dict)
-                print(f"[DEBUG] 日志已放入队列，当前队列大小: {self.log_queue.qsize()}")
-            else:
-                print(f"[DEBUG] log_queue为None，无法放入队列")
 
-        except Exception as e:
-            print(f"[DEBUG] LogHandler.emit() 发生异常: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            self.handleError(record)
 
 
 class BaseWindow:
@@ -176,6 +164,13 @@ class BaseWindow:
                 except Exception as fallback_error:
                     print(f"设置后备日志处理器也失败: {fallback_error}")
 
+        # 日志经异步管道输出，GUI处理器改由管道的监听线程调用，不阻塞业务线程
+        try:
+            from common.LogPipeline import route_logger
+            route_logger(self.logger)
+        except ImportError:
+            pass
+
     def show_window(self):
         """显示窗口"""
         if self.window is None:
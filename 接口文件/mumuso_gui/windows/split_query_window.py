@@ -105,13 +105,10 @@ except ImportError:
         def __init__(self, log_queue):
             super().__init__()
             self.log_queue = log_queue
-            print(f"[DEBUG] LogHandler.__init__() - log_queue: {log_queue is not None}")
 
         def emit(self, record):
             try:
-                print(f"[DEBUG] LogHandler.emit() 开始 - 记录: {record.getMessage()}")
                 log_entry = self.format(record)
-                print(f"[DEBUG] 格式化后的日志: {log_entry}")
 
                 # 从日志消息中提取模块名
                 module_name = "系统"
@@ -130,8 +127,6 @@ except ImportError:
                 elif '[配置管理]' in log_entry:
                     module_name = "配置管理"
 
-                print(f"[DEBUG] 提取的模块名: {module_name}")
-
                 log_dict = {
                     'level': record.levelname,
                     'message': log_entry,
@@ -139,18 +134,11 @@ except ImportError:
                     'time': datetime.now().strftime('%H:%M:%S')
                 }
 
-                print(f"[DEBUG] 准备放入队列的日志字典: {log_dict}")
-
                 if self.log_queue:
                     self.log_queue.put(log_dict)
-                    print(f"[DEBUG] 日志已放入队列，当前队列大小: {self.log_queue.qsize()}")
-                else:
-                    print(f"[DEBUG] log_queue为None，无法放入队列")
 
-            except Exception as e:
-                print(f"[DEBUG] LogHandler.emit() 发生异常: {e}")
-                import traceback
-                traceback.print_exc()
+            except Exception:
+                self.handleError(record)
 
 
     class BaseWindow:
@@ -7,14 +7,22 @@
 支持从数据库动态获取商户号和门店ID，适配生产环境需求
 """
 
-import json
-import time
 import uuid
 import logging
 from datetime import datetime
 import cx_Oracle
 
-from common.OpenClient import OpenClient
+from common.OpenClient import OpenClient, enable_debug_logging
+from common.Pipeline import StagePipeline
+from common.RunJournal import RunJournal
+from common.LogPipeline import route_logger
+from common.IdempotencyLedger import get_idempotency_ledger
+from common.DeadLetter import DeadLetterStore, get_dead_letter_store
+from common.Watermark import WatermarkTracker, get_watermark_store
+from common.Priority import PriorityScorer
+from common.ShardRunner import get_current_shard, shard_predicate
+from common.SqlStats import instrument_connection
+from common.StructLog import StructLogger
 from model.OrderUploadModel import OrderUploadModel
 from request.OrderUploadRequest import OrderUploadRequest
 from config import Config
@@ -24,6 +32,11 @@ from config_adapter import config_adapter
 class OrderUploadDemo:
     """订单上传演示类 - 支持动态商户号和门店ID版本"""
 
+    # 增量抽取水位的步骤名
+    WATERMARK_STAGE = 'order_upload'
+    # 死信队列的业务步骤名
+    DEAD_LETTER_STAGE = 'upload'
+
     def __init__(self, logger=None):
         self.config = Config
         self.client = OpenClient(Config.APP_ID, Config.PRIVATE_KEY, Config.get_url())
@@ -39,6 +52,22 @@ class OrderUploadDemo:
                 handler.setFormatter(formatter)
                 self.logger.addHandler(handler)
                 self.logger.setLevel(logging.INFO)
+        # 日志经异步管道输出，不阻塞业务线程
+        route_logger(self.logger)
+        # DEBUG级别时输出开放平台请求参数和原始响应
+        enable_debug_logging(self.logger)
+
+        # 逐单的结构化事件日志（每个步骤一条，详细内容只在DEBUG级别输出）
+        self.events = StructLogger(self.logger, '[订单上传]')
+
+        # 最近一次增量抽取的水位登记，订单处理成功后由调用方确认并提交
+        self.watermark_tracker = None
+
+        # 出站请求幂等台账（发送前检查，避免回写失败后重复上传）
+        self.ledger = get_idempotency_ledger(self.logger)
+
+        # 失败订单记入死信队列，由定时重试任务重新上传
+        self.dead_letters = get_dead_letter_store(self.logger)
 
         # 记录配置策略
         merchant_strategy = "动态获取" if Config.should_use_dynamic_merchant_id() else "配置文件固定"
@@ -52,15 +81,22 @@ class OrderUploadDemo:
         try:
             user, password, dsn = Config.get_db_connection_info()
             self.logger.info(f"[订单上传] 正在连接数据库: {dsn}")
-            connection = cx_Oracle.connect(user, password, dsn)
+            connection = instrument_connection(cx_Oracle.connect(user, password, dsn), self.logger)
             self.logger.info(f"[订单上传] ✅ 数据库连接成功: {dsn}")
             return connection
         except Exception as e:
             self.logger.error(f"[订单上传] ❌ 数据库连接失败: {str(e)}")
             return None
 
-    def get_orders_from_database(self):
-        """从数据库获取待上传的订单（支持动态商户号和门店ID）"""
+    def get_orders_from_database(self, incremental=False):
+        """
+        从数据库获取待上传的订单（支持动态商户号和门店ID）
+        :param incremental: 是否增量抽取：只扫描上次水位 (paytime, xpbillid) 之后的行，
+                            到达全量扫描间隔时仍做一次全量扫描补漏；默认全量。
+                            增量抽取时读出的行登记到 self.watermark_tracker，水位不在这里推进，
+                            由调用方在订单处理成功后按 order_id 确认并 commit()
+        """
+        self.watermark_tracker = None
         connection = self.get_database_connection()
         if not connection:
             return []
@@ -68,6 +104,14 @@ class OrderUploadDemo:
         try:
             cursor = connection.cursor()
 
+            store = get_watermark_store(self.logger) if incremental else None
+            watermark = None
+            full_sweep = True
+            if store is not None:
+                sweep_minutes = Config.get_incremental_extract_config().get('FULL_SWEEP_MINUTES', 60)
+                full_sweep = store.needs_full_sweep(self.WATERMARK_STAGE, sweep_minutes)
+                watermark = None if full_sweep else store.get(self.WATERMARK_STAGE)
+
             # 修正后的SQL - 包含商户号和门店ID字段，按时间升序排列
             sql = """
             SELECT hd.billid, dt.xpbillid as order_id, dt.wxmoney, dt.zfbmoney, 
@@ -80,43 +124,55 @@ class OrderUploadDemo:
             and dt.paytype  in('001','002')
             and dt.xpbillid not like '%from%'
             AND (dt.WXMONEY <> 0 OR dt.zfbmoney <> 0 )
-            AND NVL(dt.ISUPLOAD_FZ, 'N') = 'N'
-            ORDER BY dt.paytime ASC
+            AND CASE WHEN NVL(dt.ISUPLOAD_FZ, 'N') = 'N' THEN 'N' END = 'N'
+            """
+            params = {}
+            if watermark is not None:
+                # 水位之后的行：paytime上的范围条件可以走索引，其余过滤条件只作用于新行
+                sql += """
+            AND (dt.paytime > :wm_paytime OR (dt.paytime = :wm_paytime AND dt.xpbillid > :wm_xpbillid))
+            """
+                params = {'wm_paytime': watermark[0], 'wm_xpbillid': watermark[1]}
+            shard_condition, shard_params = self._shard_condition()
+            if shard_condition:
+                sql += f"""
+            AND {shard_condition}
+            """
+                params.update(shard_params)
+            sql += """
+            ORDER BY dt.paytime ASC, dt.xpbillid ASC
             """
 
-            self.logger.info(f"[订单上传] 🔍 执行查询SQL (包含动态商户号和门店ID):")
-            self.logger.info(f"[订单上传] {sql}")
+            scan_mode = f"增量 (水位: {watermark[0]} / {watermark[1]})" if watermark is not None else "全量"
+            self.logger.info(f"[订单上传] 🔍 执行查询SQL (包含动态商户号和门店ID，{scan_mode})")
+            self.events.dump('查询SQL', sql)
 
-            cursor.execute(sql)
+            cursor.execute(sql, params)
             rows = cursor.fetchall()
 
             self.logger.info(f"[订单上传] 📊 数据库查询结果: 共找到 {len(rows)} 条记录")
 
+            # 结果按 (paytime, xpbillid) 升序登记，处理确认成功后才推进水位
+            tracker = WatermarkTracker(store, self.WATERMARK_STAGE, full_sweep) if store is not None else None
+
             orders = []
             for i, row in enumerate(rows, 1):
                 billid, order_id, wxmoney, zfbmoney, paytime, db_merchant_id, db_store_id = row
+                row_start = len(orders)
 
-                self.logger.info(f"[订单上传] 📋 处理第 {i} 条记录:")
-                self.logger.info(f"[订单上传]    billid: {billid}")
-                self.logger.info(f"[订单上传]    order_id: {order_id}")
-                self.logger.info(f"[订单上传]    wxmoney: {wxmoney}")
-                self.logger.info(f"[订单上传]    zfbmoney: {zfbmoney}")
-                self.logger.info(f"[订单上传]    paytime: {paytime}")
-                self.logger.info(f"[订单上传]    db_merchant_id: {db_merchant_id}")
-                self.logger.info(f"[订单上传]    db_store_id: {db_store_id}")
+                self.events.debug('📋 读取记录', seq=i, billid=billid, order_id=order_id, wxmoney=wxmoney,
+                                  zfbmoney=zfbmoney, paytime=paytime, db_merchant_id=db_merchant_id,
+                                  db_store_id=db_store_id)
 
                 # 处理订单时间 - 兼容字符串和日期对象
                 order_time_str = ''
                 if paytime:
                     if isinstance(paytime, str):
                         order_time_str = paytime
-                        self.logger.info(f"[订单上传]    时间格式: 字符串 -> {order_time_str}")
                     elif hasattr(paytime, 'strftime'):
                         order_time_str = paytime.strftime("%Y%m%d%H%M%S")
-                        self.logger.info(f"[订单上传]    时间格式: 日期对象 -> {order_time_str}")
                     else:
                         order_time_str = str(paytime)
-                        self.logger.info(f"[订单上传]    时间格式: 其他类型 -> {order_time_str}")
 
                 # 处理动态商户号和门店ID
                 final_merchant_id = self._process_merchant_id(db_merchant_id, billid)
@@ -136,8 +192,8 @@ class OrderUploadDemo:
                         'store_id': final_store_id  # 动态门店ID
                     }
                     orders.append(order_data)
-                    self.logger.info(
-                        f"[订单上传]    ✅ 添加微信支付订单: {wxmoney}元 (商户: {final_merchant_id}, 门店: {final_store_id})")
+                    self.events.debug('✅ 添加微信支付订单', order_id=order_id, amount=wxmoney,
+                                      merchant=final_merchant_id, store=final_store_id)
 
                 if zfbmoney and float(zfbmoney) > 0:
                     order_data = {
@@ -152,10 +208,14 @@ class OrderUploadDemo:
                         'store_id': final_store_id  # 动态门店ID
                     }
                     orders.append(order_data)
-                    self.logger.info(
-                        f"[订单上传]    ✅ 添加支付宝订单: {zfbmoney}元 (商户: {final_merchant_id}, 门店: {final_store_id})")
+                    self.events.debug('✅ 添加支付宝订单', order_id=order_id, amount=zfbmoney,
+                                      merchant=final_merchant_id, store=final_store_id)
+
+                if tracker is not None:
+                    tracker.add(paytime, order_id, len(orders) - row_start)
 
             cursor.close()
+            self.watermark_tracker = tracker
             self.logger.info(f"[订单上传] 📈 订单处理完成: 共生成 {len(orders)} 笔待上传订单")
             return orders
 
@@ -179,13 +239,13 @@ class OrderUploadDemo:
         if not Config.should_use_dynamic_merchant_id():
             # 使用配置文件中的固定商户号
             final_merchant_id = Config.get_fallback_merchant_id()
-            self.logger.info(f"[订单上传] 💼 使用固定商户号: {final_merchant_id} (billid: {billid})")
+            self.events.debug('💼 使用固定商户号', merchant=final_merchant_id, billid=billid)
             return final_merchant_id
 
         # 使用动态商户号
         if db_merchant_id and str(db_merchant_id).strip():
             final_merchant_id = str(db_merchant_id).strip()
-            self.logger.info(f"[订单上传] 💼 使用动态商户号: {final_merchant_id} (billid: {billid})")
+            self.events.debug('💼 使用动态商户号', merchant=final_merchant_id, billid=billid)
             return final_merchant_id
         else:
             # 动态获取失败，使用备用商户号
@@ -204,13 +264,13 @@ class OrderUploadDemo:
         if not Config.should_use_dynamic_store_id():
             # 使用配置文件中的固定门店ID
             final_store_id = Config.get_fallback_store_id()
-            self.logger.info(f"[订单上传] 🏪 使用固定门店ID: {final_store_id} (billid: {billid})")
+            self.events.debug('🏪 使用固定门店ID', store=final_store_id, billid=billid)
             return final_store_id
 
         # 使用动态门店ID
         if db_store_id and str(db_store_id).strip():
             final_store_id = str(db_store_id).strip()
-            self.logger.info(f"[订单上传] 🏪 使用动态门店ID: {final_store_id} (billid: {billid})")
+            self.events.debug('🏪 使用动态门店ID', store=final_store_id, billid=billid)
             return final_store_id
         else:
             # 动态获取失败，使用备用门店ID
@@ -249,10 +309,7 @@ class OrderUploadDemo:
                 AND xpbillid = :order_id
                 """
 
-                self.logger.info(f"[订单上传] 🔄 更新订单上传状态 - 成功:")
-                self.logger.info(f"[订单上传]    SQL: {sql}")
-                self.logger.info(f"[订单上传]    参数: billid={billid}, order_id={order_id}")
-                self.logger.info(f"[订单上传]    参数: upload_time={current_time}, request_no={request_no}")
+                self.events.dump('回写SQL', sql)
 
                 cursor.execute(sql, {
                     'upload_time': current_time,
@@ -274,10 +331,7 @@ class OrderUploadDemo:
                 AND xpbillid = :order_id
                 """
 
-                self.logger.info(f"[订单上传] 🔄 更新订单上传状态 - 失败:")
-                self.logger.info(f"[订单上传]    SQL: {sql}")
-                self.logger.info(f"[订单上传]    参数: billid={billid}, order_id={order_id}")
-                self.logger.info(f"[订单上传]    参数: upload_time={current_time}, request_no={request_no}")
+                self.events.dump('回写SQL', sql)
 
                 cursor.execute(sql, {
                     'upload_time': current_time,
@@ -290,7 +344,8 @@ class OrderUploadDemo:
             connection.commit()
 
             affected_rows = cursor.rowcount
-            self.logger.info(f"[订单上传] ✅ 数据库更新成功，影响行数: {affected_rows}")
+            self.events.info('🔄 回写', order_id=order_id, billid=billid, result='Y' if success else 'F',
+                             request_no=request_no, rows=affected_rows)
 
             cursor.close()
             return affected_rows > 0
@@ -317,12 +372,6 @@ class OrderUploadDemo:
         :param order_data: 数据库查询出的订单数据（包含动态商户号和门店ID）
         :return: request对象
         """
-        self.logger.info(f"[订单上传] 🔧 创建订单请求对象:")
-        self.logger.info(f"[订单上传]    订单号: {order_data['order_id']}")
-        self.logger.info(f"[订单上传]    支付方式: {order_data['payment_method']}")
-        self.logger.info(f"[订单上传]    动态商户号: {order_data['merchant_id']}")
-        self.logger.info(f"[订单上传]    动态门店ID: {order_data['store_id']}")
-
         # 创建请求对象
         request = OrderUploadRequest()
 
@@ -335,32 +384,19 @@ class OrderUploadDemo:
         model.merchant_id = order_data['merchant_id']  # 使用动态获取的商户号
         model.store_id = order_data['store_id']  # 使用动态获取的门店ID
 
-        self.logger.info(f"[订单上传]    机构号: {model.node_id}")
-        self.logger.info(f"[订单上传]    商户号: {model.merchant_id} (动态获取)")
-        self.logger.info(f"[订单上传]    门店ID: {model.store_id} (动态获取)")
-
         # ===== 用户指定的参数 =====
         model.order_upload_mode = config_adapter.get_order_upload_mode_normal()  # 普通订单上传模式
         model.account_type = config_adapter.get_account_type_normal()  # 普通订单账户类型
 
-        self.logger.info(f"[订单上传]    上传模式: {model.order_upload_mode} (普通订单)")
-        self.logger.info(f"[订单上传]    账户类型: {model.account_type}")
-
         # ===== 订单信息（从数据库获取）=====
         model.order_id = order_data['order_id']
         model.order_time = order_data['order_time']
         model.order_amount = order_data['order_amount']  # 已经转换为分
 
-        self.logger.info(f"[订单上传]    订单金额: {model.order_amount}分 ({model.order_amount / 100}元)")
-        self.logger.info(f"[订单上传]    订单时间: {model.order_time}")
-
         # ===== 支付相关信息（根据数据库字段动态设置）=====
         model.pay_type = order_data['pay_type']  # 503-微信，502-支付宝
         model.pay_merchant_id = Config.PAY_MERCHANT_ID  # 第三方支付渠道商户号
 
-        self.logger.info(f"[订单上传]    支付类型: {model.pay_type}")
-        self.logger.info(f"[订单上传]    支付商户号: {model.pay_merchant_id}")
-
         # 生成支付平台订单号
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         if order_data['pay_type'] == '503':  # 微信
@@ -368,23 +404,18 @@ class OrderUploadDemo:
         else:  # 支付宝
             model.trade_no = f"ALI{timestamp}{str(uuid.uuid4())[:6].upper()}"
 
-        self.logger.info(f"[订单上传]    支付平台订单号: {model.trade_no}")
-
         # ===== 其他信息 =====
         model.user_id = Config.DEFAULT_USER_ID  # 操作员ID
         model.fee_amount = Config.DEFAULT_FEE_AMOUNT  # 交易手续费
         model.split_rule_source = Config.SPLIT_RULE_SOURCE  # 分账规则来源：1-接口
         model.remark = f"MUMUSO门店订单 - {order_data['payment_method']} - billid:{order_data['billid']} - 商户:{order_data['merchant_id']} - 门店:{order_data['store_id']}"
 
-        self.logger.info(f"[订单上传]    操作员ID: {model.user_id}")
-        self.logger.info(f"[订单上传]    手续费: {model.fee_amount}")
-        self.logger.info(f"[订单上传]    分账规则来源: {model.split_rule_source}")
-        self.logger.info(f"[订单上传]    备注: {model.remark}")
-
         # 设置请求的业务模型
         request.biz_model = model
 
-        self.logger.info(f"[订单上传] ✅ 订单请求对象创建完成")
+        self.events.info('🔧 构建', order_id=model.order_id, billid=order_data['billid'],
+                         merchant=model.merchant_id, store=model.store_id, amount=model.order_amount,
+                         pay_type=model.pay_type, trade_no=model.trade_no)
         return request
 
     def upload_single_order(self, order_data):
@@ -393,14 +424,12 @@ class OrderUploadDemo:
         :param order_data: 订单数据
         :return: 是否成功
         """
-        order_id = order_data['order_id']
-        merchant_id = order_data['merchant_id']
-        store_id = order_data['store_id']
-        self.logger.info(f"[订单上传] {'=' * 80}")
-        self.logger.info(f"[订单上传] 🚀 开始上传订单: {order_id} (商户: {merchant_id}, 门店: {store_id})")
-        self.logger.info(f"[订单上传] {'=' * 80}")
-
         try:
+            # 已成功上传过的订单只补做数据库回写
+            record = self._ledger_lookup(order_data)
+            if record:
+                return self._writeback_upload_result(order_data, True, record['request_no'])
+
             # 创建订单请求
             request = self.create_order_request(order_data)
             model = request.biz_model
@@ -409,40 +438,15 @@ class OrderUploadDemo:
             self._print_order_info(model, order_data)
 
             # 执行请求
-            self.logger.info(f"[订单上传] 📡 发送API请求...")
-            self.logger.info(f"[订单上传]    接口地址: {Config.get_url()}")
-            self.logger.info(f"[订单上传]    请求时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-
             response = self.client.execute(request)
 
             # 处理响应
             success, request_no = self._handle_response(response, model, order_data)
-
-            # 更新数据库状态
             if success:
-                self.logger.info(f"[订单上传] 💾 更新数据库状态...")
-                db_update_success = self.update_order_upload_status(
-                    order_data['billid'],
-                    order_data['order_id'],
-                    request_no,
-                    success=True
-                )
+                self._ledger_record(order_data, request_no)
 
-                if db_update_success:
-                    self.logger.info(f"[订单上传] ✅ 数据库状态更新成功")
-                    return True
-                else:
-                    self.logger.warning(f"[订单上传] ⚠️ 订单上传成功但数据库状态更新失败")
-                    return False
-            else:
-                self.logger.info(f"[订单上传] 💾 记录失败状态到数据库...")
-                self.update_order_upload_status(
-                    order_data['billid'],
-                    order_data['order_id'],
-                    request_no or "FAILED",
-                    success=False
-                )
-                return False
+            # 更新数据库状态
+            return self._writeback_upload_result(order_data, success, request_no)
 
         except Exception as e:
             self.logger.error(f"[订单上传] ❌ 订单上传异常: {str(e)}")
@@ -456,6 +460,7 @@ class OrderUploadDemo:
                 f"EXCEPTION: {str(e)[:100]}",
                 success=False
             )
+            self._dead_letter(order_data, DeadLetterStore.EXCEPTION, str(e))
             return False
 
     def batch_upload_orders(self, progress_callback=None):
@@ -463,12 +468,28 @@ class OrderUploadDemo:
         self.logger.info(f"[订单上传] 🚀 开始批量上传订单...")
         self.logger.info(f"[订单上传] {'=' * 80}")
 
-        # 从数据库获取订单
-        self.logger.info(f"[订单上传] 📋 从数据库获取待上传订单...")
-        orders = self.get_orders_from_database()
-
+        # 上次运行中断时优先按运行日志续跑，否则从数据库获取订单
+        journal = RunJournal.from_config('order_upload', self.logger)
+        entries = journal.resume_run() if journal else None
+        tracker = None
+        if entries is not None:
+            self.logger.info("[订单上传] ♻️ 按运行日志续跑上次未完成的批次...")
+            contexts = self._restore_upload_contexts(journal, entries)
+        else:
+            self.logger.info(f"[订单上传] 📋 从数据库获取待上传订单...")
+            orders = self._prioritize_orders(self.get_orders_from_database(incremental=True))
+            tracker = self.watermark_tracker
+            if journal and orders:
+                journal.start_run(orders, self._journal_key)
+            contexts = [{'order': order_data, 'key': self._journal_key(order_data)} for order_data in orders]
+
+        orders = [ctx['order'] for ctx in contexts]
         if not orders:
             self.logger.warning(f"[订单上传] ⚠️ 没有找到待上传的订单")
+            if journal:
+                journal.finish_run()
+            if tracker is not None:
+                tracker.commit()
             return 0, 0, []
 
         total_orders = len(orders)
@@ -501,39 +522,53 @@ class OrderUploadDemo:
 
         success_count = 0
         failed_orders = []
+        done_count = 0
         start_time = datetime.now()
 
-        for i, order_data in enumerate(orders, 1):
-            self.logger.info(f"[订单上传] 📤 处理第 {i}/{total_orders} 笔订单")
-            self.logger.info(f"[订单上传]    订单号: {order_data['order_id']}")
-            self.logger.info(f"[订单上传]    业务单号: {order_data['billid']}")
-            self.logger.info(f"[订单上传]    支付方式: {order_data['payment_method']}")
-            self.logger.info(f"[订单上传]    订单金额: {order_data['order_amount'] / 100}元")
-            self.logger.info(f"[订单上传]    动态商户号: {order_data['merchant_id']}")
-            self.logger.info(f"[订单上传]    动态门店ID: {order_data['store_id']}")
-            self.logger.info(f"[订单上传] {'-' * 80}")
-
-            # 更新进度
-            if progress_callback:
-                progress_callback(i, total_orders, f"处理订单: {order_data['order_id']}")
-
-            order_start_time = datetime.now()
-            success = self.upload_single_order(order_data)
-            order_end_time = datetime.now()
-
-            processing_time = (order_end_time - order_start_time).total_seconds()
-
-            if success:
+        def on_complete(ctx):
+            nonlocal success_count, done_count
+            done_count += 1
+            order_data = ctx['order']
+            if tracker is not None:
+                tracker.mark_done(order_data['order_id'], ctx['success'])
+            if ctx['success']:
                 success_count += 1
-                self.logger.info(f"[订单上传] ✅ 第 {i} 笔订单处理成功 (耗时: {processing_time:.2f}秒)")
+                self.events.debug('✅ 订单处理成功', order_id=order_data['order_id'], progress=f"{done_count}/{total_orders}")
             else:
                 failed_orders.append(order_data)
-                self.logger.error(f"[订单上传] ❌ 第 {i} 笔订单处理失败 (耗时: {processing_time:.2f}秒)")
+                self.logger.error(f"[订单上传] ❌ 订单处理失败: {order_data['order_id']} ({done_count}/{total_orders})")
+            if progress_callback:
+                progress_callback(done_count, total_orders, f"处理订单: {order_data['order_id']}")
 
-            # 间隔一下避免请求过快
-            if i < len(orders):  # 不是最后一笔
-                self.logger.info(f"[订单上传] ⏱️ 等待1秒后处理下一笔订单...")
-                time.sleep(1)
+        def on_error(stage_name, ctx, error):
+            nonlocal done_count
+            done_count += 1
+            order_data = ctx['order']
+            self.logger.error(f"[订单上传] ❌ 订单 {order_data['order_id']} 在[{stage_name}]阶段异常: {str(error)}")
+            self.update_order_upload_status(
+                order_data['billid'],
+                order_data['order_id'],
+                f"EXCEPTION: {str(error)[:100]}",
+                success=False
+            )
+            if journal:
+                journal.record(ctx['key'], RunJournal.FAILED, stage=stage_name)
+            if tracker is not None:
+                tracker.mark_done(order_data['order_id'], False)
+            self._dead_letter(order_data, DeadLetterStore.EXCEPTION, f"[{stage_name}] {str(error)}")
+            failed_orders.append(order_data)
+            if progress_callback:
+                progress_callback(done_count, total_orders, f"处理订单: {order_data['order_id']}")
+
+        # 订单在进入流水线前已全部读出: 优先级排序和运行日志登记都需要完整的待处理集合
+        pipeline = self._create_upload_pipeline(journal)
+        pipeline.run(contexts, on_complete=on_complete, on_error=on_error)
+        self._log_pipeline_stats(pipeline)
+        if journal:
+            journal.finish_run()
+        # 水位只推进到第一笔未成功的订单之前，失败的订单下次增量运行仍会被扫描到
+        if tracker is not None:
+            tracker.commit()
 
         end_time = datetime.now()
         total_time = (end_time - start_time).total_seconds()
@@ -565,40 +600,264 @@ class OrderUploadDemo:
         self.logger.info(f"[订单上传] {'=' * 80}")
         return success_count, len(orders), failed_orders
 
+    def _writeback_upload_result(self, order_data, success, request_no):
+        """
+        根据上传结果回写数据库状态
+        :return: 订单是否最终处理成功
+        """
+        if success:
+            db_update_success = self.update_order_upload_status(
+                order_data['billid'],
+                order_data['order_id'],
+                request_no,
+                success=True
+            )
+
+            if db_update_success:
+                if self.dead_letters:
+                    self.dead_letters.resolve(self.DEAD_LETTER_STAGE, self._dead_letter_key(order_data))
+                return True
+            else:
+                self.logger.warning(f"[订单上传] ⚠️ 订单上传成功但数据库状态更新失败")
+                self._dead_letter(order_data, DeadLetterStore.WRITEBACK, f"数据库回写失败 (request_no: {request_no})")
+                return False
+        else:
+            self.update_order_upload_status(
+                order_data['billid'],
+                order_data['order_id'],
+                request_no or "FAILED",
+                success=False
+            )
+            self._dead_letter(order_data, DeadLetterStore.BUSINESS, f"接口返回失败 (request_no: {request_no})")
+            return False
+
+    @staticmethod
+    def _dead_letter_key(order_data):
+        return f"{order_data['billid']}|{order_data['order_id']}"
+
+    def _dead_letter(self, order_data, failure_class, error):
+        """失败订单记入死信队列"""
+        if self.dead_letters:
+            self.dead_letters.add(self.DEAD_LETTER_STAGE, self._dead_letter_key(order_data), order_data,
+                                  failure_class, error)
+
+    def _ledger_lookup(self, order_data):
+        """查询幂等台账，返回该订单上次成功上传的记录，未上传过返回None"""
+        if not self.ledger:
+            return None
+        record = self.ledger.get(OrderUploadRequest().get_method(), order_data['order_id'], order_data['pay_type'])
+        if record:
+            self.logger.warning(f"[订单上传] ♻️ 订单 {order_data['order_id']} 已于 {record['create_time']} 成功上传"
+                                f"(请求号: {record['request_no']})，跳过发送，仅补做数据库回写")
+        return record
+
+    def _ledger_record(self, order_data, request_no):
+        """上传成功后记入幂等台账"""
+        if self.ledger:
+            self.ledger.put(OrderUploadRequest().get_method(), order_data['order_id'], order_data['pay_type'],
+                            request_no=request_no)
+
+    @staticmethod
+    def _journal_key(order_data):
+        """运行日志中订单的唯一键"""
+        return f"{order_data['billid']}|{order_data['order_id']}|{order_data['pay_type']}"
+
+    def _restore_upload_contexts(self, journal, entries):
+        """
+        根据运行日志恢复上次未完成的订单
+        - 已回写/已失败: 跳过
+        - 已收到接口结果: 只补做数据库回写
+        - 已发出但未收到结果: 幂等台账中有成功记录的只补做数据库回写，
+          否则结果不确定，不自动重发，标记失败待人工核实
+        - 仅纳入批次: 重新走完整流程
+        """
+        contexts = []
+        for key, entry in entries.items():
+            state = entry['state']
+            order_data = entry['data']
+            if state in RunJournal.TERMINAL_STATES or order_data is None:
+                continue
+
+            if state == RunJournal.SENT:
+                record = self._ledger_lookup(order_data)
+                if record:
+                    contexts.append({'order': order_data, 'key': key,
+                                     'ack': {'success': True, 'request_no': record['request_no']}})
+                    continue
+                self.logger.warning(f"[订单上传] ⚠️ 订单 {order_data['order_id']} 中断前已发送但未确认结果，"
+                                    f"为避免重复上传标记为失败，请人工核实")
+                self.update_order_upload_status(
+                    order_data['billid'],
+                    order_data['order_id'],
+                    "UNCERTAIN: 中断前已发送未确认",
+                    success=False
+                )
+                journal.record(key, RunJournal.FAILED, reason='uncertain')
+                continue
+
+            ctx = {'order': order_data, 'key': key}
+            if state == RunJournal.ACKED:
+                ctx['ack'] = entry['extra']
+            contexts.append(ctx)
+
+        self.logger.info(f"[订单上传] ♻️ 续跑订单: {len(contexts)} 笔 "
+                         f"(其中待补回写 {sum(1 for ctx in contexts if 'ack' in ctx)} 笔)")
+        return contexts
+
+    def _shard_condition(self):
+        """
+        分片运行时的SQL条件：按最终使用的商户号分片（与 _process_merchant_id 一致，空商户号按备用商户号）
+        :return: (条件, 绑定参数)，非分片运行时返回 (None, {})
+        """
+        shard = get_current_shard()
+        if shard is None:
+            return None, {}
+        if Config.should_use_dynamic_merchant_id():
+            condition, params = shard_predicate("NVL(TRIM(hd.ymshanghuhao), :shard_fallback_merchant)")
+        else:
+            self.logger.warning("[订单上传] ⚠️ 未启用动态商户号，全部订单使用备用商户号，只会落在同一个分片")
+            condition, params = shard_predicate(":shard_fallback_merchant")
+        self.logger.info(f"[订单上传] 🧩 分片 {shard[0] + 1}/{shard[1]}: 只读取本分片商户的订单")
+        return condition, {**params, 'shard_fallback_merchant': Config.get_fallback_merchant_id()}
+
+    def _prioritize_orders(self, orders):
+        """
+        按优先级排序待上传订单：同一单据已有明细上传过的订单加分（整单上传完才能进入分账）
+        超过单次运行上限被延后的订单不会被确认，水位停在它们之前，下次增量运行仍会扫描到
+        """
+        scorer = PriorityScorer.from_config(self.logger)
+        if not scorer or not orders:
+            return orders
+
+        waiting_bills = self._get_partially_uploaded_bills({order['billid'] for order in orders})
+        selected, deferred = scorer.order(orders,
+                                          amount=lambda order: order['order_amount'],
+                                          paytime=lambda order: order['order_time'],
+                                          merchant=lambda order: order['merchant_id'],
+                                          waiting=lambda order: order['billid'] in waiting_bills,
+                                          label='订单上传')
+        return selected
+
+    def _get_partially_uploaded_bills(self, billids):
+        """查询已有明细上传成功的单据号（分账在等待这些单据的其余明细）"""
+        if not billids:
+            return set()
+        connection = self.get_database_connection()
+        if not connection:
+            return set()
+
+        try:
+            cursor = connection.cursor()
+            billids = list(billids)
+            waiting = set()
+            # Oracle的IN列表最多1000项，分批查询
+            for start in range(0, len(billids), 1000):
+                chunk = billids[start:start + 1000]
+                binds = ', '.join(f":b{i}" for i in range(len(chunk)))
+                cursor.execute(f"""
+                SELECT DISTINCT billid FROM P_BL_SELL_PAYAMOUNT_HZ_dt
+                WHERE billid IN ({binds}) AND ISUPLOAD_FZ = 'Y'
+                """, {f"b{i}": billid for i, billid in enumerate(chunk)})
+                waiting.update(row[0] for row in cursor.fetchall())
+            cursor.close()
+            return waiting
+        except Exception as e:
+            self.logger.error(f"[订单上传] ❌ 查询部分上传的单据失败，本次不按下游等待加分: {str(e)}")
+            return set()
+        finally:
+            connection.close()
+
+    def _create_upload_pipeline(self, journal=None):
+        """
+        创建订单上传流水线: 构建 → 签名 → 发送 → 回写
+        各阶段之间为有界队列，线程数和队列容量取自ORDER_UPLOAD_PIPELINE_CONFIG
+        续跑时已收到接口结果(ctx含ack)的订单直接跳到回写阶段
+        """
+        pipeline_config = Config.get_order_upload_pipeline_config()
+
+        def build_stage(ctx):
+            if 'ack' not in ctx:
+                record = self._ledger_lookup(ctx['order'])
+                if record:
+                    ctx['ack'] = {'success': True, 'request_no': record['request_no']}
+                    return ctx
+                request = self.create_order_request(ctx['order'])
+                self._print_order_info(request.biz_model, ctx['order'])
+                ctx['request'] = request
+            return ctx
+
+        def sign_stage(ctx):
+            if 'ack' not in ctx:
+                ctx['params'] = self.client.sign_request(ctx['request'])
+            return ctx
+
+        def send_stage(ctx):
+            if 'ack' not in ctx:
+                if journal:
+                    journal.record(ctx['key'], RunJournal.SENT)
+                response = self.client.send_signed(ctx['request'], ctx['params'])
+                success, request_no = self._handle_response(response, ctx['request'].biz_model, ctx['order'])
+                ctx['ack'] = {'success': success, 'request_no': request_no}
+                if success:
+                    self._ledger_record(ctx['order'], request_no)
+                if journal:
+                    journal.record(ctx['key'], RunJournal.ACKED, **ctx['ack'])
+            return ctx
+
+        def writeback_stage(ctx):
+            ack = ctx['ack']
+            ctx['success'] = self._writeback_upload_result(ctx['order'], ack['success'], ack['request_no'])
+            if journal:
+                journal.record(ctx['key'], RunJournal.WRITTEN_BACK)
+            return ctx
+
+        pipeline = StagePipeline('OrderUpload',
+                                 queue_size=pipeline_config.get('QUEUE_SIZE', 50),
+                                 logger=self.logger)
+        pipeline.add_stage('构建', build_stage, pipeline_config.get('BUILD_WORKERS', 1))
+        pipeline.add_stage('签名', sign_stage, pipeline_config.get('SIGN_WORKERS', 1))
+        pipeline.add_stage('发送', send_stage, pipeline_config.get('SEND_WORKERS', 1))
+        pipeline.add_stage('回写', writeback_stage, pipeline_config.get('WRITEBACK_WORKERS', 1))
+        return pipeline
+
+    def _log_pipeline_stats(self, pipeline):
+        """输出流水线各阶段耗时统计"""
+        self.logger.info("[订单上传] ⏱️ 流水线阶段耗时统计:")
+        for stats in pipeline.get_stage_stats():
+            self.logger.info(f"[订单上传]    {stats['name']}: 线程 {stats['workers']}, "
+                             f"成功 {stats['processed']}, 失败 {stats['failed']}, "
+                             f"平均 {stats['avg_time'] * 1000:.1f}ms, 最大 {stats['max_time'] * 1000:.1f}ms, "
+                             f"背压阻塞 {stats['blocked_time']:.2f}秒")
+        self.logger.info(f"[订单上传] 🐢 瓶颈阶段: {pipeline.get_bottleneck()}")
+
     def _print_order_info(self, model, order_data):
-        """打印订单详细信息"""
-        self.logger.info(f"[订单上传] {'=' * 80}")
-        self.logger.info(f"[订单上传] 📦 MUMUSO订单上传信息 (动态商户号+门店ID版)")
-        self.logger.info(f"[订单上传] {'=' * 80}")
-        self.logger.info(f"[订单上传] 🌐 环境: {Config.get_env_name()}")
-        self.logger.info(f"[订单上传] 🏪 门店ID: {model.store_id} (动态获取)")
-        self.logger.info(f"[订单上传] 🏢 商户号: {model.merchant_id} (动态获取)")
-        self.logger.info(f"[订单上传] 🔢 订单号: {model.order_id}")
-        self.logger.info(f"[订单上传] 📊 业务单号: {order_data['billid']}")
-        self.logger.info(f"[订单上传] 💰 订单金额: {model.order_amount}分 ({model.order_amount / 100}元)")
-        self.logger.info(f"[订单上传] 💳 支付方式: {order_data['payment_method']} ({model.pay_type})")
-        self.logger.info(f"[订单上传] 🆔 支付平台订单号: {model.trade_no}")
-        self.logger.info(f"[订单上传] 🕐 订单时间: {model.order_time}")
-        self.logger.info(f"[订单上传] ⚙️ 上传模式: {model.order_upload_mode}")
-        self.logger.info(f"[订单上传] 💼 账户类型: {model.account_type}")
-        self.logger.info(f"[订单上传] 👤 操作员: {model.user_id}")
-        self.logger.info(f"[订单上传] 💸 手续费: {model.fee_amount}")
-        self.logger.info(f"[订单上传] 📝 备注: {model.remark}")
-        self.logger.info(f"[订单上传] {'=' * 80}")
+        """打印订单详细信息（仅DEBUG级别）"""
+        self.events.dump('📦 MUMUSO订单上传信息', lambda: {
+            '环境': Config.get_env_name(),
+            '门店ID': model.store_id,
+            '商户号': model.merchant_id,
+            '订单号': model.order_id,
+            '业务单号': order_data['billid'],
+            '订单金额(分)': model.order_amount,
+            '支付方式': f"{order_data['payment_method']} ({model.pay_type})",
+            '支付平台订单号': model.trade_no,
+            '订单时间': model.order_time,
+            '上传模式': model.order_upload_mode,
+            '账户类型': model.account_type,
+            '操作员': model.user_id,
+            '手续费': model.fee_amount,
+            '备注': model.remark,
+        })
 
     def _handle_response(self, response, model, order_data):
         """
         处理响应结果
         :return: (是否成功, 请求号)
         """
-        self.logger.info(f"[订单上传] 📋 API响应结果:")
-        self.logger.info(f"[订单上传] {'-' * 60}")
-
         if response:
-            response_str = json.dumps(response, indent=2, ensure_ascii=False)
-            self.logger.info(f"[订单上传] 响应内容: {response_str}")
+            self.events.dump('响应内容', response)
         else:
-            self.logger.error(f"[订单上传] ❌ 响应为空")
+            self.events.error('❌ 响应为空', order_id=model.order_id, billid=order_data['billid'])
             return False, None
 
         if response and isinstance(response, dict):
@@ -615,44 +874,19 @@ class OrderUploadDemo:
                           response.get('trace_id') or
                           'NO_REQUEST_NO')
 
-            self.logger.info(f"[订单上传] 📊 响应解析:")
-            self.logger.info(f"[订单上传]    成功标识: {success}")
-            self.logger.info(f"[订单上传]    响应码: {code}")
-            self.logger.info(f"[订单上传]    响应消息: {msg}")
-            self.logger.info(f"[订单上传]    请求号: {request_no}")
-            if sub_code:
-                self.logger.info(f"[订单上传]    子错误码: {sub_code}")
-            if sub_msg:
-                self.logger.info(f"[订单上传]    子错误信息: {sub_msg}")
-
             if success is True:
-                self.logger.info(f"[订单上传] 🎉 订单上传成功!")
-                self.logger.info(f"[订单上传] ✅ 订单号: {model.order_id}")
-                self.logger.info(f"[订单上传] 📊 业务单号: {order_data['billid']}")
-                self.logger.info(f"[订单上传] 💰 订单金额: {model.order_amount / 100}元")
-                self.logger.info(f"[订单上传] 💳 支付方式: {order_data['payment_method']}")
-                self.logger.info(f"[订单上传] 🏢 商户号: {model.merchant_id} (动态)")
-                self.logger.info(f"[订单上传] 🏪 门店ID: {model.store_id} (动态)")
-                self.logger.info(f"[订单上传] 🆔 请求号: {request_no}")
-                self.logger.info(f"[订单上传] 📞 银账通系统将处理订单并发送状态通知...")
+                self.events.info('🎉 上传成功', order_id=model.order_id, billid=order_data['billid'],
+                                 merchant=model.merchant_id, store=model.store_id, amount=model.order_amount,
+                                 request_no=request_no)
                 return True, request_no
             else:
-                self.logger.error(f"[订单上传] 💥 订单上传失败!")
-                self.logger.error(f"[订单上传] ❌ 订单号: {model.order_id}")
-                self.logger.error(f"[订单上传] 📊 业务单号: {order_data['billid']}")
-                self.logger.error(f"[订单上传] 🏢 商户号: {model.merchant_id} (动态)")
-                self.logger.error(f"[订单上传] 🏪 门店ID: {model.store_id} (动态)")
-                self.logger.error(f"[订单上传] 🔴 错误码: {code}")
-                self.logger.error(f"[订单上传] 🔴 错误信息: {msg}")
-                if sub_code:
-                    self.logger.error(f"[订单上传] 🔴 子错误码: {sub_code}")
-                if sub_msg:
-                    self.logger.error(f"[订单上传] 🔴 子错误信息: {sub_msg}")
+                self.events.error('💥 上传失败', order_id=model.order_id, billid=order_data['billid'],
+                                  merchant=model.merchant_id, store=model.store_id, code=code, msg=msg,
+                                  sub_code=sub_code, sub_msg=sub_msg, request_no=request_no)
                 return False, request_no
         else:
-            self.logger.error(f"[订单上传] ❌ 响应格式异常")
-            self.logger.error(f"[订单上传]    响应类型: {type(response)}")
-            self.logger.error(f"[订单上传]    响应内容: {response}")
+            self.events.error('❌ 响应格式异常', order_id=model.order_id, billid=order_data['billid'],
+                              type=type(response).__name__, response=lambda: str(response)[:500])
             return False, "INVALID_RESPONSE"
 
     # 其他方法保持不变...
@@ -26,7 +26,13 @@ import logging
 from datetime import datetime
 import cx_Oracle
 
-from common.OpenClient import OpenClient
+from common.OpenClient import OpenClient, enable_debug_logging
+from common.LogPipeline import route_logger
+from common.IdempotencyLedger import get_idempotency_ledger
+from common.DeadLetter import DeadLetterStore, get_dead_letter_store
+from common.SqlStats import instrument_connection
+from common.BalanceCache import invalidate_merchant_balance
+from common.Priority import PriorityScorer, get_merchants_awaiting_withdraw
 from model.OrderUploadModel import OrderUploadModel
 from request.OrderUploadRequest import OrderUploadRequest
 from config import Config
@@ -36,6 +42,9 @@ from config_adapter import config_adapter
 class RechargeAfterSplitDemo:
     """分账后挂账充值演示类 - GUI支持版本"""
 
+    # 死信队列的业务步骤名
+    DEAD_LETTER_STAGE = 'recharge'
+
     def __init__(self, logger=None):
         self.config = Config
         self.client = OpenClient(Config.APP_ID, Config.PRIVATE_KEY, Config.get_url())
@@ -51,6 +60,16 @@ class RechargeAfterSplitDemo:
                 handler.setFormatter(formatter)
                 self.logger.addHandler(handler)
                 self.logger.setLevel(logging.INFO)
+        # 日志经异步管道输出，不阻塞业务线程
+        route_logger(self.logger)
+        # DEBUG级别时输出开放平台请求参数和原始响应
+        enable_debug_logging(self.logger)
+
+        # 出站请求幂等台账（发送前检查，避免回写失败后重复充值）
+        self.ledger = get_idempotency_ledger(self.logger)
+
+        # 失败订单记入死信队列，由定时重试任务重新充值
+        self.dead_letters = get_dead_letter_store(self.logger)
 
         self.logger.info(f"[挂账充值] 💳 挂账充值系统初始化完成")
         self.logger.info(f"[挂账充值] 🌐 当前环境: {Config.get_env_name()}")
@@ -60,7 +79,7 @@ class RechargeAfterSplitDemo:
         try:
             user, password, dsn = Config.get_db_connection_info()
             self.logger.info(f"[挂账充值] 正在连接数据库: {dsn}")
-            connection = cx_Oracle.connect(user, password, dsn)
+            connection = instrument_connection(cx_Oracle.connect(user, password, dsn), self.logger)
             self.logger.info(f"[挂账充值] ✅ 数据库连接成功: {dsn}")
             return connection
         except Exception as e:
@@ -86,9 +105,7 @@ class RechargeAfterSplitDemo:
             AND dt.cancelsign = 'N'
             AND hd.status = '002'
             AND (dt.WXMONEY <> 0 OR dt.zfbmoney <> 0)
-            and dt.FZ_UPLOADRESULT_CONFIRM='Y'
-             AND NVL(dt.ISRECHARGE_FZ, 'N') = 'N'
-            AND NVL(dt.FZ_UPLOADRESULT_CONFIRM, 'N') = 'Y'
+            AND CASE WHEN NVL(dt.ISRECHARGE_FZ, 'N') = 'N' AND dt.FZ_UPLOADRESULT_CONFIRM = 'Y' THEN 'N' END = 'N'
             ORDER BY dt.paytime ASC
             """
 
@@ -408,6 +425,16 @@ class RechargeAfterSplitDemo:
         self.logger.info(f"[挂账充值] {'=' * 80}")
 
         try:
+            # 已成功充值过的订单只补做数据库回写
+            record = self._ledger_lookup(order_data)
+            if record:
+                return self.update_recharge_status(
+                    order_data['billid'],
+                    order_data['order_id'],
+                    record['request_no'],
+                    success=True
+                )
+
             # 创建挂账充值请求
             request = self.create_recharge_request(order_data)
             model = request.biz_model
@@ -428,6 +455,9 @@ class RechargeAfterSplitDemo:
 
             # 更新数据库状态
             if success:
+                self._ledger_record(order_data, request_no)
+                # 商户余额已变动，丢弃缓存的余额
+                invalidate_merchant_balance(order_data['merchant_id'])
                 self.logger.info(f"[挂账充值] 💾 更新挂账充值状态...")
                 db_update_success = self.update_recharge_status(
                     order_data['billid'],
@@ -438,9 +468,13 @@ class RechargeAfterSplitDemo:
 
                 if db_update_success:
                     self.logger.info(f"[挂账充值] ✅ 挂账充值状态更新成功")
+                    if self.dead_letters:
+                        self.dead_letters.resolve(self.DEAD_LETTER_STAGE, self._dead_letter_key(order_data))
                     return True
                 else:
                     self.logger.warning(f"[挂账充值] ⚠️ 挂账充值成功但数据库状态更新失败")
+                    self._dead_letter(order_data, DeadLetterStore.WRITEBACK,
+                                      f"数据库回写失败 (request_no: {request_no})")
                     return False
             else:
                 self.logger.info(f"[挂账充值] 💾 记录失败状态到数据库...")
@@ -450,6 +484,7 @@ class RechargeAfterSplitDemo:
                     request_no or "FAILED",
                     success=False
                 )
+                self._dead_letter(order_data, DeadLetterStore.BUSINESS, f"接口返回失败 (request_no: {request_no})")
                 return False
 
         except Exception as e:
@@ -464,8 +499,52 @@ class RechargeAfterSplitDemo:
                 f"EXCEPTION: {str(e)[:100]}",
                 success=False
             )
+            self._dead_letter(order_data, DeadLetterStore.EXCEPTION, str(e))
             return False
 
+    def _prioritize_orders(self, orders):
+        """按优先级排序待充值订单：商户有提现单在等待资金入账的订单加分"""
+        scorer = PriorityScorer.from_config(self.logger)
+        if not scorer or not orders:
+            return orders
+
+        awaiting = get_merchants_awaiting_withdraw(self.logger)
+        selected, _ = scorer.order(orders,
+                                   amount=lambda order: order['order_amount'],
+                                   paytime=lambda order: order['order_time'],
+                                   merchant=lambda order: order['merchant_id'],
+                                   waiting=lambda order: str(order['merchant_id']) in awaiting,
+                                   label='挂账充值')
+        return selected
+
+    @staticmethod
+    def _dead_letter_key(order_data):
+        return f"{order_data['billid']}|{order_data['order_id']}"
+
+    def _dead_letter(self, order_data, failure_class, error):
+        """失败订单记入死信队列"""
+        if self.dead_letters:
+            self.dead_letters.add(self.DEAD_LETTER_STAGE, self._dead_letter_key(order_data), order_data,
+                                  failure_class, error)
+
+    def _ledger_lookup(self, order_data):
+        """查询幂等台账，返回该笔挂账充值上次成功的记录，未充值过返回None"""
+        if not self.ledger:
+            return None
+        recharge_order_id = f"{order_data['order_id']}_RC_{order_data['source']}"
+        record = self.ledger.get(OrderUploadRequest().get_method(), recharge_order_id, order_data['source'])
+        if record:
+            self.logger.warning(f"[挂账充值] ♻️ 挂账充值订单 {recharge_order_id} 已于 {record['create_time']} 成功充值"
+                                f"(请求号: {record['request_no']})，跳过发送，仅补做数据库回写")
+        return record
+
+    def _ledger_record(self, order_data, request_no):
+        """挂账充值成功后记入幂等台账"""
+        if self.ledger:
+            recharge_order_id = f"{order_data['order_id']}_RC_{order_data['source']}"
+            self.ledger.put(OrderUploadRequest().get_method(), recharge_order_id, order_data['source'],
+                            request_no=request_no)
+
     def batch_recharge_orders(self, progress_callback=None):
         """批量挂账充值订单"""
         self.logger.info(f"[挂账充值] 💳 开始批量挂账充值...")
@@ -475,7 +554,7 @@ class RechargeAfterSplitDemo:
 
         # 从数据库获取已分账订单
         self.logger.info(f"[挂账充值] 📋 从数据库获取已分账待充值订单...")
-        orders = self.get_split_orders_from_database()
+        orders = self._prioritize_orders(self.get_split_orders_from_database())
 
         if not orders:
             self.logger.warning(f"[挂账充值] ⚠️ 没有找到待挂账充值的订单")
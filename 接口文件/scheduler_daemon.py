@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+定时任务服务（无界面）
+文件名: scheduler_daemon.py
+功能: 不依赖图形界面，在一个进程中托管全部定时任务，供生产环境以服务方式运行:
+    1. 结算全流程（上传 → 分账 → 查询 → 充值 → 提现）: 每日 AUTO_EXECUTE_TIME 执行
+    2. 分账结果查询: 每 BALANCE_PAY_QUERY_CONFIG.AUTO_QUERY_INTERVAL 分钟执行
+    3. 账户余额查询: 每 ACCOUNT_BALANCE_QUERY_CONFIG.AUTO_QUERY_INTERVAL 分钟执行
+    4. 失败单据重试: 每 DEAD_LETTER_CONFIG.REDRIVE_INTERVAL_MINUTES 分钟从死信队列取一批到期单据重新处理
+       （死信队列是本机sqlite文件，该任务不走租约，每台主机重试本机记录的失败单据）
+    5. SQL执行统计汇总: 每 SQL_STATS_CONFIG.REPORT_INTERVAL_MINUTES 分钟输出到日志
+    所有任务共享一个线程池，同一任务不会重叠执行，停机错过的每日任务在补跑窗口内补执行。
+    启用 JOB_LEASE_CONFIG 后可在多台主机上同时运行，每个任务只由持有租约的一台执行，其余待命接管。
+
+用法:
+    python scheduler_daemon.py
+"""
+
+import logging
+import os
+import signal
+
+from common.JobLease import JobLease
+from common.JobScheduler import JobScheduler
+from common.LogPipeline import route_logger
+from common.SqlStats import get_sql_stats
+from config import Config
+
+
+class SchedulerDaemon:
+    """定时任务服务"""
+
+    def __init__(self, logger=None):
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger('SchedulerDaemon')
+            if not self.logger.handlers:
+                handler = logging.StreamHandler()
+                formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+                handler.setFormatter(formatter)
+                self.logger.addHandler(handler)
+                self.logger.setLevel(logging.INFO)
+        # 日志经异步管道输出，不阻塞业务线程
+        route_logger(self.logger)
+
+        scheduler_config = Config.get_scheduler_config()
+        self.scheduler = JobScheduler(
+            max_workers=scheduler_config.get('MAX_WORKERS', 3),
+            catch_up_hours=scheduler_config.get('CATCH_UP_HOURS', 6),
+            state_file=os.path.join(Config.get_runtime_data_dir(),
+                                    scheduler_config.get('STATE_FILE', 'scheduler_state.json')),
+            lease=JobLease.from_config(self.logger),
+            logger=self.logger)
+        self._register_jobs(scheduler_config)
+
+        self.logger.info("[定时服务] ⏰ 定时任务服务初始化完成")
+        self.logger.info(f"[定时服务] 🌍 当前环境: {Config.get_env_name()}")
+        if self.scheduler.lease:
+            self.logger.info(f"[定时服务] 🔐 已启用跨主机租约，本机标识: {self.scheduler.lease.owner_id}")
+
+    def _register_jobs(self, scheduler_config):
+        """按配置注册定时任务，各业务类在首次执行时才创建"""
+        if scheduler_config.get('SETTLEMENT_FLOW_ENABLED', True):
+            hour, minute = Config.get_auto_execute_time()
+            self.scheduler.add_daily_job('结算全流程', self._run_settlement_flow, hour, minute,
+                                         accepts_stop_event=True)
+
+        if scheduler_config.get('SPLIT_QUERY_ENABLED', True):
+            self.scheduler.add_interval_job('分账结果查询', self._run_split_query,
+                                            Config.BALANCE_PAY_QUERY_CONFIG.get('AUTO_QUERY_INTERVAL', 5))
+
+        if scheduler_config.get('BALANCE_QUERY_ENABLED', True):
+            self.scheduler.add_interval_job('账户余额查询', self._run_balance_query,
+                                            Config.get_account_balance_auto_interval())
+
+        dead_letter_config = Config.get_dead_letter_config()
+        redrive_minutes = dead_letter_config.get('REDRIVE_INTERVAL_MINUTES', 15)
+        if dead_letter_config.get('ENABLED', True) and redrive_minutes:
+            # 死信队列存放在本机，失败单据由记录它的主机重试，不需要跨主机租约
+            self.scheduler.add_interval_job('失败单据重试', self._run_dead_letter_redrive, redrive_minutes,
+                                            run_immediately=False, use_lease=False)
+
+        # SQL统计只输出本进程的数据，不需要跨主机租约
+        report_minutes = Config.get_sql_stats_config().get('REPORT_INTERVAL_MINUTES', 60)
+        if report_minutes and get_sql_stats(self.logger) is not None:
+            self.scheduler.add_interval_job('SQL执行统计', self._report_sql_stats, report_minutes,
+                                            run_immediately=False, use_lease=False)
+
+    # ===== 任务 =====
+    def _run_settlement_flow(self, stop_event):
+        # 租约丢失时停止处理后续单据，由接管的主机继续
+        from settlement_flow_demo import SettlementFlowDemo
+        SettlementFlowDemo(self.logger).run(stop_event=stop_event)
+
+    def _run_split_query(self):
+        from split_query_demo import SplitQueryDemo
+        if not hasattr(self, '_split_query_demo'):
+            self._split_query_demo = SplitQueryDemo(self.logger)
+        self._split_query_demo.batch_query_from_database()
+
+    def _run_balance_query(self):
+        from account_balance_query_demo import AccountBalanceQueryDemo
+        if not hasattr(self, '_balance_query_demo'):
+            self._balance_query_demo = AccountBalanceQueryDemo(self.logger)
+        self._balance_query_demo.batch_query_from_database()
+
+    def _run_dead_letter_redrive(self):
+        from dead_letter_redrive_demo import DeadLetterRedriveDemo
+        if not hasattr(self, '_redrive_demo'):
+            self._redrive_demo = DeadLetterRedriveDemo(self.logger)
+        self._redrive_demo.redrive()
+
+    def _report_sql_stats(self):
+        registry = get_sql_stats(self.logger)
+        self.logger.info(f"[定时服务] 📊 SQL执行统计（按总耗时排序）:\n{registry.format_summary(limit=15)}")
+
+    # ===== 运行 =====
+    def run(self):
+        """运行服务，阻塞直到收到 Ctrl+C 或 SIGTERM"""
+        def handle_signal(signum, frame):
+            self.logger.info(f"[定时服务] 📴 收到停止信号({signum})，不再调度新任务，等待执行中的任务结束")
+            self.scheduler.stop(wait=False)
+
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
+
+        for job in self.scheduler.get_status():
+            self.logger.info(f"[定时服务] 📋 {job['name']}: {job['schedule']}")
+        self.scheduler.run_forever()
+        self.logger.info("[定时服务] 👋 定时任务服务已退出")
+
+
+if __name__ == '__main__':
+    ready, msg = Config.is_config_ready()
+    if not ready:
+        print(f"⚠️ 配置检查失败: {msg}")
+    else:
+        SchedulerDaemon().run()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+结算全流程作业演示
+文件名: settlement_flow_demo.py
+功能: 把 订单上传 → 分账申请 → 分账结果查询 → 挂账充值 → 提现申请 五个业务步骤注册为作业引擎的阶段，
+     某一步完成的单据直接在进程内流转到下一步，不再等下一步的定时任务从数据库重新扫描。
+
+阶段与条目类型:
+    上传     UploadOrder   → UploadedBill
+    分账     UploadedBill  → SplitTrade
+    查询     SplitTrade    → SettledSplit
+    充值     SettledSplit  → RechargedBill
+    提现     RechargedBill → (终点)
+
+每一步在执行前仍按单据号回查数据库，只有数据库状态满足该步骤条件的单据才会被处理，
+因此数据库中已处于中间状态的单据也可以直接从对应阶段注入。
+提现单(p_bl_draw_hd)与销售单据没有单号关联，充值完成后按商户号查找该商户可提现的提现单。
+分账结果查询阶段只查询一次，仍在处理中的交易放入自适应轮询计划，不占用阶段线程等待；
+各阶段处理完后按轮询计划继续查询一段时间，出结果的再投递到充值阶段，仍未出结果的交给分账结果自动查询。
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+from common.JobEngine import JobEngine
+from common.LogPipeline import route_logger
+from common.PollSchedule import AdaptivePollSchedule
+from config import Config
+from order_upload_demo import OrderUploadDemo
+from split_account_demo import SplitAccountDemo
+from split_query_demo import SplitQueryDemo
+from recharge_after_split_demo import RechargeAfterSplitDemo
+from withdraw_demo import WithdrawDemo
+
+
+# ===== 阶段间流转的条目类型 =====
+@dataclass
+class UploadOrder:
+    """待上传的订单"""
+    order_data: dict
+
+
+@dataclass
+class UploadedBill:
+    """已上传、待分账的明细单据"""
+    billid: str
+    xpbillid: str
+
+
+@dataclass
+class SplitTrade:
+    """已提交分账、待查询结果的交易"""
+    trade_no: str
+    billid: str
+    xpbillid: str
+
+
+@dataclass
+class SettledSplit:
+    """分账已成功、待挂账充值的明细单据"""
+    billid: str
+    xpbillid: str
+
+
+@dataclass
+class RechargedBill:
+    """已挂账充值、可能有待提现单据的商户"""
+    merchant_id: str
+
+
+class SettlementFlowDemo:
+    """结算全流程作业演示类"""
+
+    def __init__(self, logger=None):
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger('SettlementFlow')
+            if not self.logger.handlers:
+                handler = logging.StreamHandler()
+                formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+                handler.setFormatter(formatter)
+                self.logger.addHandler(handler)
+                self.logger.setLevel(logging.INFO)
+        # 日志经异步管道输出，不阻塞业务线程
+        route_logger(self.logger)
+
+        self.upload_demo = OrderUploadDemo(self.logger)
+        self.split_demo = SplitAccountDemo(self.logger)
+        self.query_demo = SplitQueryDemo(self.logger)
+        self.recharge_demo = RechargeAfterSplitDemo(self.logger)
+        self.withdraw_demo = WithdrawDemo(self.logger)
+
+        self.flow_config = Config.get_job_engine_config()
+
+        # 同一单据可能由多个上游条目触发（如微信、支付宝两笔上传），每一步只处理一次
+        self._claimed = set()
+        self._claimed_lock = threading.Lock()
+
+        # 分账仍在处理中的交易 trade_no -> SplitTrade
+        self._poll_schedule = None
+        self._poll_lock = threading.Lock()
+
+        # 从数据库注入的上传订单的水位登记，上传成功后确认，作业结束后提交
+        self._upload_tracker = None
+
+        self.logger.info("[结算流程] 🔗 结算全流程作业初始化完成")
+        self.logger.info(f"[结算流程] 🌍 当前环境: {Config.get_env_name()}")
+
+    # ===== 作业引擎 =====
+    def create_engine(self):
+        """创建并注册五个业务阶段"""
+        engine = JobEngine('settlement', queue_size=self.flow_config.get('QUEUE_SIZE', 50), logger=self.logger)
+        engine.add_stage('上传', self._upload_stage, UploadOrder, UploadedBill,
+                         self.flow_config.get('UPLOAD_WORKERS', 2)) \
+            .add_stage('分账', self._split_stage, UploadedBill, SplitTrade,
+                       self.flow_config.get('SPLIT_WORKERS', 2)) \
+            .add_stage('查询', self._query_stage, SplitTrade, SettledSplit,
+                       self.flow_config.get('QUERY_WORKERS', 2)) \
+            .add_stage('充值', self._recharge_stage, SettledSplit, RechargedBill,
+                       self.flow_config.get('RECHARGE_WORKERS', 1)) \
+            .add_stage('提现', self._withdraw_stage, RechargedBill, None,
+                       self.flow_config.get('WITHDRAW_WORKERS', 1))
+        return engine
+
+    def run(self, seed_from_database=True, stop_event=None):
+        """
+        运行全流程作业
+        :param seed_from_database: 是否把数据库中各步骤待处理的单据作为初始条目注入对应阶段
+        :param stop_event: 停止事件（定时服务中为任务租约丢失事件），置位后各阶段不再处理后续单据
+        :return: 各阶段统计
+        """
+        self.logger.info("[结算流程] 🚀 开始结算全流程作业")
+        self._claimed.clear()
+        self._upload_tracker = None
+        self._poll_schedule = AdaptivePollSchedule(
+            initial_delay=self.flow_config.get('QUERY_POLL_INITIAL_DELAY', 2),
+            max_delay=self.flow_config.get('QUERY_POLL_MAX_DELAY', 10),
+            backoff_factor=2)
+
+        engine = self.create_engine()
+        seeds = self._seed_from_database() if seed_from_database else []
+        run_start = time.perf_counter()
+        engine.run(seeds, stop_event=stop_event)
+        # 上传水位只推进到第一笔未成功（含被停止而未处理）的订单之前
+        if self._upload_tracker is not None:
+            self._upload_tracker.commit()
+        self._poll_pending_queries(engine, stop_event)
+        elapsed = time.perf_counter() - run_start
+
+        stats = engine.get_stage_stats()
+        self.logger.info(f"[结算流程] {'=' * 60}")
+        self.logger.info(f"[结算流程] 📊 结算全流程作业完成，耗时 {elapsed:.2f}秒")
+        for stage_stats in stats:
+            self.logger.info(
+                f"[结算流程]   {stage_stats['name']}: 成功 {stage_stats['processed']}，异常 {stage_stats['failed']}，"
+                f"平均 {stage_stats['avg_time']:.2f}秒，线程 {stage_stats['workers']}")
+        self.logger.info(f"[结算流程] {'=' * 60}")
+        return stats
+
+    def _seed_from_database(self):
+        """按阶段顺序从数据库读取各步骤的待处理单据（生成器，边读边投递）"""
+        orders = self.upload_demo.get_orders_from_database(incremental=True)
+        self._upload_tracker = self.upload_demo.watermark_tracker
+        for order in orders:
+            yield UploadOrder(order)
+
+        seen = set()
+        for order in self.split_demo.get_split_orders_from_database():
+            if order.get('xpbillid') and order['xpbillid'] not in seen:
+                seen.add(order['xpbillid'])
+                yield UploadedBill(order['billid'], order['xpbillid'])
+
+        for record in self.query_demo.query_pending_split_records():
+            yield SplitTrade(record.get_trade_no(), record.billid, record.xpbillid)
+
+        seen = set()
+        for order in self.recharge_demo.get_split_orders_from_database():
+            if order['order_id'] not in seen:
+                seen.add(order['order_id'])
+                yield SettledSplit(order['billid'], order['order_id'])
+
+        seen = set()
+        for order in self.withdraw_demo.get_withdraw_orders_from_database():
+            if order['merchantno'] not in seen:
+                seen.add(order['merchantno'])
+                yield RechargedBill(order['merchantno'])
+
+    # ===== 阶段处理函数 =====
+    def _upload_stage(self, item):
+        order_data = item.order_data
+        success = self.upload_demo.upload_single_order(order_data)
+        if self._upload_tracker is not None:
+            self._upload_tracker.mark_done(order_data['order_id'], success)
+        if success:
+            return [UploadedBill(order_data['billid'], order_data['order_id'])]
+        return []
+
+    def _split_stage(self, item):
+        if not self._claim('split', item.xpbillid):
+            return []
+
+        # 数据库中该明细满足分账条件才执行，并做付款方余额预检
+        orders = [order for order in self.split_demo.get_split_order_by_xpbillid(item.xpbillid)
+                  if order.get('xpbillid') == item.xpbillid]
+        orders, deferred = self.split_demo.preflight_split_orders(orders)
+        if deferred:
+            self.logger.warning(f"[结算流程] ⏸️ 明细 {item.xpbillid} 付款方余额不足，本次不分账")
+
+        outputs = []
+        for order in orders:
+            for result in self.split_demo.split_single_order(order):
+                if result.get('success') and result.get('trade_no'):
+                    outputs.append(SplitTrade(result['trade_no'], order['billid'], item.xpbillid))
+        return outputs
+
+    def _query_stage(self, item):
+        if not self._claim('query', item.trade_no):
+            return []
+
+        # 查询一次，处理中的交给轮询计划，不在阶段线程中等待
+        status = self._query_split_status(item.trade_no)
+        if status == "1":
+            return [SettledSplit(item.billid, item.xpbillid)]
+        if status not in ("0", "2"):
+            with self._poll_lock:
+                self._poll_schedule.add(item.trade_no, item)
+            self.logger.info(f"[结算流程] ⏳ 交易 {item.trade_no} 未出结果，加入轮询")
+        return []
+
+    def _query_split_status(self, trade_no):
+        """查询并回写分账结果，返回状态（1=成功，0/2=未成功的终态），查询失败或处理中返回None"""
+        api_result, _ = self.query_demo.query_single_split_result(trade_no, auto_writeback=True)
+        status = api_result.data.status if api_result.is_success() and api_result.data else None
+        if status in ("0", "2"):
+            self.logger.warning(f"[结算流程] ❌ 交易 {trade_no} 分账未成功: {api_result.data.get_status_text()}")
+        return status
+
+    def _poll_pending_queries(self, engine, stop_event=None):
+        """
+        各阶段处理完后按轮询计划继续查询处理中的分账，出结果的投递到充值阶段继续流转；
+        超过轮询时长仍未出结果的交给分账结果自动查询
+        """
+        deadline = time.monotonic() + self.flow_config.get('QUERY_POLL_WINDOW', 30)
+        while not (stop_event is not None and stop_event.is_set()):
+            with self._poll_lock:
+                wait_seconds = self._poll_schedule.seconds_until_next()
+            if wait_seconds is None or time.monotonic() + wait_seconds > deadline:
+                break
+            if stop_event is not None:
+                stop_event.wait(wait_seconds)
+            else:
+                time.sleep(wait_seconds)
+
+            with self._poll_lock:
+                due = self._poll_schedule.pop_due()
+            settled = []
+            for trade_no, item, attempts in due:
+                status = self._query_split_status(trade_no)
+                with self._poll_lock:
+                    if status == "1":
+                        self._poll_schedule.retire(trade_no)
+                        settled.append(SettledSplit(item.billid, item.xpbillid))
+                    elif status in ("0", "2"):
+                        self._poll_schedule.retire(trade_no)
+                    else:
+                        self._poll_schedule.backoff(trade_no)
+            if settled:
+                self.logger.info(f"[结算流程] ✅ 轮询确认 {len(settled)} 笔分账成功，继续充值、提现")
+                engine.run(settled, stop_event=stop_event, reset_stats=False)
+
+        remaining = len(self._poll_schedule)
+        if remaining:
+            self.logger.info(f"[结算流程] ⏳ {remaining} 笔分账仍在处理中，交给分账结果自动查询")
+
+    def _recharge_stage(self, item):
+        if not self._claim('recharge', item.xpbillid):
+            return []
+
+        order = self.recharge_demo.get_recharge_by_id(item.xpbillid)
+        if not order:
+            return []
+        if self.recharge_demo.recharge_single_order(order):
+            return [RechargedBill(order['merchant_id'])]
+        return []
+
+    def _withdraw_stage(self, item):
+        # 可用余额是否满足提现金额由查询条件判断，每次充值后只查询该商户的待提现单
+        # （数据库不可用时测试环境返回的模拟数据不按商户过滤，这里再核对一次商户号）
+        for order in self.withdraw_demo.get_withdraw_orders_from_database(merchant_id=item.merchant_id):
+            if str(order['merchantno']) == str(item.merchant_id) and self._claim('withdraw', order['billid']):
+                self.withdraw_demo.withdraw_single_order(order)
+        return []
+
+    def _claim(self, step, key):
+        """同一步骤同一单据只处理一次"""
+        with self._claimed_lock:
+            if (step, key) in self._claimed:
+                return False
+            self._claimed.add((step, key))
+            return True
+
+
+# ===== 主函数和调用示例 =====
+def run_demo():
+    """运行演示程序"""
+    print("🔗 MUMUSO结算全流程作业")
+    print("=" * 80)
+
+    ready, msg = Config.is_config_ready()
+    if not ready:
+        print(f"⚠️ 配置检查失败: {msg}")
+        return False
+
+    SettlementFlowDemo().run()
+    print("\n🎉 结算全流程作业完成!")
+    return True
+
+
+if __name__ == '__main__':
+    try:
+        run_demo()
+    except KeyboardInterrupt:
+        print("\n👋 程序退出")
+    except Exception as e:
+        print(f"❌ 程序异常: {str(e)}")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+分片多进程批量执行入口
+文件名: sharded_batch_runner.py
+功能: 按商户号哈希把批量上传 / 批量分账分到N个工作进程，每个进程独立的OpenClient、签名器和数据库连接，
+     用满结算主机的所有CPU核。父进程汇总各分片的进度和结果。
+     - 上传: 按订单商户号(merchant_id)分片
+     - 分账: 按付款方商户号(payer_merchant_id)分片，同一付款方的扣款仍在一个进程内串行
+
+用法:
+    python sharded_batch_runner.py upload            # 分片数取 SHARD_RUNNER_CONFIG.WORKERS（0为CPU核数）
+    python sharded_batch_runner.py split --workers 4
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.LogPipeline import route_logger
+from common.ShardRunner import ShardedBatchRunner
+from config import Config
+
+
+# ===== 分片任务（在工作进程中执行，须为模块级函数） =====
+def upload_shard_task(logger, progress):
+    from order_upload_demo import OrderUploadDemo
+    success_count, total, failed_orders = OrderUploadDemo(logger).batch_upload_orders(progress_callback=progress)
+    return {'total': total, 'success': success_count, 'failed': len(failed_orders)}
+
+
+def split_shard_task(logger, progress):
+    from split_account_demo import SplitAccountDemo
+    demo = SplitAccountDemo(logger)
+    results = demo.batch_split_orders(progress_callback=progress)
+    success_count = sum(1 for result in results if result.get('success'))
+    return {'total': len(results), 'success': success_count, 'failed': len(results) - success_count,
+            'deferred': len(demo.deferred_orders)}
+
+
+TASKS = {
+    'upload': ('批量上传', upload_shard_task),
+    'split': ('批量分账', split_shard_task),
+}
+
+
+def run_demo(argv=None):
+    """运行分片批量任务"""
+    parser = argparse.ArgumentParser(description='按商户号哈希分片的多进程批量执行')
+    parser.add_argument('task', choices=sorted(TASKS), help='批量任务: upload=批量上传, split=批量分账')
+    parser.add_argument('--workers', type=int, default=None, help='分片（工作进程）数，默认取配置')
+    args = parser.parse_args(argv)
+
+    print("🧩 MUMUSO分片批量执行")
+    print("=" * 80)
+
+    ready, msg = Config.is_config_ready()
+    if not ready:
+        print(f"⚠️ 配置检查失败: {msg}")
+        return False
+
+    logger = logging.getLogger('ShardedBatchRunner')
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+    route_logger(logger)
+
+    runner_config = Config.get_shard_runner_config()
+    task_name, task = TASKS[args.task]
+    shard_count = args.workers or runner_config.get('WORKERS', 0) or None
+    if args.task == 'upload' and not Config.should_use_dynamic_merchant_id() and shard_count != 1:
+        # 全部订单使用同一个备用商户号，多个分片中只有一个有数据
+        logger.warning("[分片执行] ⚠️ 未启用动态商户号，订单无法按商户号分片，改为单分片执行")
+        shard_count = 1
+    runner = ShardedBatchRunner(task,
+                                shard_count=shard_count,
+                                progress_interval=runner_config.get('PROGRESS_INTERVAL', 5),
+                                logger=logger)
+    logger.info(f"[分片执行] 📋 任务: {task_name}，分片数: {runner.shard_count}，环境: {Config.get_env_name()}")
+    result = runner.run()
+
+    totals = result['totals']
+    print(f"\n🎉 {task_name}完成: 共 {totals.get('total', 0)} 条，成功 {totals.get('success', 0)} 条，"
+          f"失败 {totals.get('failed', 0)} 条，耗时 {result['elapsed']:.2f}秒")
+    if result['errors']:
+        print(f"⚠️ {len(result['errors'])} 个分片执行失败: "
+              + "; ".join(f"分片{index + 1}: {error}" for index, error in sorted(result['errors'].items())))
+    return not result['errors']
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(0 if run_demo() else 1)
+    except KeyboardInterrupt:
+        print("\n👋 程序退出")
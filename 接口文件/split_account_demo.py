@@ -18,13 +18,23 @@
 """
 
 import json
-import time
 import uuid
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import cx_Oracle
 
-from common.OpenClient import OpenClient
+from common.OpenClient import OpenClient, enable_debug_logging
+from common.PartitionScheduler import PartitionScheduler
+from common.RunJournal import RunJournal
+from common.LogPipeline import route_logger
+from common.IdempotencyLedger import get_idempotency_ledger
+from common.DeadLetter import DeadLetterStore, get_dead_letter_store
+from common.BalanceCache import invalidate_merchant_balance
+from common.SqlStats import instrument_connection
+from common.Priority import PriorityScorer, get_merchants_awaiting_withdraw
+from common.ShardRunner import get_current_shard, shard_predicate
+from request.AccountBalanceQueryRequest import AccountBalanceQueryRequestHandler
 from model.SplitAccountModel import SplitAccountModel
 from request.SplitAccountRequest import SplitAccountRequest
 from config import Config
@@ -35,6 +45,12 @@ from config_adapter import config_adapter
 class SplitAccountDemo:
     """分账申请演示类 - GUI支持版本"""
 
+    # 订单延后原因
+    DEFER_INSUFFICIENT_BALANCE = 'INSUFFICIENT_BALANCE'
+
+    # 死信队列的业务步骤名
+    DEAD_LETTER_STAGE = 'split'
+
     def __init__(self, logger=None):
         self.config = Config
         self.client = OpenClient(Config.APP_ID, Config.PRIVATE_KEY, Config.get_url())
@@ -50,6 +66,20 @@ class SplitAccountDemo:
                 handler.setFormatter(formatter)
                 self.logger.addHandler(handler)
                 self.logger.setLevel(logging.INFO)
+        # 日志经异步管道输出，不阻塞业务线程
+        route_logger(self.logger)
+        # DEBUG级别时输出开放平台请求参数和原始响应
+        enable_debug_logging(self.logger)
+
+        # 出站请求幂等台账（发送前检查，避免回写失败后重复分账）
+        self.ledger = get_idempotency_ledger(self.logger)
+
+        # 失败订单记入死信队列，由定时重试任务重新分账（已成功的分账目标由幂等台账跳过）
+        self.dead_letters = get_dead_letter_store(self.logger)
+
+        # 分账前余额预检（按需创建余额查询处理器）
+        self.balance_handler = None
+        self.deferred_orders = []
 
         self.logger.info(f"[分账管理] 💰 分账申请系统初始化完成")
         self.logger.info(f"[分账管理] 🌍 当前环境: {Config.get_env_name()}")
@@ -61,7 +91,7 @@ class SplitAccountDemo:
         try:
             user, password, dsn = Config.get_db_connection_info()
             self.logger.info(f"[分账管理] 正在连接数据库: {dsn}")
-            connection = cx_Oracle.connect(user, password, dsn)
+            connection = instrument_connection(cx_Oracle.connect(user, password, dsn), self.logger)
             self.logger.info(f"[分账管理] ✅ 数据库连接成功: {dsn}")
             return connection
         except Exception as e:
@@ -91,11 +121,22 @@ class SplitAccountDemo:
                 LEFT JOIN P_BL_SELL_PAYAMOUNT_HZ_dt dt ON hd.billid = dt.billid 
                 WHERE hd.cancelsign = 'N' 
                 AND dt.cancelsign = 'N'
-                AND dt.IS_FZ_REQUEST = 'N'
+                AND CASE WHEN dt.IS_FZ_REQUEST = 'N' THEN 'N' END = 'N'
                 AND hd.status = '003'
                 and dt.paytype in('099','003')
                 AND (dt.gs_fzmoney <> 0 OR dt.jms_fzmoney <> 0 or dt.sourcemoney <>0 )
                 AND hd.allresult_check_sign='Y'
+            """
+            # 分片运行时按付款方商户号分片（与 _process_query_results 中付款方的取法一致）
+            shard_condition, params = shard_predicate(
+                "CASE WHEN TRUNC(NVL(dt.sourcemoney, 0) * 100) > 0 THEN hd.payaccoutgsyx ELSE hd.jms_payaccount END")
+            if shard_condition:
+                shard = get_current_shard()
+                self.logger.info(f"[分账管理] 🧩 分片 {shard[0] + 1}/{shard[1]}: 只读取本分片付款方的订单")
+                sql += f"""
+                AND {shard_condition}
+            """
+            sql += """
                 ORDER BY hd.billid ASC, dt.xpbillid ASC
             """
 
@@ -111,7 +152,7 @@ class SplitAccountDemo:
                 f"[分账管理]   - (dt.gs_fzmoney <> 0 OR dt.jms_fzmoney <> 0 or dt.sourcemoney <>0): 分账金额或营销转账金额不为0")
             self.logger.info(f"[分账管理]   - hd.allresult_check_sign='Y': 审核通过")
 
-            cursor.execute(sql)
+            cursor.execute(sql, params)
             rows = cursor.fetchall()
 
             self.logger.info(f"[分账管理] 📊 数据库查询结果: 共找到 {len(rows)} 条待分账记录")
@@ -157,7 +198,7 @@ class SplitAccountDemo:
                 LEFT JOIN P_BL_SELL_PAYAMOUNT_HZ_dt dt ON hd.billid = dt.billid 
                 WHERE hd.cancelsign = 'N' 
                 AND dt.cancelsign = 'N'
-                AND dt.IS_FZ_REQUEST = 'N'
+                AND CASE WHEN dt.IS_FZ_REQUEST = 'N' THEN 'N' END = 'N'
                 AND hd.status = '003'
                 and dt.paytype in('099','003')
                 AND (dt.gs_fzmoney <> 0 OR dt.jms_fzmoney <> 0 or dt.sourcemoney <>0 )
@@ -447,16 +488,8 @@ class SplitAccountDemo:
             self.logger.error(f"[分账管理] 错误详情: {traceback.format_exc()}")
             return None
 
-    def split_single_order(self, order_data):
-        """对单个订单进行分账申请"""
-        self.logger.info(f"[分账管理] " + "=" * 60)
-        self.logger.info(f"[分账管理] 💰 开始订单分账申请: {order_data['billid']}")
-        self.logger.info(f"[分账管理] 📄 明细单据号: {order_data.get('xpbillid', 'N/A')}")
-        self.logger.info(f"[分账管理] " + "=" * 60)
-
-        results = []
-        split_sequence = 1
-
+    def _plan_split_targets(self, order_data):
+        """根据订单数据确定分账目标列表"""
         # 🔥 准备分账目标列表 - 根据sourcemoney确定分账策略（修正后的关键逻辑）
         split_targets = []
 
@@ -492,85 +525,27 @@ class SplitAccountDemo:
                     'type': 'GS'
                 })
 
-        self.logger.info(f"[分账管理] 📊 分账计划:")
-        self.logger.info(f"[分账管理]   付款方: {order_data['payer_merchant_id']}")
-        self.logger.info(f"[分账管理]   分账目标数: {len(split_targets)}")
-        for target in split_targets:
-            self.logger.info(f"[分账管理]   - {target['type']}: {target['merchant_id']} ({target['amount']}分)")
+        return split_targets
 
-        # 执行分账
-        for target in split_targets:
-            try:
-                self.logger.info(f"[分账管理] 📄 执行{target['type']}分账...")
-
-                # 创建分账请求
-                request = self.create_split_request(
-                    order_data, target, split_sequence, target['type']
-                )
-
-                # 执行分账请求
-                response = self.execute_split_request(
-                    request, order_data, target, target['type']
-                )
-
-                # 处理响应
-                success, msg = self._handle_split_response(response)
-
-                result = {
-                    'target_type': target['type'],
-                    'target_merchant': target['merchant_id'],
-                    'amount': target['amount'],
-                    'success': success,
-                    'message': msg,
-                    'response': response,
-                    'billid': order_data['billid'],
-                    'xpbillid': order_data.get('xpbillid', ''),
-                    'request_id': None,
-                    'trade_no': None,
-                    'execute_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-
-                # 提取API返回的关键信息
-                if success and response:
-                    split_response = response
-                    if 'bkfunds_balance_pay_apply_response' in response:
-                        split_response = response['bkfunds_balance_pay_apply_response']
-
-                    result['request_id'] = split_response.get('request_id')
-                    data = split_response.get('data', {})
-                    result['trade_no'] = data.get('trade_no')
-
-                results.append(result)
-
-                if success:
-                    self.logger.info(f"[分账管理] ✅ {target['type']}分账成功: {target['amount']}分")
-                else:
-                    self.logger.error(f"[分账管理] ❌ {target['type']}分账失败: {msg}")
-
-                split_sequence += 1
-
-                # 间隔一下避免请求过快
-                time.sleep(1)
-
-            except Exception as e:
-                error_msg = f"分账异常: {str(e)}"
-                self.logger.error(f"[分账管理] ❌ {target['type']}分账异常: {error_msg}")
-
-                result = {
-                    'target_type': target['type'],
-                    'target_merchant': target['merchant_id'],
-                    'amount': target['amount'],
-                    'success': False,
-                    'message': error_msg,
-                    'response': None,
-                    'billid': order_data['billid'],
-                    'xpbillid': order_data.get('xpbillid', ''),
-                    'request_id': None,
-                    'trade_no': None,
-                    'execute_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                results.append(result)
+    def _prioritize_orders(self, orders):
+        """按优先级排序待分账订单：收款方有提现单在等待资金入账的订单加分（同一付款方内按排序后的顺序扣款）"""
+        scorer = PriorityScorer.from_config(self.logger)
+        if not scorer or not orders:
+            return orders
 
+        awaiting = get_merchants_awaiting_withdraw(self.logger)
+        selected, _ = scorer.order(orders,
+                                   amount=lambda order: order['total_amount'],
+                                   merchant=lambda order: order['payer_merchant_id'],
+                                   waiting=lambda order: any(
+                                       str(order.get(field)) in awaiting
+                                       for field in ('payee_jms_merchant_id', 'payee_gs_merchant_id',
+                                                     'payee_target_merchant_id') if order.get(field)),
+                                   label='分账申请')
+        return selected
+
+    def _writeback_split_results(self, order_data, results):
+        """汇总单笔订单的分账结果并回写数据库"""
         # 汇总结果
         success_count = sum(1 for r in results if r['success'])
         total_count = len(results)
@@ -613,6 +588,200 @@ class SplitAccountDemo:
         else:
             self.logger.error(f"[分账管理] ❌ 分账状态回写失败")
 
+        self._dead_letter_split_result(order_data, results, all_success, update_success)
+        return update_success
+
+    def _dead_letter_split_result(self, order_data, results, all_success, update_success):
+        """分账全部成功并回写后移出死信队列，否则按失败类型记入"""
+        if not self.dead_letters:
+            return
+        item_key = f"{order_data['billid']}|{order_data.get('xpbillid', '')}"
+        if all_success and update_success:
+            self.dead_letters.resolve(self.DEAD_LETTER_STAGE, item_key)
+            return
+
+        failed = [r for r in results if not r['success']]
+        if not failed:
+            failure_class, error = DeadLetterStore.WRITEBACK, "分账已全部成功但数据库回写失败"
+        else:
+            # 没有接口响应的失败来自处理异常（网络、超时等）
+            failure_class = DeadLetterStore.EXCEPTION if any(r.get('response') is None for r in failed) \
+                else DeadLetterStore.BUSINESS
+            error = "; ".join(f"{r['target_type']}: {r['message']}" for r in failed)
+        self.dead_letters.add(self.DEAD_LETTER_STAGE, item_key, order_data, failure_class, error)
+
+    def _ledger_lookup(self, order_data, target):
+        """查询幂等台账，返回该分账目标上次成功的记录，未分账过返回None"""
+        if not self.ledger:
+            return None
+        record = self.ledger.get(SplitAccountRequest().get_method(), order_data.get('xpbillid', ''), target['type'])
+        if record:
+            self.logger.warning(f"[分账管理] ♻️ {order_data.get('xpbillid', '')} 的{target['type']}分账已于 "
+                                f"{record['create_time']} 成功(trade_no: {record['trade_no']})，跳过发送")
+        return record
+
+    def _ledger_record(self, order_data, target, request_id, trade_no):
+        """分账成功后记入幂等台账"""
+        if self.ledger:
+            self.ledger.put(SplitAccountRequest().get_method(), order_data.get('xpbillid', ''), target['type'],
+                            request_no=request_id, trade_no=trade_no)
+
+    @staticmethod
+    def _ledger_result(order_data, target, record):
+        """根据幂等台账记录构造分账结果"""
+        return {
+            'target_type': target['type'],
+            'target_merchant': target['merchant_id'],
+            'amount': target['amount'],
+            'success': True,
+            'message': '已成功分账(幂等台账)',
+            'response': None,
+            'billid': order_data['billid'],
+            'xpbillid': order_data.get('xpbillid', ''),
+            'request_id': record['request_no'],
+            'trade_no': record['trade_no'],
+            'execute_time': record['create_time']
+        }
+
+    def _ledger_results(self, order_data):
+        """订单的全部分账目标都已记入幂等台账时返回按台账构造的分账结果，否则返回None"""
+        split_targets = self._plan_split_targets(order_data)
+        results = []
+        for target in split_targets:
+            record = self._ledger_lookup(order_data, target)
+            if not record:
+                return None
+            results.append(self._ledger_result(order_data, target, record))
+        return results or None
+
+    @staticmethod
+    def _journal_key(order_data):
+        """运行日志中订单的唯一键"""
+        return f"{order_data['billid']}|{order_data.get('xpbillid', '')}"
+
+    @staticmethod
+    def _slim_results(results):
+        """去掉原始响应，只保留回写所需字段，用于写入运行日志"""
+        return [{k: v for k, v in r.items() if k != 'response'} for r in results]
+
+    def _execute_split_target(self, order_data, target, split_sequence):
+        """执行单个分账目标的分账申请，返回分账结果（异常也转换为失败结果）"""
+        try:
+            # 已成功分账过的目标直接复用上次结果
+            record = self._ledger_lookup(order_data, target)
+            if record:
+                return self._ledger_result(order_data, target, record)
+
+            self.logger.info(f"[分账管理] 📄 执行{target['type']}分账...")
+
+            # 创建分账请求
+            request = self.create_split_request(
+                order_data, target, split_sequence, target['type']
+            )
+
+            # 执行分账请求
+            response = self.execute_split_request(
+                request, order_data, target, target['type']
+            )
+
+            # 处理响应
+            success, msg = self._handle_split_response(response)
+
+            result = {
+                'target_type': target['type'],
+                'target_merchant': target['merchant_id'],
+                'amount': target['amount'],
+                'success': success,
+                'message': msg,
+                'response': response,
+                'billid': order_data['billid'],
+                'xpbillid': order_data.get('xpbillid', ''),
+                'request_id': None,
+                'trade_no': None,
+                'execute_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+
+            # 提取API返回的关键信息
+            if success and response:
+                split_response = response
+                if 'bkfunds_balance_pay_apply_response' in response:
+                    split_response = response['bkfunds_balance_pay_apply_response']
+
+                result['request_id'] = split_response.get('request_id')
+                data = split_response.get('data', {})
+                result['trade_no'] = data.get('trade_no')
+                self._ledger_record(order_data, target, result['request_id'], result['trade_no'])
+
+            if success:
+                self.logger.info(f"[分账管理] ✅ {target['type']}分账成功: {target['amount']}分")
+            else:
+                self.logger.error(f"[分账管理] ❌ {target['type']}分账失败: {msg}")
+
+            return result
+
+        except Exception as e:
+            error_msg = f"分账异常: {str(e)}"
+            self.logger.error(f"[分账管理] ❌ {target['type']}分账异常: {error_msg}")
+
+            return {
+                'target_type': target['type'],
+                'target_merchant': target['merchant_id'],
+                'amount': target['amount'],
+                'success': False,
+                'message': error_msg,
+                'response': None,
+                'billid': order_data['billid'],
+                'xpbillid': order_data.get('xpbillid', ''),
+                'request_id': None,
+                'trade_no': None,
+                'execute_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+
+    def split_single_order(self, order_data, journal=None):
+        """
+        对单个订单进行分账申请
+        :param order_data: 订单数据
+        :param journal: 运行日志（批量运行时传入，用于断点续跑）
+        """
+        self.logger.info(f"[分账管理] " + "=" * 60)
+        self.logger.info(f"[分账管理] 💰 开始订单分账申请: {order_data['billid']}")
+        self.logger.info(f"[分账管理] 📄 明细单据号: {order_data.get('xpbillid', 'N/A')}")
+        self.logger.info(f"[分账管理] " + "=" * 60)
+
+        journal_key = self._journal_key(order_data)
+        split_targets = self._plan_split_targets(order_data)
+
+        self.logger.info(f"[分账管理] 📊 分账计划:")
+        self.logger.info(f"[分账管理]   付款方: {order_data['payer_merchant_id']}")
+        self.logger.info(f"[分账管理]   分账目标数: {len(split_targets)}")
+        for target in split_targets:
+            self.logger.info(f"[分账管理]   - {target['type']}: {target['merchant_id']} ({target['amount']}分)")
+
+        # 执行分账：同一订单的各分账目标相互独立，并发发送后统一回写
+        if journal:
+            journal.record(journal_key, RunJournal.SENT)
+        if len(split_targets) > 1:
+            with ThreadPoolExecutor(max_workers=len(split_targets),
+                                    thread_name_prefix='split-target') as executor:
+                futures = [executor.submit(self._execute_split_target, order_data, target, sequence)
+                           for sequence, target in enumerate(split_targets, 1)]
+                results = [future.result() for future in futures]
+        else:
+            results = [self._execute_split_target(order_data, target, sequence)
+                       for sequence, target in enumerate(split_targets, 1)]
+
+        if journal:
+            journal.record(journal_key, RunJournal.ACKED, results=self._slim_results(results))
+
+        # 付款方和收款方余额已变动，丢弃缓存的余额
+        invalidate_merchant_balance(order_data['payer_merchant_id'])
+        for target in split_targets:
+            invalidate_merchant_balance(target['merchant_id'])
+
+        self._writeback_split_results(order_data, results)
+        if journal:
+            journal.record(journal_key, RunJournal.WRITTEN_BACK)
+
         return results
 
     def split_single_order_by_xpbillid(self, xpbillid):
@@ -635,38 +804,68 @@ class SplitAccountDemo:
 
         return all_results
 
-    def batch_split_orders(self):
-        """批量处理分账申请"""
+    def batch_split_orders(self, progress_callback=None):
+        """
+        批量处理分账申请
+        :param progress_callback: 进度回调 progress_callback(done, total, message)
+        """
         self.logger.info(f"[分账管理] 🚀 开始批量分账申请处理")
         self.logger.info(f"[分账管理] 🌍 当前环境: {Config.get_env_name()}")
 
-        # 获取待分账订单
-        orders = self.get_split_orders_from_database()
+        all_results = []
+        self.deferred_orders = []
+
+        # 上次运行中断时优先按运行日志续跑，否则从数据库获取待分账订单
+        journal = RunJournal.from_config('split_account', self.logger)
+        entries = journal.resume_run() if journal else None
+        if entries is not None:
+            self.logger.info("[分账管理] ♻️ 按运行日志续跑上次未完成的批次...")
+            orders = self._restore_split_orders(journal, entries, all_results)
+        else:
+            # 先按优先级排序，余额预检按排序后的顺序占用付款方余额，余额不足时延后的是低优先级订单；
+            # 余额不够的订单本次不发起申请，只把能执行的订单纳入运行日志
+            orders = self._prioritize_orders(self.get_split_orders_from_database())
+            orders, self.deferred_orders = self.preflight_split_orders(orders)
+            if journal and orders:
+                journal.start_run(orders, self._journal_key)
 
         if not orders:
             self.logger.warning(f"[分账管理] ⚠️ 没有找到待分账的订单")
-            return []
+            if journal:
+                journal.finish_run()
+            return all_results
 
         self.logger.info(f"[分账管理] 📊 开始处理 {len(orders)} 笔待分账订单")
 
-        all_results = []
-        for i, order in enumerate(orders, 1):
-            self.logger.info(
-                f"[分账管理] 📋 处理第 {i}/{len(orders)} 笔订单: {order['billid']}-{order.get('xpbillid', 'N/A')}")
+        # 按付款方分组：同一付款方的订单串行扣款，不同付款方并行
+        scheduler_config = Config.get_split_scheduler_config()
+        scheduler = PartitionScheduler(
+            max_workers=scheduler_config.get('MAX_PARALLEL_PAYERS', 4),
+            item_interval=scheduler_config.get('PAYER_ITEM_INTERVAL', 0),
+            name='split-payer',
+            logger=self.logger
+        )
 
-            try:
-                # 执行分账
-                results = self.split_single_order(order)
+        def on_order_done(done, total, order, results):
+            status = '完成' if results is not None else '异常'
+            self.logger.info(
+                f"[分账管理] 📋 第 {done}/{total} 笔订单{status}: {order['billid']}-{order.get('xpbillid', 'N/A')} "
+                f"(付款方: {order['payer_merchant_id']})")
+            if progress_callback:
+                progress_callback(done, total, f"处理订单: {order['billid']}-{order.get('xpbillid', 'N/A')}")
+
+        order_results = scheduler.run(
+            orders,
+            key_func=lambda order: order['payer_merchant_id'],
+            handler=lambda order: self.split_single_order(order, journal),
+            on_item_done=on_order_done
+        )
+        for results in order_results:
+            if results:
                 all_results.extend(results)
 
-                # 间隔一下
-                if i < len(orders):
-                    self.logger.info(f"[分账管理] ⏱️ 等待2秒后处理下一笔订单...")
-                    time.sleep(2)
-
-            except Exception as e:
-                self.logger.error(
-                    f"[分账管理] ❌ 订单处理异常: {order['billid']}-{order.get('xpbillid', 'N/A')}, 错误: {str(e)}")
+        if journal:
+            journal.finish_run()
 
         # 汇总统计
         total_splits = len(all_results)
@@ -676,6 +875,8 @@ class SplitAccountDemo:
         self.logger.info(f"[分账管理] 📊 批量分账申请完成")
         self.logger.info(f"[分账管理] " + "=" * 60)
         self.logger.info(f"[分账管理] 📈 处理订单数: {len(orders)}")
+        if self.deferred_orders:
+            self.logger.info(f"[分账管理] ⏸️ 余额不足延后订单数: {len(self.deferred_orders)}")
         self.logger.info(f"[分账管理] 🎯 分账申请总数: {total_splits}")
         self.logger.info(f"[分账管理] ✅ 分账成功: {success_splits}")
         self.logger.info(f"[分账管理] ❌ 分账失败: {total_splits - success_splits}")
@@ -684,6 +885,123 @@ class SplitAccountDemo:
 
         return all_results
 
+    def preflight_split_orders(self, orders):
+        """
+        分账前余额预检：按付款方汇总应扣金额（各分账目标金额之和，营销转账模式只扣营销转账金额），
+        每个付款方只查询一次可用余额，
+        按订单顺序依次占用余额，放得下的订单执行，放不下的延后到下次并记录原因
+        余额查询失败时不拦截该付款方的订单，由分账接口自行判断
+        :return: (可执行订单列表, 延后订单列表)
+        """
+        if not orders or not Config.get_split_scheduler_config().get('PREFLIGHT_BALANCE_CHECK', True):
+            return orders, []
+
+        payer_orders = {}
+        for order in orders:
+            payer_orders.setdefault((order['payer_merchant_id'], str(order.get('payer_type') or '1')), []).append(order)
+
+        self.logger.info(f"[分账管理] 🔍 余额预检: {len(orders)} 笔订单，涉及 {len(payer_orders)} 个付款方")
+
+        if self.balance_handler is None:
+            self.balance_handler = AccountBalanceQueryRequestHandler(self.logger)
+
+        def query_available(payer):
+            merchant_id, account_type = payer
+            try:
+                response = self.balance_handler.query_single_balance(int(merchant_id), account_type)
+            except (TypeError, ValueError):
+                self.logger.warning(f"[分账管理] ⚠️ 付款方商户号无效，跳过余额预检: {merchant_id}")
+                return None
+            if not response.is_success() or not response.data:
+                self.logger.warning(
+                    f"[分账管理] ⚠️ 付款方 {merchant_id} 余额查询失败，跳过余额预检: {response.get_error_message()}")
+                return None
+            return response.data.available_balance or 0
+
+        payers = list(payer_orders.keys())
+        workers = max(1, min(Config.get_split_scheduler_config().get('MAX_PARALLEL_PAYERS', 4), len(payers)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='split-preflight') as executor:
+            available_balances = dict(zip(payers, executor.map(query_available, payers)))
+
+        runnable = []
+        deferred = []
+        for payer, payer_order_list in payer_orders.items():
+            available = available_balances[payer]
+            if available is None:
+                runnable.extend(payer_order_list)
+                continue
+
+            debits = [self._payer_debit(order) for order in payer_order_list]
+            required_total = sum(debits)
+            remaining = available
+            for order, debit in zip(payer_order_list, debits):
+                if debit <= remaining:
+                    remaining -= debit
+                    runnable.append(order)
+                else:
+                    order['split_status'] = '已延后'
+                    order['defer_reason'] = self.DEFER_INSUFFICIENT_BALANCE
+                    deferred.append(order)
+                    self.logger.warning(
+                        f"[分账管理] ⏸️ 订单延后: {order['billid']}-{order.get('xpbillid', 'N/A')} "
+                        f"需扣 {debit}分，付款方 {payer[0]} 剩余可用 {remaining}分 "
+                        f"[{self.DEFER_INSUFFICIENT_BALANCE}]")
+
+            if required_total > available:
+                self.logger.warning(
+                    f"[分账管理] 💸 付款方 {payer[0]} 可用余额不足: 可用 {available}分，应扣合计 {required_total}分")
+
+        # 保持订单原有顺序
+        order_index = {id(order): index for index, order in enumerate(orders)}
+        runnable.sort(key=lambda order: order_index[id(order)])
+
+        self.logger.info(f"[分账管理] 🔍 余额预检完成: 可执行 {len(runnable)} 笔，延后 {len(deferred)} 笔")
+        return runnable, deferred
+
+    def _payer_debit(self, order_data):
+        """订单从付款方扣减的金额：各分账目标金额之和"""
+        return sum(target['amount'] for target in self._plan_split_targets(order_data))
+
+    def _restore_split_orders(self, journal, entries, all_results):
+        """
+        根据运行日志恢复上次未完成的分账订单，返回需要重新执行分账的订单列表
+        - 已回写: 跳过
+        - 已收到全部分账结果: 只补做数据库回写，结果并入all_results
+        - 已发出但未收到结果: 各分账目标在幂等台账中都有成功记录的按台账结果补做回写，
+          否则结果不确定，不自动重发，标记失败待人工核实
+        - 仅纳入批次: 重新执行分账
+        """
+        orders = []
+        for key, entry in entries.items():
+            state = entry['state']
+            order_data = entry['data']
+            if state in RunJournal.TERMINAL_STATES or order_data is None:
+                continue
+
+            if state == RunJournal.ACKED:
+                results = entry['extra'].get('results', [])
+                self.logger.info(f"[分账管理] ♻️ 补做分账回写: {key}")
+                self._writeback_split_results(order_data, results)
+                journal.record(key, RunJournal.WRITTEN_BACK)
+                all_results.extend(results)
+            elif state == RunJournal.SENT:
+                results = self._ledger_results(order_data)
+                if results is not None:
+                    self.logger.info(f"[分账管理] ♻️ 订单 {key} 已在幂等台账中确认分账成功，补做分账回写")
+                    self._writeback_split_results(order_data, results)
+                    journal.record(key, RunJournal.WRITTEN_BACK)
+                    all_results.extend(results)
+                    continue
+                self.logger.warning(f"[分账管理] ⚠️ 订单 {key} 中断前已发出分账请求但未确认结果，"
+                                    f"为避免重复分账标记为失败，请人工核实")
+                self.update_split_status_by_xpbillid(order_data['billid'], order_data.get('xpbillid', ''), False)
+                journal.record(key, RunJournal.FAILED, reason='uncertain')
+            else:
+                orders.append(order_data)
+
+        self.logger.info(f"[分账管理] ♻️ 续跑需重新分账的订单: {len(orders)} 笔")
+        return orders
+
     def _handle_split_response(self, response):
         """处理分账申请响应结果"""
         self.logger.info(f"[分账管理] 📊 响应解析:")
@@ -806,7 +1124,7 @@ class SplitAccountDemo:
                 FZ_REQUESTBACK_NO = :trade_no
             WHERE billid = :billid 
               AND xpbillid = :xpbillid
-              AND (IS_FZ_REQUEST IS NULL OR IS_FZ_REQUEST = 'N')
+              AND (IS_FZ_REQUEST IS NULL OR IS_FZ_REQUEST IN ('N', 'F'))
             """
 
             params = {
@@ -827,44 +1145,12 @@ class SplitAccountDemo:
             connection.commit()
             affected_rows_dt = cursor.rowcount
 
+            # UPDATE自带条件和影响行数即可判断回写结果，不再额外SELECT验证
             if affected_rows_dt > 0:
                 self.logger.info(f"[分账管理] ✅ 明细表分账申请状态更新成功，影响行数: {affected_rows_dt}")
-
-                # 验证回写结果
-                verify_sql = """
-                SELECT IS_FZ_REQUEST, FZ_SPLIT_RECORD, FZ_REQUESTBACK_NO 
-                FROM P_BL_SELL_PAYAMOUNT_HZ_dt 
-                WHERE billid = :billid AND xpbillid = :xpbillid
-                """
-                cursor.execute(verify_sql, {'billid': billid, 'xpbillid': xpbillid})
-                verify_result = cursor.fetchone()
-                if verify_result:
-                    is_fz_request, fz_split_record, fz_requestback_no = verify_result
-                    self.logger.info(
-                        f"[分账管理] 📄 验证回写结果: IS_FZ_REQUEST={is_fz_request}, FZ_SPLIT_RECORD={fz_split_record}, FZ_REQUESTBACK_NO={fz_requestback_no}")
-
-                    if fz_split_record == safe_request_id and fz_requestback_no == safe_trade_no:
-                        self.logger.info(f"[分账管理] ✅ FZ_SPLIT_RECORD和FZ_REQUESTBACK_NO回写成功验证通过")
-                    else:
-                        self.logger.warning(
-                            f"[分账管理] ⚠️ 回写验证不一致，期望: request_id={safe_request_id}, trade_no={safe_trade_no}")
-
             else:
-                self.logger.warning(f"[分账管理] ⚠️ 明细表分账申请状态更新无影响行数: {billid}-{xpbillid}")
-                # 检查记录是否已经被处理
-                check_sql = """
-                SELECT IS_FZ_REQUEST, FZ_SPLIT_RECORD, FZ_REQUESTBACK_NO 
-                FROM P_BL_SELL_PAYAMOUNT_HZ_dt 
-                WHERE billid = :billid AND xpbillid = :xpbillid
-                """
-                cursor.execute(check_sql, {'billid': billid, 'xpbillid': xpbillid})
-                check_result = cursor.fetchone()
-                if check_result:
-                    is_fz_request, fz_split_record, fz_requestback_no = check_result
-                    self.logger.info(
-                        f"[分账管理] 📄 检查现有记录状态: IS_FZ_REQUEST={is_fz_request}, FZ_SPLIT_RECORD={fz_split_record}, FZ_REQUESTBACK_NO={fz_requestback_no}")
-                    if is_fz_request == 'Y':
-                        self.logger.warning(f"[分账管理] ⚠️ 记录已经被处理过，IS_FZ_REQUEST=Y")
+                self.logger.warning(f"[分账管理] ⚠️ 明细表分账申请状态更新无影响行数: {billid}-{xpbillid} "
+                                    f"(记录不存在或已分账成功，IS_FZ_REQUEST为Y)")
 
             cursor.close()
             return affected_rows_dt > 0
@@ -21,6 +21,10 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import Config
+from common.OraclePool import pooled_connection
+from common.LogPipeline import route_logger
+from common.PollSchedule import AdaptivePollSchedule
+from common.SqlStats import instrument_connection
 from request.SplitQueryRequest import BalancePayQueryRequestHandler
 from model.SplitQueryModel import DatabaseQueryResult, BalancePayQueryResponse, BalancePayQueryData
 
@@ -30,7 +34,7 @@ class SplitQueryDemo:
 
     def __init__(self, logger: Optional[logging.Logger] = None):
         """初始化余额支付查询演示"""
-        self.logger = logger or logging.getLogger(__name__)
+        self.logger = route_logger(logger or logging.getLogger(__name__))
         self.query_handler = BalancePayQueryRequestHandler(logger)
 
         # 数据库连接配置
@@ -77,12 +81,12 @@ class SplitQueryDemo:
         try:
             self.logger.info("[余额支付查询] 测试数据库连接...")
 
-            connection = cx_Oracle.connect(
+            connection = instrument_connection(cx_Oracle.connect(
                 user=self.db_user,
                 password=self.db_password,
                 dsn=self.db_dsn,
                 encoding="UTF-8"
-            )
+            ), self.logger)
 
             cursor = connection.cursor()
             cursor.execute("SELECT 1 FROM DUAL")
@@ -115,12 +119,12 @@ class SplitQueryDemo:
         try:
             self.logger.info(f"[余额支付查询] 开始查询待查询记录，限制数量: {limit or '无限制'}")
 
-            connection = cx_Oracle.connect(
+            connection = instrument_connection(cx_Oracle.connect(
                 user=self.db_user,
                 password=self.db_password,
                 dsn=self.db_dsn,
                 encoding="UTF-8"
-            )
+            ), self.logger)
 
             cursor = connection.cursor()
 
@@ -177,12 +181,12 @@ class SplitQueryDemo:
         try:
             self.logger.info(f"[余额支付查询] 根据流水号查询数据库记录: {trade_no}")
 
-            connection = cx_Oracle.connect(
+            connection = instrument_connection(cx_Oracle.connect(
                 user=self.db_user,
                 password=self.db_password,
                 dsn=self.db_dsn,
                 encoding="UTF-8"
-            )
+            ), self.logger)
 
             cursor = connection.cursor()
 
@@ -254,7 +258,7 @@ class SplitQueryDemo:
         # 如果查询成功且需要自动回写
         if auto_writeback and api_result.is_success() and api_result.data and api_result.data.status == "1":
             self.logger.info(f"[余额支付查询] 分账成功，开始回写数据库: {trade_no}")
-            success = self._writeback_split_result(trade_no, api_result.data)
+            success = self._writeback_split_result(trade_no, api_result.data, db_record)
             if success:
                 self.logger.info(f"[余额支付查询] 回写成功: {trade_no}")
             else:
@@ -298,6 +302,7 @@ class SplitQueryDemo:
             success_count = 0
             writeback_success_count = 0
             total_count = len(trade_nos)
+            pending_writebacks = []  # 待回写: (trade_no, data, db_record, result_item)
 
             for i, trade_no in enumerate(trade_nos, 1):
                 try:
@@ -325,12 +330,9 @@ class SplitQueryDemo:
                     if result_item['success']:
                         success_count += 1
 
-                        # 如果分账成功且需要自动回写，执行回写操作
+                        # 如果分账成功且需要自动回写，先收集，查询结束后整批回写
                         if auto_writeback and result.data and result.data.status == "1":
-                            writeback_success = self._writeback_split_result(trade_no, result.data)
-                            result_item['writeback_success'] = writeback_success
-                            if writeback_success:
-                                writeback_success_count += 1
+                            pending_writebacks.append((trade_no, result.data, db_record, result_item))
 
                     # 添加延时避免频繁请求
                     if i < total_count:
@@ -355,6 +357,17 @@ class SplitQueryDemo:
                     }
                     results.append(result_item)
 
+            # 整批回写
+            if pending_writebacks:
+                if progress_callback:
+                    progress_callback(f"回写数据库: {len(pending_writebacks)} 条", 95)
+                outcome = self._flush_split_writebacks(
+                    [(trade_no, data, db_record) for trade_no, data, db_record, _ in pending_writebacks])
+                for trade_no, _, _, result_item in pending_writebacks:
+                    result_item['writeback_success'] = outcome.get(trade_no, False)
+                    if result_item['writeback_success']:
+                        writeback_success_count += 1
+
             # 最终进度更新
             if progress_callback:
                 final_message = f"查询完成! 成功: {success_count}/{total_count}"
@@ -386,8 +399,7 @@ class SplitQueryDemo:
         """
         self.logger.info(f"[余额支付查询] 开始批量回写结果，共 {len(results)} 条记录")
 
-        success_count = 0
-        total_count = 0
+        pending_writebacks = []
 
         for result_item in results:
             if not result_item.get('success'):
@@ -401,114 +413,123 @@ class SplitQueryDemo:
             if not trade_no:
                 continue
 
-            total_count += 1
+            # 结果中已带有查询时的billid/xpbillid，直接用于回写；缺失时按流水号补查
+            billid = result_item.get('billid')
+            xpbillid = result_item.get('xpbillid')
+            if billid and xpbillid and billid != 'N/A' and xpbillid != 'N/A':
+                db_record = DatabaseQueryResult(billid=billid, xpbillid=xpbillid, trade_no=trade_no)
+            else:
+                db_record = self.query_record_by_trade_no(trade_no)
+            pending_writebacks.append((trade_no, result.data, db_record, result_item))
 
-            try:
-                if self._writeback_split_result(trade_no, result.data):
-                    success_count += 1
-                    result_item['writeback_success'] = True
-                else:
-                    result_item['writeback_success'] = False
+        outcome = self._flush_split_writebacks(
+            [(trade_no, data, db_record) for trade_no, data, db_record, _ in pending_writebacks])
+        for trade_no, _, _, result_item in pending_writebacks:
+            result_item['writeback_success'] = outcome.get(trade_no, False)
 
-            except Exception as e:
-                self.logger.error(f"[余额支付查询] 回写记录失败 {trade_no}: {str(e)}")
-                result_item['writeback_success'] = False
+        total_count = len(pending_writebacks)
+        success_count = sum(1 for item in pending_writebacks if item[3]['writeback_success'])
 
         self.logger.info(f"[余额支付查询] 批量回写完成: {success_count}/{total_count} 成功")
         return success_count, total_count
 
-    def _writeback_split_result(self, trade_no: str, data: BalancePayQueryData) -> bool:
+    def _writeback_split_result(self, trade_no: str, data: BalancePayQueryData,
+                                db_record: Optional[DatabaseQueryResult] = None) -> bool:
         """
-        回写分账结果到数据库
+        回写单条分账结果到数据库
 
         Args:
             trade_no: 银行流水号
             data: 查询结果数据
+            db_record: 对应的数据库记录（已知时传入，避免再查库）
 
         Returns:
             bool: 回写是否成功
         """
-        try:
-            self.logger.info(f"[余额支付查询] 开始回写分账结果: {trade_no}")
-
-            connection = cx_Oracle.connect(
-                user=self.db_user,
-                password=self.db_password,
-                dsn=self.db_dsn,
-                encoding="UTF-8"
-            )
-
-            cursor = connection.cursor()
-
-            # 首先根据银行流水号查找对应的记录
-            # 这里使用与原始查询相同的逻辑来匹配记录
-            find_record_sql = self.query_sql + " AND ROWNUM = 1"
-
-            cursor.execute(find_record_sql)
-            record_row = cursor.fetchone()
-
-            if not record_row:
+        if db_record is None:
+            db_record = self.query_record_by_trade_no(trade_no)
+            if db_record is None:
                 self.logger.warning(f"[余额支付查询] 未找到对应的数据库记录: {trade_no}")
-                cursor.close()
-                connection.close()
                 return False
 
-            # 获取billid和xpbillid用于更新
-            billid = str(record_row[0]) if record_row[0] else ""
-            xpbillid = str(record_row[1]) if record_row[1] else ""
+        return self._flush_split_writebacks([(trade_no, data, db_record)]).get(trade_no, False)
 
-            if not billid or not xpbillid:
-                self.logger.warning(f"[余额支付查询] 记录缺少必要字段 billid={billid}, xpbillid={xpbillid}: {trade_no}")
-                cursor.close()
-                connection.close()
-                return False
+    def _flush_split_writebacks(self, pending: List[Tuple[str, BalancePayQueryData, DatabaseQueryResult]]) -> Dict[str, bool]:
+        """
+        批量回写分账结果：整批数组绑定执行一次UPDATE并提交一次
 
-            # 执行回写SQL语句：根据billid和xpbillid更新
-            writeback_sql = """
-                UPDATE P_BL_SELL_PAYAMOUNT_HZ_dt 
-                SET FZ_EXECUTE_RESULT = :result, 
-                    EXECUTE_RESULT_CONFIRMTIME = TO_DATE(:confirm_time, 'YYYY-MM-DD HH24:MI:SS')
-                WHERE billid = :billid 
-                AND xpbillid = :xpbillid
-            """
+        Args:
+            pending: [(银行流水号, 查询结果数据, 数据库记录)]，数据库记录来自查询时建立的流水号映射
 
-            # 准备参数
-            result_value = "Y" if data.status == "1" else "N"  # Y表示成功，N表示失败
-            confirm_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        Returns:
+            Dict[str, bool]: 各流水号的回写结果
+        """
+        outcome = {}
+        rows = []
+        confirm_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-            # 执行更新
-            cursor.execute(writeback_sql, {
-                'result': result_value,
-                'confirm_time': confirm_time,
+        for trade_no, data, db_record in pending:
+            billid = getattr(db_record, 'billid', '') if db_record else ''
+            xpbillid = getattr(db_record, 'xpbillid', '') if db_record else ''
+            if not billid or not xpbillid:
+                self.logger.warning(f"[余额支付查询] 记录缺少必要字段 billid={billid}, xpbillid={xpbillid}: {trade_no}")
+                outcome[trade_no] = False
+                continue
+            rows.append({
+                'trade_no': trade_no,
                 'billid': billid,
-                'xpbillid': xpbillid
+                'xpbillid': xpbillid,
+                'result': "Y" if data.status == "1" else "N",  # Y表示成功，N表示失败
+                'confirm_time': confirm_time
             })
 
-            # 检查影响的行数
-            rows_affected = cursor.rowcount
+        if not rows:
+            return outcome
 
-            # 提交事务
-            connection.commit()
+        # 根据billid和xpbillid更新
+        writeback_sql = """
+            UPDATE P_BL_SELL_PAYAMOUNT_HZ_dt 
+            SET FZ_EXECUTE_RESULT = :result, 
+                EXECUTE_RESULT_CONFIRMTIME = TO_DATE(:confirm_time, 'YYYY-MM-DD HH24:MI:SS')
+            WHERE billid = :billid 
+            AND xpbillid = :xpbillid
+        """
 
-            cursor.close()
-            connection.close()
+        try:
+            self.logger.info(f"[余额支付查询] 开始批量回写分账结果: {len(rows)} 条")
+
+            with pooled_connection(self.logger) as connection:
+                cursor = connection.cursor()
+                cursor.executemany(
+                    writeback_sql,
+                    [{k: row[k] for k in ('result', 'confirm_time', 'billid', 'xpbillid')} for row in rows],
+                    arraydmlrowcounts=True
+                )
+                row_counts = cursor.getarraydmlrowcounts()
+                connection.commit()
+                cursor.close()
 
-            if rows_affected > 0:
-                self.logger.info(
-                    f"[余额支付查询] 回写分账结果成功: {trade_no} (billid={billid}, xpbillid={xpbillid}, 影响行数: {rows_affected})")
-                return True
-            else:
-                self.logger.warning(
-                    f"[余额支付查询] 回写分账结果失败，未找到对应记录: {trade_no} (billid={billid}, xpbillid={xpbillid})")
-                return False
+            for row, rows_affected in zip(rows, row_counts):
+                trade_no = row['trade_no']
+                outcome[trade_no] = rows_affected > 0
+                if rows_affected > 0:
+                    self.logger.info(
+                        f"[余额支付查询] 回写分账结果成功: {trade_no} (billid={row['billid']}, xpbillid={row['xpbillid']}, 影响行数: {rows_affected})")
+                else:
+                    self.logger.warning(
+                        f"[余额支付查询] 回写分账结果失败，未找到对应记录: {trade_no} (billid={row['billid']}, xpbillid={row['xpbillid']})")
 
         except cx_Oracle.DatabaseError as e:
             error, = e.args
-            self.logger.error(f"[余额支付查询] 回写分账结果失败: ORA-{error.code}: {error.message}")
-            return False
+            self.logger.error(f"[余额支付查询] 批量回写分账结果失败: ORA-{error.code}: {error.message}")
+            for row in rows:
+                outcome[row['trade_no']] = False
         except Exception as e:
-            self.logger.error(f"[余额支付查询] 回写分账结果异常: {str(e)}")
-            return False
+            self.logger.error(f"[余额支付查询] 批量回写分账结果异常: {str(e)}")
+            for row in rows:
+                outcome[row['trade_no']] = False
+
+        return outcome
 
     def batch_query_from_database(self) -> Dict[str, BalancePayQueryResponse]:
         """
@@ -531,6 +552,9 @@ class SplitQueryDemo:
                 self._notify_progress("没有找到待查询的交易记录", 100)
                 return {}
 
+            # 创建交易号到记录的映射，回写时直接使用，无需再查库
+            trade_no_to_record = {record.get_trade_no(): record for record in db_records}
+
             # 提取银行流水号
             trade_nos = [record.get_trade_no() for record in db_records if record.get_trade_no()]
 
@@ -548,6 +572,7 @@ class SplitQueryDemo:
             success_count = 0
             writeback_success_count = 0
             total_count = len(trade_nos)
+            pending_writebacks = []
 
             for i, trade_no in enumerate(trade_nos, 1):
                 try:
@@ -562,10 +587,9 @@ class SplitQueryDemo:
                     if result.is_success():
                         success_count += 1
 
-                        # 如果分账成功，执行回写操作
+                        # 如果分账成功，收集后整批回写
                         if result.data and result.data.status == "1":
-                            if self._writeback_split_result(trade_no, result.data):
-                                writeback_success_count += 1
+                            pending_writebacks.append((trade_no, result.data, trade_no_to_record.get(trade_no)))
 
                         # 通知单个查询结果
                         self._notify_result('single_result', {
@@ -588,6 +612,12 @@ class SplitQueryDemo:
                         success=False
                     )
 
+            # 整批回写
+            if pending_writebacks:
+                self._notify_progress(f"回写数据库: {len(pending_writebacks)} 条", 95)
+                outcome = self._flush_split_writebacks(pending_writebacks)
+                writeback_success_count = sum(1 for ok in outcome.values() if ok)
+
             # 完成查询
             final_message = f"查询完成! 成功: {success_count}, 总数: {total_count}, 回写成功: {writeback_success_count}"
             self._notify_progress(final_message, 100)
@@ -639,28 +669,51 @@ class SplitQueryDemo:
         self._notify_result('auto_status', {'status': 'stopped'})
 
     def _auto_query_worker(self):
-        """自动查询工作线程"""
+        """
+        自动查询工作线程
+
+        每个AUTO_QUERY_INTERVAL扫描一次数据库发现新的待查询流水号；每笔流水号按自己的到期时间查询，
+        处理中的按指数退避拉长间隔，查到终态（0/1/2）后退出轮询。
+        """
         self.logger.info("[余额支付查询] 自动查询工作线程启动")
 
+        schedule = AdaptivePollSchedule(
+            initial_delay=Config.BALANCE_PAY_QUERY_CONFIG.get('POLL_INITIAL_DELAY', 30),
+            max_delay=Config.BALANCE_PAY_QUERY_CONFIG.get('POLL_MAX_DELAY', 1800),
+            backoff_factor=Config.BALANCE_PAY_QUERY_CONFIG.get('POLL_BACKOFF_FACTOR', 2)
+        )
+        scan_interval = self.auto_query_interval * 60
+        next_scan = 0
+
         while self.auto_query_running:
             try:
-                # 执行查询（包含自动回写）
-                self.logger.info("[余额支付查询] 执行定时自动查询")
-                results = self.batch_query_from_database()
-
-                # 通知自动查询结果
-                self._notify_result('auto_query_result', {
-                    'timestamp': datetime.now(),
-                    'results_count': len(results),
-                    'results': results
-                })
-
-                # 等待下次查询
-                wait_seconds = self.auto_query_interval * 60
-                for i in range(wait_seconds):
-                    if not self.auto_query_running:
-                        break
-                    time.sleep(1)
+                # 定期扫描数据库，同步待查询集合
+                if time.monotonic() >= next_scan:
+                    db_records = self.query_pending_split_records(self.batch_size)
+                    added = schedule.sync({record.get_trade_no(): record for record in db_records})
+                    next_scan = time.monotonic() + scan_interval
+                    self.logger.info(f"[余额支付查询] 扫描待查询记录: 新增 {added} 笔，轮询中 {len(schedule)} 笔")
+
+                due = schedule.pop_due()
+                if due:
+                    self.logger.info(f"[余额支付查询] 执行定时自动查询: 本轮到期 {len(due)} 笔")
+                    results = self._poll_due_trades(schedule, due)
+
+                    # 通知自动查询结果
+                    self._notify_result('auto_query_result', {
+                        'timestamp': datetime.now(),
+                        'results_count': len(results),
+                        'results': results
+                    })
+
+                # 等待到下一笔到期或下一次扫描
+                next_due = schedule.seconds_until_next()
+                wait_seconds = max(0.0, next_scan - time.monotonic())
+                if next_due is not None:
+                    wait_seconds = min(wait_seconds, next_due)
+                wait_until = time.monotonic() + wait_seconds
+                while self.auto_query_running and time.monotonic() < wait_until:
+                    time.sleep(min(1.0, max(0.0, wait_until - time.monotonic())))
 
             except Exception as e:
                 self.logger.error(f"[余额支付查询] 自动查询异常: {str(e)}")
@@ -669,6 +722,59 @@ class SplitQueryDemo:
 
         self.logger.info("[余额支付查询] 自动查询工作线程退出")
 
+    def _poll_due_trades(self, schedule: AdaptivePollSchedule, due: List[Tuple]) -> Dict[str, BalancePayQueryResponse]:
+        """
+        查询本轮到期的流水号：终态退出轮询，处理中或查询失败按退避重新排期
+
+        Returns:
+            Dict[str, BalancePayQueryResponse]: 本轮查询结果
+        """
+        results = {}
+        pending_writebacks = []
+
+        for i, (trade_no, db_record, attempts) in enumerate(due, 1):
+            if not self.auto_query_running:
+                break
+            try:
+                result = self.query_handler.query_balance_pay_result(trade_no)
+            except Exception as e:
+                self.logger.error(f"[余额支付查询] 查询流水号 {trade_no} 失败: {str(e)}")
+                result = BalancePayQueryResponse(request_id="", code=0, msg=f"查询异常: {str(e)}", success=False)
+            results[trade_no] = result
+
+            status = result.data.status if result.is_success() and result.data else None
+            if status == "1":
+                pending_writebacks.append((trade_no, result.data, db_record))
+            elif status in ("0", "2"):
+                schedule.retire(trade_no)
+                self.logger.info(f"[余额支付查询] {trade_no} 已到终态({result.data.get_status_text()})，退出轮询")
+            else:
+                delay = schedule.backoff(trade_no)
+                self.logger.info(f"[余额支付查询] {trade_no} 未到终态，第 {attempts + 1} 次查询，{int(delay)}秒后再查")
+
+            if result.is_success():
+                self._notify_result('single_result', {
+                    'seq': trade_no,
+                    'result': result,
+                    'index': i,
+                    'total': len(due)
+                })
+
+            # 添加延时避免频繁请求
+            if i < len(due):
+                time.sleep(0.5)
+
+        # 成功的整批回写，回写成功才退出轮询，失败的按退避稍后重试
+        if pending_writebacks:
+            outcome = self._flush_split_writebacks(pending_writebacks)
+            for trade_no, _, _ in pending_writebacks:
+                if outcome.get(trade_no):
+                    schedule.retire(trade_no)
+                else:
+                    schedule.backoff(trade_no)
+
+        return results
+
     def is_auto_query_running(self) -> bool:
         """检查自动查询是否在运行"""
         return self.auto_query_running
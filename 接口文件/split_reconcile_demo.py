@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+分账对账演示
+文件名: split_reconcile_demo.py
+功能: 核对本地已标记分账成功(IS_FZ_REQUEST='Y')的明细在平台上确实存在且金额一致:
+    1. 流式读取本地明细（分账流水号 FZ_REQUESTBACK_NO、各分账目标金额）
+    2. 并发调用 bkfunds.balance.pay.query 查询平台当前状态（不使用终态缓存，受接口限流控制）
+    3. 按规范化流水号哈希分区比对，差异写入运行数据目录 reconcile/ 下的分区差异文件
+    比对规则:
+    - 本地期望状态取自分账结果查询的回写 FZ_EXECUTE_RESULT: Y(已确认成功)和未确认的明细期望平台状态为成功(1)，
+      N(已确认失败)的明细期望平台状态不是成功
+    - 平台状态为处理中(9)的记为无法确认，不算不一致
+    - 平台交易金额须等于该明细某个分账目标的金额（一条明细有多个分账目标时，本地只回写了其中第一笔成功的流水号）
+    本地申请成功但没有流水号的明细直接记为平台缺失。
+接口: bkfunds.balance.pay.query
+"""
+
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.OraclePool import pooled_connection
+from common.LogPipeline import route_logger
+from common.Reconciler import Reconciler
+from config import Config
+from request.SplitQueryRequest import BalancePayQueryRequestHandler
+
+
+class SplitReconcileDemo:
+    """分账对账演示类"""
+
+    _LOCAL_SQL = """
+        SELECT dt.billid, dt.xpbillid, dt.FZ_REQUESTBACK_NO, dt.gs_fzmoney, dt.jms_fzmoney, dt.sourcemoney,
+               dt.FZ_EXECUTE_RESULT
+        FROM P_BL_SELL_PAYAMOUNT_HZ_dt dt
+        WHERE dt.IS_FZ_REQUEST = 'Y'
+        AND dt.cancelsign = 'N'
+    """
+
+    # 本地期望状态（由 FZ_EXECUTE_RESULT 推导）
+    EXPECT_SUCCESS = 'success'  # 已确认成功
+    EXPECT_FAILED = 'failed'  # 已确认失败
+    EXPECT_UNCONFIRMED = 'unconfirmed'  # 申请已受理，结果尚未查询确认
+
+    # 平台状态: 成功、处理中
+    PLATFORM_SUCCESS = '1'
+    PLATFORM_PROCESSING = '9'
+
+    def __init__(self, logger=None):
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger('SplitReconcile')
+            if not self.logger.handlers:
+                handler = logging.StreamHandler()
+                formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+                handler.setFormatter(formatter)
+                self.logger.addHandler(handler)
+                self.logger.setLevel(logging.INFO)
+        # 日志经异步管道输出，不阻塞业务线程
+        route_logger(self.logger)
+
+        self.reconcile_config = Config.get_reconcile_config()
+        self.query_handler = BalancePayQueryRequestHandler(self.logger)
+
+    @staticmethod
+    def _to_fen(value):
+        return int(round(float(value) * 100)) if value else 0
+
+    def stream_local_records(self, lookback_days=None):
+        """
+        流式读取本地已分账明细
+        :return: 迭代器，产出 (规范化流水号, {'billid', 'xpbillid', 'expect', 'amounts'})
+        """
+        if lookback_days is None:
+            lookback_days = self.reconcile_config.get('LOOKBACK_DAYS', 7)
+        sql = self._LOCAL_SQL
+        params = {}
+        if lookback_days:
+            sql += "        AND dt.FZ_REQUEST_TIME >= :since\n"
+            params['since'] = datetime.now() - timedelta(days=lookback_days)
+
+        with pooled_connection(self.logger) as connection:
+            cursor = connection.cursor()
+            cursor.arraysize = self.reconcile_config.get('FETCH_SIZE', 1000)
+            try:
+                cursor.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany()
+                    if not rows:
+                        break
+                    for billid, xpbillid, trade_no, gs_money, jms_money, source_money, result in rows:
+                        amounts = sorted({self._to_fen(money) for money in (gs_money, jms_money, source_money)} - {0})
+                        trade_no = (trade_no or '').strip()
+                        if not trade_no:
+                            # 没有流水号的记录用单据号做键，平台查询时直接判为缺失
+                            trade_no = f"NO_TRADE_NO:{billid}:{xpbillid}"
+                        yield trade_no, {'billid': billid, 'xpbillid': xpbillid,
+                                         'expect': self._expected_status(result), 'amounts': amounts}
+            finally:
+                cursor.close()
+
+    @classmethod
+    def _expected_status(cls, execute_result):
+        result = (execute_result or '').strip().upper()
+        if result == 'Y':
+            return cls.EXPECT_SUCCESS
+        if result == 'N':
+            return cls.EXPECT_FAILED
+        return cls.EXPECT_UNCONFIRMED
+
+    def fetch_platform_record(self, trade_no, local_fields):
+        """查询平台记录，返回规范化字段；平台不存在返回None；查询失败抛出异常"""
+        if trade_no.startswith('NO_TRADE_NO:'):
+            return None
+        response = self.query_handler.query_balance_pay_result(trade_no, use_cache=False)
+        if not response.is_success():
+            raise Exception(response.get_error_message())
+        if not response.data:
+            return None
+        if response.data.status == self.PLATFORM_PROCESSING:
+            raise Exception('平台处理中，结果未定')
+        return {'status': response.data.status, 'amount': int(response.data.total_amount or 0),
+                'payer_merchant_id': response.data.payer_merchant_id,
+                'payee_merchant_id': response.data.payee_merchant_id}
+
+    @classmethod
+    def compare(cls, local_fields, remote_fields):
+        """返回不一致的字段名列表"""
+        differences = []
+        platform_success = remote_fields['status'] == cls.PLATFORM_SUCCESS
+        if platform_success == (local_fields['expect'] == cls.EXPECT_FAILED):
+            differences.append('status')
+        if remote_fields['amount'] not in local_fields['amounts']:
+            differences.append('amount')
+        return differences
+
+    def reconcile(self, lookback_days=None):
+        """执行分账对账，返回汇总"""
+        reconciler = Reconciler('split',
+                                partitions=self.reconcile_config.get('PARTITIONS', 64),
+                                workers=self.reconcile_config.get('WORKERS', 8),
+                                logger=self.logger)
+        return reconciler.run(self.stream_local_records(lookback_days),
+                              self.fetch_platform_record,
+                              self.compare)
+
+
+# ===== 主函数和调用示例 =====
+def run_demo():
+    """运行演示程序"""
+    print("🔎 MUMUSO分账对账")
+    print("=" * 80)
+
+    ready, msg = Config.is_config_ready()
+    if not ready:
+        print(f"⚠️ 配置检查失败: {msg}")
+        return False
+
+    summary = SplitReconcileDemo().reconcile()
+    differences = summary['differences']
+    print(f"\n🎉 对账完成: 共 {summary['rows']} 条，一致 {summary['consistent']} 条，"
+          f"平台缺失 {differences['missing']} 条，不一致 {differences['mismatch']} 条，"
+          f"无法确认 {differences['unverified']} 条")
+    print(f"📁 差异文件: {summary['output_dir']}")
+    return True
+
+
+if __name__ == '__main__':
+    try:
+        run_demo()
+    except KeyboardInterrupt:
+        print("\n👋 程序退出")
+    except Exception as e:
+        print(f"❌ 程序异常: {str(e)}")
@@ -26,7 +26,13 @@ try:
 except ImportError:
     cx_Oracle = None
 
-from common.OpenClient import OpenClient
+from common.OpenClient import OpenClient, enable_debug_logging
+from common.LogPipeline import route_logger
+from common.IdempotencyLedger import get_idempotency_ledger
+from common.DeadLetter import DeadLetterStore, get_dead_letter_store
+from common.SqlStats import instrument_connection
+from common.BalanceCache import invalidate_merchant_balance
+from common.Priority import PriorityScorer
 from model.WithdrawModel import WithdrawModel
 from request.WithdrawRequest import WithdrawRequest
 from config import Config
@@ -36,6 +42,9 @@ from config_adapter import config_adapter
 class WithdrawDemo:
     """提现申请演示类 - GUI支持版本"""
 
+    # 死信队列的业务步骤名
+    DEAD_LETTER_STAGE = 'withdraw'
+
     def __init__(self, logger=None):
         self.config = Config
         self.client = OpenClient(Config.APP_ID, Config.PRIVATE_KEY, Config.get_url())
@@ -51,6 +60,16 @@ class WithdrawDemo:
                 handler.setFormatter(formatter)
                 self.logger.addHandler(handler)
                 self.logger.setLevel(logging.INFO)
+        # 日志经异步管道输出，不阻塞业务线程
+        route_logger(self.logger)
+        # DEBUG级别时输出开放平台请求参数和原始响应
+        enable_debug_logging(self.logger)
+
+        # 出站请求幂等台账（发送前检查，避免回写失败后重复提现）
+        self.ledger = get_idempotency_ledger(self.logger)
+
+        # 失败单据记入死信队列，由定时重试任务重新提现
+        self.dead_letters = get_dead_letter_store(self.logger)
 
         self.logger.info(f"[提现管理] 💰 提现申请系统初始化完成")
         self.logger.info(f"[提现管理] 🌍 当前环境: {Config.get_env_name()}")
@@ -64,15 +83,18 @@ class WithdrawDemo:
                 
             user, password, dsn = Config.get_db_connection_info()
             self.logger.info(f"[提现管理] 正在连接数据库: {dsn}")
-            connection = cx_Oracle.connect(user, password, dsn)
+            connection = instrument_connection(cx_Oracle.connect(user, password, dsn), self.logger)
             self.logger.info(f"[提现管理] ✅ 数据库连接成功: {dsn}")
             return connection
         except Exception as e:
             self.logger.error(f"[提现管理] ❌ 数据库连接失败: {str(e)}")
             return None
 
-    def get_withdraw_orders_from_database(self):
-        """从数据库获取待提现的订单信息（正式环境）"""
+    def get_withdraw_orders_from_database(self, merchant_id=None):
+        """
+        从数据库获取待提现的订单信息（正式环境）
+        :param merchant_id: 只查询该商户的待提现单，为空时查询全部
+        """
         connection = self.get_database_connection()
         if not connection:
             # 如果数据库连接失败，在测试环境返回模拟数据作为兜底
@@ -89,13 +111,20 @@ class WithdrawDemo:
             select BILLID, STOREID, MERCHANTNO, IS_UNPAID_FEE, WITHDRAW_AMOUNT, 
                    AVAILABLE_FEE, TRANSACTION_NO, WITHDRAW_TIME, SERVICE_FEE  
             from p_bl_draw_hd
-            where AVAILABLE_FEE>=WITHDRAW_AMOUNT and IS_UNPAID_FEE='Y' and cancelsign='N' and status='003'
+            where CASE WHEN IS_UNPAID_FEE = 'Y' AND STATUS = '003' AND CANCELSIGN = 'N' THEN 'Y' END = 'Y'
+            and AVAILABLE_FEE>=WITHDRAW_AMOUNT
             """
+            params = {}
+            if merchant_id is not None:
+                sql += """
+            and MERCHANTNO = :merchantno
+            """
+                params['merchantno'] = str(merchant_id)
 
             self.logger.info(f"[提现管理] 🔍 执行批量提现查询SQL:")
             self.logger.info(f"[提现管理] {sql}")
 
-            cursor.execute(sql)
+            cursor.execute(sql, params)
             rows = cursor.fetchall()
 
             self.logger.info(f"[提现管理] 📊 数据库查询结果: 共找到 {len(rows)} 条待提现记录")
@@ -387,16 +416,26 @@ class WithdrawDemo:
         self.logger.info(f"[提现管理] " + "=" * 60)
 
         try:
-            self.logger.info(f"[提现管理] 📄 执行提现申请...")
+            record = self._ledger_lookup(order_data)
+            if record:
+                # 已成功提现过的单据直接复用上次结果，只补做数据库回写
+                response = None
+                success, msg, request_id, trade_no = True, '已成功提现(幂等台账)', record['request_no'], record['trade_no']
+            else:
+                self.logger.info(f"[提现管理] 📄 执行提现申请...")
 
-            # 创建提现请求
-            request = self.create_withdraw_request(order_data)
+                # 创建提现请求
+                request = self.create_withdraw_request(order_data)
 
-            # 执行提现请求
-            response = self.execute_withdraw_request(request, order_data)
+                # 执行提现请求
+                response = self.execute_withdraw_request(request, order_data)
 
-            # 处理响应
-            success, msg, request_id, trade_no = self._handle_withdraw_response(response)
+                # 处理响应
+                success, msg, request_id, trade_no = self._handle_withdraw_response(response)
+                if success:
+                    self._ledger_record(order_data, request_id, trade_no)
+                    # 商户余额已变动，丢弃缓存的余额
+                    invalidate_merchant_balance(order_data['merchantno'])
 
             result = {
                 'billid': order_data['billid'],
@@ -417,12 +456,17 @@ class WithdrawDemo:
                 update_success = self.update_withdraw_status(order_data['billid'], True, request_id, trade_no)
                 if update_success:
                     self.logger.info(f"[提现管理] ✅ 提现状态更新成功")
+                    if self.dead_letters:
+                        self.dead_letters.resolve(self.DEAD_LETTER_STAGE, order_data['billid'])
                 else:
                     self.logger.error(f"[提现管理] ❌ 提现状态更新失败")
+                    self._dead_letter(order_data, DeadLetterStore.WRITEBACK, f"数据库回写失败 (trade_no: {trade_no})")
+                result['writeback'] = update_success
             else:
                 self.logger.error(f"[提现管理] ❌ 提现申请失败: {msg}")
                 # 更新数据库状态为失败
                 self.update_withdraw_status(order_data['billid'], False, request_id, trade_no)
+                self._dead_letter(order_data, DeadLetterStore.BUSINESS, msg)
 
             return result
 
@@ -445,8 +489,30 @@ class WithdrawDemo:
             
             # 更新数据库状态为失败
             self.update_withdraw_status(order_data['billid'], False, None, None)
+            self._dead_letter(order_data, DeadLetterStore.EXCEPTION, str(e))
             return result
 
+    def _dead_letter(self, order_data, failure_class, error):
+        """失败单据记入死信队列"""
+        if self.dead_letters:
+            self.dead_letters.add(self.DEAD_LETTER_STAGE, order_data['billid'], order_data, failure_class, error)
+
+    def _ledger_lookup(self, order_data):
+        """查询幂等台账，返回该提现单据上次成功的记录，未提现过返回None"""
+        if not self.ledger:
+            return None
+        record = self.ledger.get(WithdrawRequest().get_method(), order_data['billid'], order_data['merchantno'])
+        if record:
+            self.logger.warning(f"[提现管理] ♻️ 提现单据 {order_data['billid']} 已于 {record['create_time']} 成功提现"
+                                f"(交易号: {record['trade_no']})，跳过发送，仅补做数据库回写")
+        return record
+
+    def _ledger_record(self, order_data, request_id, trade_no):
+        """提现成功后记入幂等台账"""
+        if self.ledger:
+            self.ledger.put(WithdrawRequest().get_method(), order_data['billid'], order_data['merchantno'],
+                            request_no=request_id, trade_no=trade_no)
+
     def withdraw_single_order_by_billid(self, billid):
         """根据billid对单个订单进行提现申请"""
         self.logger.info(f"[提现管理] " + "=" * 60)
@@ -471,8 +537,14 @@ class WithdrawDemo:
         self.logger.info(f"[提现管理] 🚀 开始批量提现申请处理")
         self.logger.info(f"[提现管理] 🌍 当前环境: {Config.get_env_name()}")
 
-        # 获取待提现订单
+        # 获取待提现订单，按优先级排序
         orders = self.get_withdraw_orders_from_database()
+        scorer = PriorityScorer.from_config(self.logger)
+        if scorer and orders:
+            orders, _ = scorer.order(orders,
+                                     amount=lambda order: order['withdraw_amount'],
+                                     merchant=lambda order: order['merchantno'],
+                                     label='提现申请')
 
         if not orders:
             self.logger.warning(f"[提现管理] ⚠️ 没有找到待提现的订单")